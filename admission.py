@@ -0,0 +1,183 @@
+"""
+Контроль допуска к генерации: ограниченная очередь с приоритетами и быстрый отказ
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from metrics import count_admission, observe_stage
+
+# Полосы в порядке приоритета и длина очереди каждой: операторы Битрикс24 раньше виджета,
+# фоновые генерации (конспекты истории) — только когда ответам пациентов ничего не мешает
+DEFAULT_LANES = (("operator", 16), ("widget", 32), ("background", 4))
+
+
+class AdmissionRejected(RuntimeError):
+    """Очередь полосы заполнена или ожидание дольше допустимого: ответить 429"""
+
+    def __init__(self, message: str, retry_after: int, lane: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.lane = lane
+
+
+class AdmissionController:
+    """Допуск запросов к LLM: не больше max_active одновременно, остальные ждут в очереди
+
+    Очередь разбита на полосы с приоритетами: освободившийся слот получает первый
+    в самой приоритетной непустой полосе, внутри полосы — по порядку. Ожидаемое
+    время ожидания оценивается по числу запросов впереди и среднему времени
+    генерации. Если очередь полосы полна или ожидание превысит max_wait_seconds,
+    запрос сразу получает отказ с рекомендуемым Retry-After: при перегрузке
+    допущенные запросы сохраняют стабильную задержку, а не стареют все вместе.
+    """
+
+    def __init__(self, max_active: int, lanes: Sequence[Tuple[str, int]] = DEFAULT_LANES,
+                 max_wait_seconds: float = 20.0, initial_service_seconds: float = 8.0):
+        self.max_active = max(max_active, 1)
+        self.lanes = [lane for lane, _ in lanes]
+        self.queue_limits = dict(lanes)
+        self.max_wait_seconds = max_wait_seconds
+        # Среднее время генерации (экспоненциальное сглаживание) для оценки ожидания
+        self.service_seconds = initial_service_seconds
+
+        self._condition = threading.Condition()
+        self._queues: Dict[str, deque] = {lane: deque() for lane in self.lanes}
+        self._active = 0
+        self.stats = {lane: {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_wait": 0, "timeouts": 0}
+                      for lane in self.lanes}
+
+    def _lane(self, lane: str) -> str:
+        # Неизвестная полоса — наименьший приоритет
+        return lane if lane in self._queues else self.lanes[-1]
+
+    def _ahead(self, lane: str) -> int:
+        """Сколько запросов в очереди будет впереди нового запроса полосы lane"""
+        priority = self.lanes.index(lane)
+        return sum(len(self._queues[name]) for name in self.lanes[:priority + 1])
+
+    def _next_ticket(self) -> Optional[object]:
+        for lane in self.lanes:
+            if self._queues[lane]:
+                return self._queues[lane][0]
+        return None
+
+    def estimate_wait(self, lane: str = "widget") -> float:
+        """Ожидаемое время ожидания слота (секунды) для нового запроса полосы"""
+        with self._condition:
+            return self._estimate_wait(self._lane(lane))
+
+    def _estimate_wait(self, lane: str) -> float:
+        # Новый запрос получит слот, когда завершатся генерации, занимающие слоты
+        # сейчас и отданные впереди стоящим; слоты освобождаются параллельно
+        waiting_for = self._active + self._ahead(lane) + 1 - self.max_active
+        if waiting_for <= 0:
+            return 0.0
+        return math.ceil(waiting_for / self.max_active) * self.service_seconds
+
+    def _reject(self, lane: str, reason: str, wait: float) -> AdmissionRejected:
+        self.stats[lane][reason] += 1
+        count_admission(lane, reason)
+        retry_after = max(int(math.ceil(wait)), 1)
+        return AdmissionRejected(f"Сервер перегружен, повторите через {retry_after} с", retry_after, lane)
+
+    def _enter(self, lane: str, timeout: Optional[float]) -> float:
+        """Занять слот или дождаться его; возвращает время ожидания"""
+        limit = self.max_wait_seconds if timeout is None else min(timeout, self.max_wait_seconds)
+        with self._condition:
+            if self._active < self.max_active and self._next_ticket() is None:
+                self._active += 1
+                self.stats[lane]["admitted"] += 1
+                count_admission(lane, "admitted")
+                return 0.0
+
+            if len(self._queues[lane]) >= self.queue_limits[lane]:
+                raise self._reject(lane, "rejected_full", self._estimate_wait(lane))
+            wait = self._estimate_wait(lane)
+            if wait > limit:
+                raise self._reject(lane, "rejected_wait", wait)
+
+            ticket = object()
+            self._queues[lane].append(ticket)
+            self.stats[lane]["queued"] += 1
+            started = time.monotonic()
+            deadline = started + limit
+            while self._active >= self.max_active or self._next_ticket() is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queues[lane].remove(ticket)
+                    self._condition.notify_all()
+                    raise self._reject(lane, "timeouts", self._estimate_wait(lane))
+                self._condition.wait(remaining)
+
+            self._queues[lane].popleft()
+            self._active += 1
+            self.stats[lane]["admitted"] += 1
+            count_admission(lane, "admitted")
+            # Следующий в очереди может получить еще свободный слот
+            self._condition.notify_all()
+            return time.monotonic() - started
+
+    def _leave(self, service_seconds: float):
+        with self._condition:
+            self._active -= 1
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * service_seconds
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, lane: str = "widget", timeout: Optional[float] = None) -> Iterator[float]:
+        """Слот генерации на время блока; отдает время ожидания в очереди
+
+        Бросает AdmissionRejected, если очередь полосы заполнена или слот не
+        освободится за min(timeout, max_wait_seconds).
+        """
+        lane = self._lane(lane)
+        waited = self._enter(lane, timeout)
+        observe_stage("admission_wait", waited)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self._leave(time.monotonic() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "max_active": self.max_active,
+                "active": self._active,
+                "queued": {lane: len(queue) for lane, queue in self._queues.items()},
+                "estimated_wait_seconds": {lane: self._estimate_wait(lane) for lane in self.lanes},
+                "service_seconds": round(self.service_seconds, 2),
+                "lanes": {lane: dict(stats) for lane, stats in self.stats.items()}
+            }
+
+
+_shared_controller: Optional[AdmissionController] = None
+_shared_lock = threading.Lock()
+
+
+def get_admission_controller(capacity: Optional[int] = None) -> AdmissionController:
+    """Общий для процесса контроллер допуска
+
+    ADMISSION_MAX_ACTIVE — одновременных генераций в процессе (по умолчанию
+    capacity — суммарный лимит серверов пула), ADMISSION_QUEUE_OPERATOR,
+    ADMISSION_QUEUE_WIDGET и ADMISSION_QUEUE_BACKGROUND — длины очередей полос, ADMISSION_MAX_WAIT — предел
+    ожидания в секундах (меньше таймаутов gunicorn и nginx).
+    """
+    global _shared_controller
+    with _shared_lock:
+        if _shared_controller is None:
+            max_active = int(os.getenv("ADMISSION_MAX_ACTIVE", "0")) or capacity or 4
+            lanes = tuple(
+                (lane, int(os.getenv(f"ADMISSION_QUEUE_{lane.upper()}", str(limit))))
+                for lane, limit in DEFAULT_LANES
+            )
+            _shared_controller = AdmissionController(
+                max_active, lanes, max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT", "20"))
+            )
+        return _shared_controller
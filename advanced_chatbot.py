@@ -5,13 +5,18 @@ import os
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from system_prompts import SYSTEM_PROMPTS, get_prompt, list_available_prompts, get_prompt_name
+from model_registry import get_model_registry
+from history_compactor import HistoryCompactor
 
 class AdvancedLocalChatBot:
     def __init__(self, base_url: str = "http://localhost:1234"):
         self.base_url = base_url
         self.api_url = f"{base_url}/v1/chat/completions"
         self.model = None
+        self.model_registry = get_model_registry(base_url)
         self.conversation_history = []
+        # Старые реплики сворачиваются в краткое содержание, жесткий предел — 40 сообщений
+        self.history_compactor = HistoryCompactor(self.api_url, lambda: self.model, hard_limit=40)
         self.current_prompt_key = "general_assistant"
         self.current_prompt = get_prompt(self.current_prompt_key)
         self.conversations_dir = "conversations"
@@ -22,30 +27,19 @@ class AdvancedLocalChatBot:
     
     def check_connection(self) -> bool:
         """Проверка подключения к LM Studio"""
-        try:
-            response = requests.get(f"{self.base_url}/v1/models", timeout=5)
-            if response.status_code == 200:
-                models = response.json()
-                if models.get('data'):
-                    self.model = models['data'][0]['id']
-                    print(f"✅ Подключено к LM Studio")
-                    print(f"📋 Доступная модель: {self.model}")
-                    return True
-                else:
-                    print("⚠️ Нет доступных моделей")
-                    return False
-            else:
-                print(f"❌ Ошибка подключения: {response.status_code}")
-                return False
-        except requests.exceptions.ConnectionError:
-            print("❌ Не удалось подключиться к LM Studio")
+        # Сервер опрашивается в обход кэша: закэшированный список не означает, что LM Studio доступен
+        models = self.model_registry.refresh()
+        if self.model_registry.last_error:
+            print(f"❌ {self.model_registry.last_error}")
             print("Убедитесь, что LM Studio запущен и сервер активен")
             return False
-        except requests.exceptions.Timeout:
-            print("❌ Превышено время ожидания подключения")
-            return False
-        except Exception as e:
-            print(f"❌ Неожиданная ошибка: {str(e)}")
+        elif models:
+            self.model = self.model_registry.get_default_model() or models[0]
+            print(f"✅ Подключено к LM Studio")
+            print(f"📋 Доступная модель: {self.model}")
+            return True
+        else:
+            print("⚠️ Нет доступных моделей")
             return False
     
     def set_system_prompt(self, prompt_key: str):
@@ -68,7 +62,9 @@ class AdvancedLocalChatBot:
         messages = []
         
         if use_system_prompt and self.current_prompt:
-            messages.append({"role": "system", "content": self.current_prompt})
+            messages.append({"role": "system", "content": self.current_prompt + self.history_compactor.summary_block()})
+        elif self.history_compactor.summary:
+            messages.append({"role": "system", "content": self.history_compactor.summary_block().strip()})
         
         # Добавление истории разговора
         messages.extend(self.conversation_history)
@@ -103,9 +99,8 @@ class AdvancedLocalChatBot:
                 self.conversation_history.append({"role": "user", "content": message})
                 self.conversation_history.append({"role": "assistant", "content": assistant_message})
                 
-                # Ограничение истории (последние 20 сообщений)
-                if len(self.conversation_history) > 40:
-                    self.conversation_history = self.conversation_history[-40:]
+                # Старые сообщения сворачиваются в фоне; при недоступности модели история обрезается до 40
+                self.history_compactor.maybe_compact(self.conversation_history)
                 
                 return assistant_message
             else:
@@ -119,6 +114,7 @@ class AdvancedLocalChatBot:
     def clear_history(self):
         """Очистка истории разговора"""
         self.conversation_history = []
+        self.history_compactor.reset()
         print("🗑️ История разговора очищена")
     
     def save_conversation(self, filename: str = None):
@@ -136,7 +132,8 @@ class AdvancedLocalChatBot:
                     "name": get_prompt_name(self.current_prompt_key),
                     "content": self.current_prompt
                 },
-                "history": self.conversation_history
+                "history": self.conversation_history,
+                "history_summary": self.history_compactor.summary
             }
             
             with open(filename, 'w', encoding='utf-8') as f:
@@ -154,6 +151,7 @@ class AdvancedLocalChatBot:
                 conversation_data = json.load(f)
             
             self.conversation_history = conversation_data.get("history", [])
+            self.history_compactor.restore(conversation_data.get("history_summary", ""))
             if "system_prompt" in conversation_data:
                 prompt_key = conversation_data["system_prompt"].get("key", "general_assistant")
                 self.set_system_prompt(prompt_key)
@@ -201,6 +199,8 @@ class AdvancedLocalChatBot:
         print(f"   Текущий режим: {get_prompt_name(self.current_prompt_key)}")
         print(f"   История: {len(self.conversation_history)} сообщений")
         print(f"   Модель: {self.model or 'Не подключена'}")
+        if self.history_compactor.summary:
+            print(f"   Свернуто в краткое содержание: {self.history_compactor.summarized_messages} сообщений")
         
         if self.conversation_history:
             user_messages = len([m for m in self.conversation_history if m["role"] == "user"])
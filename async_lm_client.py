@@ -0,0 +1,344 @@
+"""
+Асинхронный клиент LM Studio (OpenAI-совместимый API) на стандартных asyncio streams
+
+Самостоятельный клиент для скриптов и сервисов на asyncio; веб-сервер и консольные
+чатботы работают через синхронный пул llm_pool.
+"""
+
+import asyncio
+import json
+import logging
+import ssl
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class _ProcessLimiter:
+    """Лимит параллельных запросов, общий для всех event loop и потоков процесса
+
+    asyncio.Semaphore привязан к одному loop, а клиент из get_async_client общий
+    для процесса: с семафором на каждый loop к серверу уходило бы
+    max_concurrency × число loop запросов. Ожидающие — futures своих loop, слот
+    передается им через call_soon_threadsafe.
+    """
+
+    def __init__(self, limit: int):
+        self._lock = threading.Lock()
+        self._limit = max(1, limit)
+        self.active = 0
+        self._waiters: deque = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: int):
+        with self._lock:
+            self._limit = max(1, value)
+            self._wake_locked()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self._limit and not self._waiters:
+                self.active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # Слот уже передан: отмененная future вернет его в _grant,
+            # а выданный, но не полученный — возвращаем здесь
+            if waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            self._wake_locked()
+
+    def _wake_locked(self):
+        while self._waiters and self.active < self._limit:
+            loop, future = self._waiters.popleft()
+            self.active += 1
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # Loop ожидающего уже закрыт
+                self.active -= 1
+
+    def _grant(self, future: asyncio.Future):
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class AsyncLMStudioClient:
+    """Асинхронный клиент для /v1/embeddings и /v1/chat/completions с ограничением параллелизма"""
+
+    def __init__(self, base_url: str = "http://localhost:1234", max_concurrency: int = 8,
+                 timeout: float = 120.0, stream_idle_timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # Наибольшая пауза между порциями потокового ответа: зависший сервер не держит слот вечно
+        self.stream_idle_timeout = stream_idle_timeout
+
+        parts = urlsplit(self.base_url)
+        self.host = parts.hostname or "localhost"
+        self.use_ssl = parts.scheme == "https"
+        self.port = parts.port or (443 if self.use_ssl else 80)
+        self.path_prefix = parts.path.rstrip("/")
+
+        self.semaphore = _ProcessLimiter(max_concurrency)
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.semaphore.limit
+
+    @max_concurrency.setter
+    def max_concurrency(self, value: int):
+        self.semaphore.limit = value
+
+    @property
+    def in_flight(self) -> int:
+        """Запросов, занявших слот (во всех event loop процесса)"""
+        return self.semaphore.active
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        return await asyncio.open_connection(self.host, self.port, ssl=ssl_context)
+
+    async def _send_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str,
+                            path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, str]]:
+        """Отправить запрос в открытое соединение и прочитать заголовки ответа
+
+        Соединение закрывает вызывающий код: LM Studio без stream присылает
+        заголовки только после всей генерации, и отмена во время ожидания должна
+        закрыть сокет, чтобы генерация прервалась.
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+        head = [
+            f"{method} {self.path_prefix}{path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Accept: application/json, text/event-stream",
+            "Connection: close",
+        ]
+        if payload is not None:
+            head.append("Content-Type: application/json")
+            head.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Сервер закрыл соединение без ответа")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        return status, headers
+
+    @staticmethod
+    async def _iter_body(reader: asyncio.StreamReader, headers: Dict[str, str],
+                         idle_timeout: Optional[float] = None) -> AsyncIterator[bytes]:
+        """Итерироваться по телу ответа с учетом chunked/Content-Length
+
+        idle_timeout ограничивает каждое чтение: молчащий дольше сервер дает
+        asyncio.TimeoutError, оборванный посреди порции ответ — ConnectionError.
+        """
+        async def read(operation):
+            try:
+                return await asyncio.wait_for(operation, idle_timeout)
+            except asyncio.IncompleteReadError as e:
+                raise ConnectionError("Сервер оборвал соединение посреди ответа") from e
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await read(reader.readline())
+                if not size_line:
+                    raise ConnectionError("Сервер оборвал соединение посреди ответа")
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    await read(reader.readline())
+                    return
+                yield await read(reader.readexactly(size))
+                await read(reader.readexactly(2))
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                chunk = await read(reader.read(min(remaining, 65536)))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            while True:
+                chunk = await read(reader.read(65536))
+                if not chunk:
+                    return
+                yield chunk
+
+    async def _request_json(self, method: str, path: str,
+                            payload: Optional[Dict[str, Any]] = None) -> Tuple[int, Any]:
+        """Выполнить запрос под семафором и вернуть (status, json)"""
+        async with self.semaphore:
+            async def _do():
+                reader, writer = await self._connect()
+                try:
+                    status, headers = await self._send_request(reader, writer, method, path, payload)
+                    raw = b"".join([chunk async for chunk in self._iter_body(reader, headers)])
+                finally:
+                    # Закрытие сокета при отмене или таймауте обрывает запрос к LM Studio
+                    writer.close()
+                try:
+                    return status, json.loads(raw.decode("utf-8")) if raw else None
+                except ValueError:
+                    return status, raw.decode("utf-8", errors="replace")
+
+            return await asyncio.wait_for(_do(), self.timeout)
+
+    async def get_available_models(self) -> List[str]:
+        """Получить список доступных моделей"""
+        try:
+            status, data = await self._request_json("GET", "/v1/models")
+            if status == 200 and isinstance(data, dict):
+                return [model["id"] for model in data.get("data", [])]
+            logger.error("Ошибка при получении списка моделей: %s", status)
+            return []
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("Ошибка при подключении к LM Studio: %s", e)
+            return []
+
+    async def get_embeddings_batch(self, texts: List[str], model: str = None) -> List[Optional[List[float]]]:
+        """Получить эмбеддинги для списка текстов одним запросом"""
+        if not texts:
+            return []
+        payload = {
+            "input": texts,
+            "model": model or "text-embedding-ada-002"
+        }
+        try:
+            status, data = await self._request_json("POST", "/v1/embeddings", payload)
+            if status == 200 and isinstance(data, dict):
+                embeddings: List[Optional[List[float]]] = [None] * len(texts)
+                for position, item in enumerate(data.get("data", [])):
+                    index = item.get("index", position)
+                    if not isinstance(index, int) or not 0 <= index < len(texts):
+                        logger.warning("Эмбеддинг с индексом %r вне пакета из %d текстов пропущен", index, len(texts))
+                        continue
+                    embeddings[index] = item.get("embedding")
+                return embeddings
+            logger.error("Ошибка при генерации эмбеддинга: %s", status)
+            return [None] * len(texts)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("Ошибка при генерации эмбеддинга: %s", e)
+            return [None] * len(texts)
+
+    async def get_embedding(self, text: str, model: str = None) -> Optional[List[float]]:
+        """Получить эмбеддинг для текста"""
+        return (await self.get_embeddings_batch([text], model))[0]
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str,
+                              temperature: float = 0.7, max_tokens: int = 2000) -> Optional[Dict[str, Any]]:
+        """Получить полный ответ модели (stream: false)"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        try:
+            status, data = await self._request_json("POST", "/v1/chat/completions", payload)
+            if status == 200 and isinstance(data, dict):
+                return data
+            logger.error("Ошибка: %s - %s", status, data)
+            return None
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("Ошибка при отправке сообщения: %s", e)
+            return None
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                     temperature: float = 0.7, max_tokens: int = 2000) -> AsyncIterator[str]:
+        """Получать ответ модели по токенам (stream: true, SSE)
+
+        Соединение и заголовки ограничены timeout, каждая следующая порция —
+        stream_idle_timeout (asyncio.TimeoutError); прерывание итерации или
+        отмена задачи закрывает сокет, и LM Studio прекращает генерацию.
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        async with self.semaphore:
+            reader, writer = await asyncio.wait_for(self._connect(), self.timeout)
+            try:
+                status, headers = await asyncio.wait_for(
+                    self._send_request(reader, writer, "POST", "/v1/chat/completions", payload), self.timeout
+                )
+                if status != 200:
+                    raise ConnectionError(f"LM Studio вернул статус {status}")
+
+                buffer = b""
+                async for chunk in self._iter_body(reader, headers, self.stream_idle_timeout):
+                    buffer += chunk
+                    while b"\n" in buffer:
+                        line, buffer = buffer.split(b"\n", 1)
+                        line = line.strip()
+                        if not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            return
+                        event = json.loads(data.decode("utf-8"))
+                        choices = event.get("choices") or [{}]
+                        delta = choices[0].get("delta", {}).get("content")
+                        if delta:
+                            yield delta
+            finally:
+                writer.close()
+
+
+_clients: Dict[str, AsyncLMStudioClient] = {}
+
+
+_clients_lock = threading.Lock()
+
+
+def get_async_client(base_url: str = "http://localhost:1234", max_concurrency: int = 8) -> AsyncLMStudioClient:
+    """Получить общий для процесса клиент для указанного сервера
+
+    Лимит параллельных запросов один на процесс; max_concurrency, отличный от
+    текущего, применяется к уже созданному клиенту.
+    """
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = AsyncLMStudioClient(base_url, max_concurrency=max_concurrency)
+        elif client.max_concurrency != max_concurrency:
+            logger.info("Лимит параллельных запросов к %s: %d → %d", base_url, client.max_concurrency, max_concurrency)
+            client.max_concurrency = max_concurrency
+    return client
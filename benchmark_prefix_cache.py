@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк переиспользования KV-кэша префикса для раскладок промпта (system / user)
+
+Разговор из нескольких ходов прогоняется через PromptBuilder с контекстом из базы
+знаний ВОККДЦ и отправляется в фейковый LM Studio, который моделирует prefill
+только для некэшированной части промпта. История сворачивается HistoryCompactor
+с теми же порогами, что в RAGChatBot. Для каждого хода выводятся общий префикс
+с предыдущим промптом, закэшированные сервером токены и время ответа.
+
+Примеры:
+    python benchmark_prefix_cache.py
+    python benchmark_prefix_cache.py --prefill-tokens-per-sec 300 --turns 12
+"""
+
+import argparse
+import time
+
+import requests
+
+from history_compactor import HistoryCompactor
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer, common_prefix_length, render_prompt
+from knowledge_base import DocumentProcessor
+from local_embeddings import LexicalIndex
+from prompt_builder import PromptBuilder
+from system_prompts import get_prompt
+
+QUESTIONS = [
+    "Где находится ВОККДЦ и как до него добраться?",
+    "Какой режим работы у поликлиники?",
+    "Сколько стоит МРТ головного мозга?",
+    "Нужно ли направление для записи к кардиологу?",
+    "Как подготовиться к УЗИ брюшной полости?",
+    "Можно ли сдать анализы в субботу?",
+    "Какой телефон call-центра?",
+    "Принимаете ли вы по полису ОМС?",
+    "Сколько стоит консультация невролога?",
+    "Где взять результаты анализов?",
+    "Есть ли в центре детское отделение?",
+    "Как отменить запись к врачу?",
+]
+
+
+def run_conversation(base_url: str, layout: str, index: LexicalIndex, turns: int, top_k: int):
+    """Прогнать разговор и вернуть построчную статистику по ходам"""
+    model = "fake-llama-3.2-3b-instruct"
+    compactor = HistoryCompactor(f"{base_url}/v1/chat/completions", lambda: model,
+                                 compact_threshold=10, keep_recent=4)
+    builder = PromptBuilder(layout=layout, max_history_messages=compactor.compact_threshold + 2)
+    system_prompt = get_prompt("general_assistant")
+    history = []
+    previous_prompt = ""
+    rows = []
+
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        chunks = [
+            f"[Документ {i + 1} (релевантность: {r['similarity']:.2f})]: {r['document'].content}"
+            for i, r in enumerate(index.search(question, top_k))
+        ]
+        prompt = builder.build(system_prompt, chunks, history, question, summary=compactor.summary_block())
+        rendered = render_prompt(prompt.messages)
+        overlap = common_prefix_length(previous_prompt, rendered) / len(rendered)
+        previous_prompt = rendered
+
+        started = time.perf_counter()
+        response = requests.post(f"{base_url}/v1/chat/completions", json={
+            "model": model,
+            "messages": prompt.messages,
+            "max_tokens": prompt.max_tokens
+        }, timeout=120)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        data = response.json()
+        usage = data["usage"]
+
+        rows.append({
+            "turn": turn + 1,
+            "prompt_tokens": usage["prompt_tokens"],
+            "cached_tokens": usage.get("prompt_tokens_details", {}).get("cached_tokens", 0),
+            "overlap": overlap,
+            "latency_ms": elapsed_ms
+        })
+        history.append({"role": "user", "content": question})
+        history.append({"role": "assistant", "content": data["choices"][0]["message"]["content"]})
+        # В чатботе сжатие идет в фоне между ходами; здесь дожидаемся его для воспроизводимости
+        if compactor.maybe_compact(history):
+            compactor.wait()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк раскладок промпта и KV-кэша префикса")
+    parser.add_argument("--kb-file", default="knowledge_base/vodc_complete_info.md")
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=500.0,
+                        help="Скорость prefill фейкового сервера (CPU/небольшой GPU: 200–1000)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Накладные расходы на запрос")
+    args = parser.parse_args()
+
+    documents = DocumentProcessor().process_file(args.kb_file)
+    if not documents:
+        print(f"❌ Не удалось загрузить {args.kb_file}")
+        return
+    index = LexicalIndex(documents)
+
+    config = FakeLMStudioConfig(
+        port=0,
+        latency_ms=args.latency_ms,
+        tokens_per_sec=0,
+        completion_tokens=48,
+        prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+        # Один активный разговор и запросы на сжатие истории
+        prefix_cache_slots=2
+    )
+
+    print(f"📊 {len(documents)} чанков из {args.kb_file}, ходов: {args.turns}, "
+          f"prefill: {args.prefill_tokens_per_sec:.0f} ток/с")
+    totals = {}
+    for layout in PromptBuilder.LAYOUTS:
+        server = FakeLMStudioServer(config).start()
+        try:
+            rows = run_conversation(server.base_url, layout, index, args.turns, args.top_k)
+        finally:
+            server.stop()
+
+        print(f"\nРаскладка '{layout}':")
+        print(f"{'ход':>4}{'промпт':>9}{'в кэше':>9}{'префикс':>10}{'мс':>9}")
+        for row in rows:
+            print(f"{row['turn']:>4}{row['prompt_tokens']:>9}{row['cached_tokens']:>9}"
+                  f"{row['overlap']:>9.0%}{row['latency_ms']:>10.0f}")
+        prompt_tokens = sum(r["prompt_tokens"] for r in rows)
+        cached_tokens = sum(r["cached_tokens"] for r in rows)
+        totals[layout] = {
+            "prefill_tokens": prompt_tokens - cached_tokens,
+            "cached_share": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "latency_ms": sum(r["latency_ms"] for r in rows) / len(rows)
+        }
+
+    print(f"\n{'раскладка':<10}{'prefill, ток.':>15}{'из кэша':>10}{'ср. мс':>10}")
+    for layout, total in totals.items():
+        print(f"{layout:<10}{total['prefill_tokens']:>15}{total['cached_share']:>10.0%}{total['latency_ms']:>10.0f}")
+    if totals["system"]["prefill_tokens"]:
+        saved = 1 - totals["user"]["prefill_tokens"] / totals["system"]["prefill_tokens"]
+        print(f"\n✅ Раскладка 'user' экономит {saved:.0%} токенов prefill")
+
+
+if __name__ == "__main__":
+    main()
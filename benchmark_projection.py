@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Отчет о компромиссе полнота/задержка для проекции эмбеддингов индекса (PCA и усечение)
+
+Примеры:
+    python benchmark_projection.py                       # синтетический корпус 20 000 x 1536
+    python benchmark_projection.py --store knowledge_base  # эмбеддинги из vector_store.json
+"""
+
+import argparse
+import time
+import numpy as np
+
+from knowledge_base import VectorStore
+from embedding_projection import EmbeddingProjection
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def synthetic_corpus(n_docs: int, dim: int, latent_dim: int, seed: int) -> np.ndarray:
+    """Корпус с низкоранговой структурой, как у узкой предметной области"""
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((latent_dim, dim), dtype=np.float32)
+    # Убывающий спектр: несколько сильных «тем» и длинный хвост
+    scales = (1.0 / np.arange(1, latent_dim + 1) ** 0.5).astype(np.float32)
+    latent = rng.standard_normal((n_docs, latent_dim), dtype=np.float32) * scales
+    noise = 0.05 * rng.standard_normal((n_docs, dim), dtype=np.float32)
+    return normalize(latent @ basis + noise)
+
+
+def make_queries(corpus: np.ndarray, n_queries: int, seed: int) -> np.ndarray:
+    """Запросы — зашумленные копии случайных документов"""
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, corpus.shape[0], n_queries)
+    noise = 0.5 * rng.standard_normal((n_queries, corpus.shape[1]), dtype=np.float32) / np.sqrt(corpus.shape[1])
+    return normalize(corpus[picks] + noise)
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = matrix @ query
+    k = min(k, scores.shape[0])
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def measure(matrix: np.ndarray, queries: np.ndarray, k: int, repeats: int = 3):
+    """Результаты top-k и среднее время одного поиска (мс)"""
+    results = [top_k(matrix, q, k) for q in queries]
+    best_time = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for q in queries:
+            top_k(matrix, q, k)
+        best_time = min(best_time, (time.perf_counter() - start) / len(queries))
+    return results, best_time * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк проекции эмбеддингов")
+    parser.add_argument("--store", help="Каталог с vector_store.json (по умолчанию — синтетический корпус)")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latent-dim", type=int, default=96)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--dims", default="32,64,128,256,512", help="Целевые размерности через запятую")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.store:
+        store = VectorStore(args.store)
+        store.projection = None
+        corpus, _ = store._raw_matrix()
+        if not len(corpus):
+            print(f"❌ В {args.store}/vector_store.json нет эмбеддингов")
+            return
+        source = f"{args.store}/vector_store.json"
+    else:
+        corpus = synthetic_corpus(args.docs, args.dim, args.latent_dim, args.seed)
+        source = f"синтетический корпус (латентная размерность {args.latent_dim})"
+
+    queries = make_queries(corpus, args.queries, args.seed)
+    k = args.top_k
+    exact, full_ms = measure(corpus, queries, k)
+
+    print(f"📊 Корпус: {source}: {corpus.shape[0]} x {corpus.shape[1]}, запросов: {len(queries)}, top-{k}")
+    print(f"{'метод':<10}{'размерн.':>10}{'recall@k':>10}{'мс/запрос':>12}{'ускорение':>11}{'память, МБ':>12}{'дисперсия':>11}")
+    print(f"{'full':<10}{corpus.shape[1]:>10}{1.0:>10.3f}{full_ms:>12.3f}{1.0:>10.1f}x{corpus.nbytes / 2**20:>12.1f}{'':>11}")
+
+    for method in EmbeddingProjection.METHODS:
+        for dim in [int(d) for d in args.dims.split(",")]:
+            projection = EmbeddingProjection(method, dim).fit(corpus)
+            projected = projection.transform(corpus)
+            projected_queries = projection.transform(queries)
+            approx, ms = measure(projected, projected_queries, k)
+            recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+            variance = f"{projection.explained_variance_ratio:.3f}" if projection.explained_variance_ratio else "-"
+            print(f"{method:<10}{projection.dim:>10}{recall:>10.3f}{ms:>12.3f}{full_ms / ms:>10.1f}x"
+                  f"{projected.nbytes / 2**20:>12.1f}{variance:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,35 +2,32 @@ import requests
 import json
 import time
 from typing import Optional, Dict, Any
+from model_registry import get_model_registry
 
 class LocalChatBot:
     def __init__(self, base_url: str = "http://localhost:1234"):
         self.base_url = base_url
         self.api_url = f"{base_url}/v1/chat/completions"
         self.model = None
+        self.model_registry = get_model_registry(base_url)
         self.conversation_history = []
         
     def check_connection(self) -> bool:
         """Проверка подключения к LM Studio"""
-        try:
-            response = requests.get(f"{self.base_url}/v1/models")
-            if response.status_code == 200:
-                models = response.json()
-                if models.get('data'):
-                    self.model = models['data'][0]['id']
-                    print(f"✅ Подключено к LM Studio")
-                    print(f"📋 Доступная модель: {self.model}")
-                    return True
-                else:
-                    print("⚠️ Нет доступных моделей")
-                    return False
-            else:
-                print(f"❌ Ошибка подключения: {response.status_code}")
-                return False
-        except requests.exceptions.ConnectionError:
-            print("❌ Не удалось подключиться к LM Studio")
+        # Сервер опрашивается в обход кэша: закэшированный список не означает, что LM Studio доступен
+        models = self.model_registry.refresh()
+        if self.model_registry.last_error:
+            print(f"❌ {self.model_registry.last_error}")
             print("Убедитесь, что LM Studio запущен и сервер активен")
             return False
+        elif models:
+            self.model = self.model_registry.get_default_model() or models[0]
+            print(f"✅ Подключено к LM Studio")
+            print(f"📋 Доступная модель: {self.model}")
+            return True
+        else:
+            print("⚠️ Нет доступных моделей")
+            return False
     
     def send_message(self, message: str, system_prompt: Optional[str] = None) -> str:
         """Отправка сообщения модели"""
@@ -1,5 +1,8 @@
 import requests
 import json
+import hashlib
+import random
+import numpy as np
 from typing import List, Optional
 
 class EmbeddingAPI:
@@ -52,12 +55,42 @@ class EmbeddingAPI:
             return None
     
     def get_embeddings_batch(self, texts: List[str], model: str = None) -> List[Optional[List[float]]]:
-        """Получить эмбеддинги для списка текстов"""
-        embeddings = []
-        for text in texts:
-            embedding = self.get_embedding(text, model)
-            embeddings.append(embedding)
-        return embeddings
+        """Получить эмбеддинги для списка текстов одним запросом (input — массив строк)
+
+        По одному тексту повторяет, только если сервер отверг массив (ответ 4xx).
+        Ошибки соединения и таймауты пробрасываются: запросы по одному к
+        недоступному серверу лишь умножили бы число ошибок.
+        """
+        if not texts:
+            return []
+        payload = {
+            "input": texts,
+            "model": model or "text-embedding-ada-002"
+        }
+        
+        response = requests.post(
+            self.embedding_endpoint,
+            json=payload,
+            headers={"Content-Type": "application/json"}
+        )
+        
+        if response.status_code == 200:
+            try:
+                items = sorted(response.json().get("data", []), key=lambda item: item.get("index", 0))
+            except (ValueError, AttributeError) as e:
+                print(f"Некорректный ответ при пакетной генерации эмбеддингов: {e}")
+                return [None] * len(texts)
+            embeddings = [item.get("embedding") for item in items]
+            if len(embeddings) == len(texts):
+                return embeddings
+            print(f"Сервер вернул {len(embeddings)} эмбеддингов вместо {len(texts)}")
+            return [None] * len(texts)
+        
+        print(f"Ошибка при пакетной генерации эмбеддингов: {response.status_code}")
+        if 400 <= response.status_code < 500:
+            # Сервер без поддержки пакетного input — по одному тексту
+            return [self.get_embedding(text, model) for text in texts]
+        return [None] * len(texts)
 
 class MockEmbeddingAPI:
     """Мок-API для тестирования без LM Studio"""
@@ -67,16 +100,14 @@ class MockEmbeddingAPI:
     
     def get_embedding(self, text: str) -> List[float]:
         """Генерирует мок-эмбеддинг на основе хэша текста"""
-        import hashlib
-        import random
-        
-        # Используем хэш текста как seed для генерации последовательности
+        # Используем хэш текста как seed для генерации последовательности.
+        # Локальный генератор не трогает глобальное состояние модуля random
         hash_obj = hashlib.md5(text.encode())
         seed = int(hash_obj.hexdigest(), 16)
-        random.seed(seed)
+        rng = random.Random(seed)
         
         # Генерируем эмбеддинг
-        embedding = [random.gauss(0, 1) for _ in range(self.embedding_dim)]
+        embedding = [rng.gauss(0, 1) for _ in range(self.embedding_dim)]
         
         # Нормализуем вектор
         norm = sum(x**2 for x in embedding) ** 0.5
@@ -87,4 +118,34 @@ class MockEmbeddingAPI:
     
     def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
         """Генерирует мок-эмбеддинги для списка текстов"""
-        return [self.get_embedding(text) for text in texts]
\ No newline at end of file
+        return [self.get_embedding(text) for text in texts]
+
+class FastMockEmbeddingAPI:
+    """Векторизованный детерминированный мок-API (NumPy, float32) для нагрузочного тестирования"""
+    
+    def __init__(self, embedding_dim: int = 1536):
+        self.embedding_dim = embedding_dim
+    
+    @staticmethod
+    def _generator(text: str) -> np.random.Generator:
+        """Собственный генератор для текста, засеянный его хэшем"""
+        seed = int(hashlib.md5(text.encode()).hexdigest(), 16)
+        return np.random.default_rng(seed)
+    
+    def get_embeddings_matrix(self, texts: List[str]) -> np.ndarray:
+        """Матрица эмбеддингов (len(texts) x embedding_dim, float32) с L2-нормализацией строк"""
+        matrix = np.empty((len(texts), self.embedding_dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            self._generator(text).standard_normal(dtype=np.float32, out=matrix[i])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+    
+    def get_embedding(self, text: str) -> List[float]:
+        """Генерирует мок-эмбеддинг на основе хэша текста"""
+        return self.get_embeddings_matrix([text])[0].tolist()
+    
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        """Генерирует мок-эмбеддинги для списка текстов"""
+        return self.get_embeddings_matrix(texts).tolist()
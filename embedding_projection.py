@@ -0,0 +1,91 @@
+"""
+Понижение размерности эмбеддингов для индекса базы знаний (PCA или усечение префикса)
+"""
+
+import numpy as np
+from typing import Dict, Any, Optional
+
+
+class EmbeddingProjection:
+    """Проекция эмбеддингов, обучаемая на корпусе и хранимая вместе с индексом
+
+    method="pca"      — центрирование и проекция на главные компоненты (SVD);
+    method="truncate" — первые dim координат (для Matryoshka-моделей).
+    Результат всегда L2-нормализован, поэтому косинус сводится к скалярному произведению.
+    """
+
+    METHODS = ("pca", "truncate")
+
+    def __init__(self, method: str = "pca", dim: int = 256):
+        if method not in self.METHODS:
+            raise ValueError(f"Неизвестный метод проекции: {method}")
+        self.method = method
+        self.dim = dim
+        self.input_dim: Optional[int] = None
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.explained_variance_ratio: Optional[float] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.input_dim is not None
+
+    def fit(self, embeddings: np.ndarray) -> "EmbeddingProjection":
+        """Обучить проекцию на матрице эмбеддингов корпуса (n_docs x input_dim)"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.input_dim = embeddings.shape[1]
+
+        if self.method == "truncate":
+            self.dim = min(self.dim, self.input_dim)
+            return self
+
+        self.mean = embeddings.mean(axis=0)
+        centered = embeddings - self.mean
+        # Компонент не может быть больше, чем документов в корпусе
+        _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+        self.dim = min(self.dim, vt.shape[0])
+        self.components = vt[:self.dim].astype(np.float32)
+        variance = singular_values ** 2
+        total = float(variance.sum())
+        self.explained_variance_ratio = float(variance[:self.dim].sum() / total) if total > 0 else 1.0
+        return self
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """Применить проекцию к матрице или одному вектору"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        single = embeddings.ndim == 1
+        if single:
+            embeddings = embeddings[None, :]
+
+        if self.method == "truncate":
+            projected = embeddings[:, :self.dim].copy()
+        else:
+            projected = (embeddings - self.mean) @ self.components.T
+
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        projected /= norms
+        return projected[0] if single else projected
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализация для vector_store.json"""
+        return {
+            "method": self.method,
+            "dim": self.dim,
+            "input_dim": self.input_dim,
+            "mean": self.mean.tolist() if self.mean is not None else None,
+            "components": self.components.tolist() if self.components is not None else None,
+            "explained_variance_ratio": self.explained_variance_ratio
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EmbeddingProjection":
+        """Восстановление из vector_store.json"""
+        projection = cls(data["method"], data["dim"])
+        projection.input_dim = data.get("input_dim")
+        if data.get("mean") is not None:
+            projection.mean = np.asarray(data["mean"], dtype=np.float32)
+        if data.get("components") is not None:
+            projection.components = np.asarray(data["components"], dtype=np.float32)
+        projection.explained_variance_ratio = data.get("explained_variance_ratio")
+        return projection
@@ -0,0 +1,250 @@
+"""
+Справочные таблицы (цены, адреса, телефоны), извлеченные из базы знаний ВОККДЦ
+"""
+
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from local_embeddings import HashingEmbeddingAPI
+
+# Раздел markdown → таблица
+FACT_SECTIONS = {
+    "Цены на популярные услуги": "prices",
+    "Режим работы и адреса": "locations",
+    "Контактная информация": "contacts",
+}
+
+FIELD_LABELS = {
+    "адрес": "address",
+    "режим работы": "hours",
+    "телефон": "phone",
+    "запись онлайн": "online",
+}
+
+FIELD_TITLES = {
+    "price": "",
+    "address": "адрес",
+    "hours": "режим работы",
+    "phone": "телефон",
+    "online": "запись онлайн",
+}
+
+# Слова вопроса → нужные таблицы и поля
+QUESTION_FIELDS: List[Tuple["re.Pattern", str, Tuple[str, ...]]] = [
+    (re.compile(r"цен|стои|прайс|руб|платн"), "prices", ("price",)),
+    # «номер» без «телефона» — номер полиса, талона, кабинета
+    (re.compile(r"телефон|позвонить|call"), "contacts", ("phone", "online")),
+    (re.compile(r"телефон|позвонить"), "locations", ("phone",)),
+    (re.compile(r"адрес|наход|расположен|добраться|корпус|филиал"), "locations", ("address", "hours")),
+    (re.compile(r"режим|часы|время работы|график|во сколько|до скольки|работает|работаете|открыт|суббот|выходн"),
+     "locations", ("hours", "address")),
+]
+
+# Прямой ответ из таблиц — только при уверенности не ниже этой
+ANSWER_MIN_CONFIDENCE = 0.5
+# Вопрос уточняет строку, но ни одна не совпала: вся таблица — лишь догадка (контекст для LLM)
+TABLE_GUESS_CONFIDENCE = 0.3
+
+STOP_WORDS = {
+    "сколько", "стоит", "стоимость", "цена", "цены", "какая", "какой", "какие", "где", "как", "в", "во", "на",
+    "у", "вас", "вы", "по", "и", "а", "ли", "за", "мне", "нужно", "можно", "подскажите", "скажите",
+    "пожалуйста", "воккдц", "центр", "центра", "центре", "рублей", "от", "это", "есть", "для",
+    # Слова, которые выбирают таблицу, а не строку в ней
+    "адрес", "адреса", "телефон", "телефона", "номер", "режим", "работы", "работает", "работаете",
+    "часы", "график", "время", "находится", "находитесь", "расположен", "позвонить",
+}
+
+_LABELED_RE = re.compile(r"^\*{0,2}([^:*]+?):\*{0,2}\s*(.+)$")
+_NUMBERED_RE = re.compile(r"^\d+\.\s+\*{0,2}(.+?)\*{0,2}\s*$")
+
+
+def _stems(text: str) -> Set[str]:
+    """Грубые основы слов: первые 5 букв, без служебных слов"""
+    words = HashingEmbeddingAPI.normalize_text(text).split()
+    return {word[:5] for word in words if word not in STOP_WORDS and len(word) > 1}
+
+
+@dataclass
+class FactRow:
+    """Строка справочной таблицы"""
+    table: str
+    key: str
+    category: str = ""
+    fields: Dict[str, str] = field(default_factory=dict)
+
+    def render(self, fields: Tuple[str, ...] = ()) -> str:
+        """Компактная строка «ключ: поле; поле»"""
+        names = [name for name in (fields or tuple(self.fields)) if name in self.fields]
+        parts = []
+        for name in names:
+            title = FIELD_TITLES.get(name, name)
+            parts.append(f"{title}: {self.fields[name]}" if title else self.fields[name])
+        return f"{self.key}: {'; '.join(parts)}" if parts else self.key
+
+
+class FactTables:
+    """Индексированные в памяти таблицы фактов из разделов vodc_complete_info.md
+
+    Цены (услуга → цена), адреса корпусов (корпус → адрес, режим работы, телефон)
+    и контакты заполняются при загрузке базы знаний. Поиск — по инвертированному
+    индексу основ слов, без эмбеддингов: ответ на справочный вопрос собирается за
+    микросекунды, а для сложных вопросов строки отдаются LLM как структурированный контекст.
+    """
+
+    TABLES = ("prices", "locations", "contacts")
+
+    def __init__(self, max_answer_words: int = 10):
+        self.max_answer_words = max_answer_words
+        self.rows: List[FactRow] = []
+        self._index: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "answered": 0, "context_rows": 0}
+
+    def parse_markdown(self, text: str) -> List[FactRow]:
+        """Извлечь строки таблиц из разделов FACT_SECTIONS"""
+        rows: List[FactRow] = []
+        table: Optional[str] = None
+        category = ""
+        current: Optional[FactRow] = None
+
+        for raw_line in text.splitlines():
+            line = raw_line.strip()
+            if line.startswith("## "):
+                table = FACT_SECTIONS.get(line[3:].strip())
+                category, current = "", None
+                continue
+            if table is None or not line:
+                continue
+            if line.startswith("### "):
+                category, current = line[4:].strip().rstrip(":"), None
+                continue
+
+            if table == "prices":
+                match = _LABELED_RE.match(line.lstrip("-• ").strip())
+                if match:
+                    rows.append(FactRow("prices", match.group(1).strip(), category,
+                                        {"price": match.group(2).strip()}))
+                continue
+
+            numbered = _NUMBERED_RE.match(line)
+            if numbered:
+                # «1. **ул. Фридриха Энгельса, 63**» — новый адрес в списке
+                current = FactRow(table, numbered.group(1).strip(), category,
+                                  {"address": numbered.group(1).strip()})
+                rows.append(current)
+                continue
+            match = _LABELED_RE.match(line.lstrip("-• ").strip())
+            if match:
+                label = match.group(1).strip().lower()
+                if current is None:
+                    current = FactRow(table, category, category)
+                    rows.append(current)
+                current.fields[FIELD_LABELS.get(label, label)] = match.group(2).strip()
+        return rows
+
+    def add_rows(self, rows: List[FactRow]):
+        with self._lock:
+            for row in rows:
+                row_id = len(self.rows)
+                self.rows.append(row)
+                for stem in _stems(f"{row.key} {row.category}"):
+                    self._index.setdefault(stem, set()).add(row_id)
+
+    def load_file(self, file_path: str) -> int:
+        """Заполнить таблицы из markdown-файла; возвращает число строк"""
+        if not os.path.exists(file_path):
+            print(f"Файл {file_path} не найден")
+            return 0
+        with open(file_path, "r", encoding="utf-8") as f:
+            rows = self.parse_markdown(f.read())
+        self.add_rows(rows)
+        return len(rows)
+
+    def find_rows(self, query: str, limit: int = 5) -> Tuple[List[Tuple[FactRow, Tuple[str, ...]]], float]:
+        """Строки, отвечающие на вопрос, с полями для показа, и уверенность (0..1)
+
+        Таблица выбирается по словам вопроса (цена, адрес, телефон, режим работы),
+        строки внутри нее — по совпадению основ слов с названием и категорией.
+        Если вопрос о таблице не уточняет строку (например, «режим работы»),
+        возвращаются все строки таблицы; если уточняет, но ни одна строка не
+        совпала, — тоже все, но с уверенностью ниже порога прямого ответа.
+        """
+        normalized = HashingEmbeddingAPI.normalize_text(query)
+        wanted: Dict[str, Tuple[str, ...]] = {}
+        for pattern, table, fields in QUESTION_FIELDS:
+            if table not in wanted and pattern.search(normalized):
+                wanted[table] = fields
+        if not wanted:
+            return [], 0.0
+
+        stems = _stems(query)
+        scores: Dict[int, int] = {}
+        for stem in stems:
+            for row_id in self._index.get(stem, ()):
+                scores[row_id] = scores.get(row_id, 0) + 1
+
+        matched = sorted(
+            (row_id for row_id in scores if self.rows[row_id].table in wanted),
+            key=lambda row_id: -scores[row_id]
+        )
+        if matched:
+            best = scores[matched[0]]
+            matched = [row_id for row_id in matched if scores[row_id] == best]
+            confidence = best / max(len(stems), 1)
+        elif stems and list(wanted) == ["prices"]:
+            # Цена неизвестной услуги — таблица не знает ответа
+            return [], 0.0
+        else:
+            matched = [row_id for row_id, row in enumerate(self.rows) if row.table in wanted]
+            confidence = 1.0 if not stems else TABLE_GUESS_CONFIDENCE
+
+        rows = [(self.rows[row_id], wanted[self.rows[row_id].table]) for row_id in matched[:limit]]
+        rows = [(row, fields) for row, fields in rows if any(name in row.fields for name in fields)]
+        return rows, min(confidence, 1.0) if rows else 0.0
+
+    def answer(self, query: str) -> Optional[Dict[str, Any]]:
+        """Прямой ответ на короткий справочный вопрос; None — нужен LLM"""
+        started = time.perf_counter()
+        self.stats["lookups"] += 1
+        if len(HashingEmbeddingAPI.normalize_text(query).split()) > self.max_answer_words:
+            return None
+        rows, confidence = self.find_rows(query)
+        if not rows or confidence < ANSWER_MIN_CONFIDENCE:
+            return None
+
+        lines = [f"- {row.render(fields)}" for row, fields in rows]
+        if any(row.table == "prices" for row, _ in rows):
+            lines.append("Точную стоимость уточняйте в call-центре"
+                         + (f" {self.call_center_phone()}" if self.call_center_phone() else "") + ".")
+        self.stats["answered"] += 1
+        return {
+            "answer": "По данным ВОККДЦ:\n" + "\n".join(lines),
+            "rows": [row for row, _ in rows],
+            "confidence": confidence,
+            "latency_ms": (time.perf_counter() - started) * 1000
+        }
+
+    def call_center_phone(self) -> Optional[str]:
+        for row in self.rows:
+            if row.table == "contacts" and "phone" in row.fields:
+                return row.fields["phone"]
+        return None
+
+    def as_context(self, query: str, limit: int = 5) -> str:
+        """Строки таблиц для промпта LLM в компактном виде; пустая строка, если ничего не нашлось"""
+        rows, _ = self.find_rows(query, limit)
+        if not rows:
+            return ""
+        self.stats["context_rows"] += len(rows)
+        return "[Справочные данные ВОККДЦ]:\n" + "\n".join(f"- {row.render()}" for row, _ in rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts = {table: sum(1 for row in self.rows if row.table == table) for table in self.TABLES}
+        return {"rows": counts, **self.stats}
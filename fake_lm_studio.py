@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Локальная замена LM Studio (OpenAI-совместимый API) для бенчмарков без сети и GPU
+
+Реализует /v1/models, /v1/embeddings и /v1/chat/completions (включая stream: true)
+с настраиваемыми задержками, скоростью генерации, долей ошибок и лимитом параллелизма.
+При заданной скорости prefill моделируется переиспользование KV-кэша общего префикса
+промпта, как в llama.cpp: время до первого токена зависит только от некэшированной части.
+
+Запуск:
+    python fake_lm_studio.py --port 1234 --latency-dist lognormal --latency-ms 300 --tokens-per-sec 40
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional
+
+from embedding_api import FastMockEmbeddingAPI
+
+FILLER_WORDS = [
+    "ВОККДЦ", "принимает", "пациентов", "по", "полису", "ОМС", "и", "на", "платной", "основе.",
+    "Запись", "ведется", "через", "единый", "call-центр", "+7", "(473)", "272-02-05", "или", "сайт",
+    "vodc.ru.", "Уточните", "подготовку", "к", "исследованию", "у", "оператора", "при", "записи."
+]
+
+
+@dataclass
+class FakeLMStudioConfig:
+    """Параметры поведения фейкового сервера"""
+    host: str = "127.0.0.1"
+    port: int = 1234
+    models: tuple = ("fake-llama-3.2-3b-instruct", "fake-text-embedding")
+    latency_dist: str = "fixed"        # fixed | uniform | normal | lognormal | exponential
+    latency_ms: float = 200.0          # среднее время до первого токена (и ответа эмбеддингов)
+    latency_jitter_ms: float = 50.0    # разброс для uniform/normal/lognormal
+    tokens_per_sec: float = 50.0       # скорость генерации; 0 — без задержки
+    completion_tokens: int = 64        # длина ответа в токенах (словах)
+    embedding_latency_ms: float = 20.0
+    embedding_dim: int = 1536
+    error_rate: float = 0.0            # доля запросов, завершающихся 500
+    max_concurrency: int = 4           # одновременно обрабатываемых запросов генерации
+    reject_when_busy: bool = False     # True — 503 вместо ожидания в очереди
+    prefill_tokens_per_sec: float = 0.0  # скорость обработки промпта; 0 — prefill не моделируется
+    prefix_cache_slots: int = 4        # сколько последних промптов хранится в KV-кэше; 0 — без кэша
+    seed: Optional[int] = None
+
+
+class FakeLMStudioStats:
+    """Потокобезопасные счетчики сервера"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "chat_requests": 0,
+            "stream_requests": 0,
+            "embedding_requests": 0,
+            "errors_injected": 0,
+            "rejected_busy": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "completion_tokens": 0,
+            "client_disconnects": 0,
+            "tokens_not_generated": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+        }
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] += value
+            if name == "in_flight":
+                self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.counters["in_flight"])
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+def render_prompt(messages: List[Dict[str, str]]) -> str:
+    """Промпт в виде строки, как его видит модель после применения шаблона чата"""
+    return "".join(f"<|{m.get('role', '')}|>{m.get('content', '')}<|end|>" for m in messages)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Длина общего префикса двух строк (бинарный поиск по сравнению срезов)"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class FakeLMStudioHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов OpenAI-совместимого API"""
+
+    server_version = "FakeLMStudio/1.0"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    # --- утилиты ---
+
+    @property
+    def config(self) -> FakeLMStudioConfig:
+        return self.server.config
+
+    @property
+    def stats(self) -> FakeLMStudioStats:
+        return self.server.stats
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент оборвал соединение, не дождавшись ответа (отмена, хеджирование)
+            self.stats.incr("client_disconnects")
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+        return json.loads(raw.decode("utf-8"))
+
+    def _sample_latency(self, mean_ms: float) -> float:
+        """Задержка в секундах по выбранному распределению"""
+        cfg = self.config
+        rng = self.server.rng
+        with self.server.rng_lock:
+            if cfg.latency_dist == "uniform":
+                value = rng.uniform(mean_ms - cfg.latency_jitter_ms, mean_ms + cfg.latency_jitter_ms)
+            elif cfg.latency_dist == "normal":
+                value = rng.gauss(mean_ms, cfg.latency_jitter_ms)
+            elif cfg.latency_dist == "lognormal":
+                # Параметры подбираются так, чтобы среднее было mean_ms
+                sigma = min(cfg.latency_jitter_ms / max(mean_ms, 1e-9), 2.0)
+                mu = math.log(max(mean_ms, 1e-9)) - sigma ** 2 / 2
+                value = rng.lognormvariate(mu, sigma)
+            elif cfg.latency_dist == "exponential":
+                value = rng.expovariate(1.0 / mean_ms) if mean_ms > 0 else 0.0
+            else:
+                value = mean_ms
+        return max(value, 0.0) / 1000.0
+
+    def _inject_error(self) -> bool:
+        if self.config.error_rate <= 0:
+            return False
+        with self.server.rng_lock:
+            failed = self.server.rng.random() < self.config.error_rate
+        if failed:
+            self.stats.incr("errors_injected")
+            self._send_json(500, {"error": {"message": "Injected failure", "type": "server_error"}})
+        return failed
+
+    @staticmethod
+    def _estimate_tokens(messages: List[Dict[str, str]]) -> int:
+        return sum(max(1, len(m.get("content", "")) // 4) for m in messages)
+
+    def _prefill(self, messages: List[Dict[str, str]], prompt_tokens: int) -> int:
+        """Смоделировать обработку промпта; возвращает число токенов, взятых из KV-кэша"""
+        cached_chars = self.server.match_prefix(render_prompt(messages))
+        cached_tokens = min(cached_chars // 4, prompt_tokens)
+        self.stats.incr("prompt_tokens", prompt_tokens)
+        self.stats.incr("cached_prompt_tokens", cached_tokens)
+        if self.config.prefill_tokens_per_sec > 0:
+            time.sleep((prompt_tokens - cached_tokens) / self.config.prefill_tokens_per_sec)
+        return cached_tokens
+
+    def _completion_words(self, messages: List[Dict[str, str]], max_tokens: int) -> List[str]:
+        """Детерминированный ответ, зависящий от последнего сообщения пользователя"""
+        last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        rng = random.Random(last_user)
+        count = min(self.config.completion_tokens, max_tokens)
+        return [rng.choice(FILLER_WORDS) for _ in range(count)]
+
+    # --- маршруты ---
+
+    def do_GET(self):
+        self.stats.incr("requests")
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {
+                "object": "list",
+                "data": [{"id": model_id, "object": "model", "owned_by": "fake-lm-studio"} for model_id in self.config.models]
+            })
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, {"stats": self.stats.snapshot(), "config": asdict(self.config)})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        self.stats.incr("requests")
+        path = self.path.rstrip("/")
+        try:
+            payload = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        if path == "/v1/embeddings":
+            self._handle_embeddings(payload)
+        elif path == "/v1/chat/completions":
+            self._handle_chat(payload)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _handle_embeddings(self, payload: Dict[str, Any]):
+        self.stats.incr("embedding_requests")
+        if self._inject_error():
+            return
+        texts = payload.get("input", "")
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep(self._sample_latency(self.config.embedding_latency_ms))
+        matrix = self.server.embedder.get_embeddings_matrix(texts)
+        self._send_json(200, {
+            "object": "list",
+            "model": payload.get("model", self.config.models[-1]),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": row.tolist()}
+                for i, row in enumerate(matrix)
+            ],
+            "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts), "total_tokens": sum(len(t) // 4 for t in texts)}
+        })
+
+    def _handle_chat(self, payload: Dict[str, Any]):
+        stream = bool(payload.get("stream"))
+        self.stats.incr("stream_requests" if stream else "chat_requests")
+
+        slots = self.server.slots
+        if not slots.acquire(blocking=not self.config.reject_when_busy):
+            self.stats.incr("rejected_busy")
+            self._send_json(503, {"error": {"message": "Model is busy", "type": "server_busy"}})
+            return
+
+        self.stats.incr("in_flight")
+        try:
+            if self._inject_error():
+                return
+            messages = payload.get("messages", [])
+            words = self._completion_words(messages, int(payload.get("max_tokens", 2000)))
+            prompt_tokens = self._estimate_tokens(messages)
+            cached_tokens = self._prefill(messages, prompt_tokens)
+            time.sleep(self._sample_latency(self.config.latency_ms))
+
+            if stream:
+                self._stream_words(payload, words, prompt_tokens, cached_tokens)
+            else:
+                if self.config.tokens_per_sec > 0:
+                    time.sleep(len(words) / self.config.tokens_per_sec)
+                self.stats.incr("completion_tokens", len(words))
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", self.config.models[0]),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(words),
+                        "total_tokens": prompt_tokens + len(words),
+                        "prompt_tokens_details": {"cached_tokens": cached_tokens}
+                    }
+                })
+        finally:
+            self.stats.incr("in_flight", -1)
+            slots.release()
+
+    def _stream_words(self, payload: Dict[str, Any], words: List[str], prompt_tokens: int,
+                      cached_tokens: int = 0):
+        """Отдать ответ в формате SSE (chat.completion.chunk)"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get("model", self.config.models[0])
+        delay = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Optional[Dict] = None) -> bytes:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            if usage:
+                chunk["usage"] = usage
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        sent = 0
+        try:
+            self.wfile.write(event({"role": "assistant"}))
+            for i, word in enumerate(words):
+                if delay:
+                    time.sleep(delay)
+                self.wfile.write(event({"content": word if i == 0 else f" {word}"}))
+                self.wfile.flush()
+                sent += 1
+            self.wfile.write(event({}, "stop", {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+                "prompt_tokens_details": {"cached_tokens": cached_tokens}
+            }))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент ушел — как и LM Studio, прекращаем генерацию
+            self.stats.incr("client_disconnects")
+            self.stats.incr("tokens_not_generated", len(words) - sent)
+        finally:
+            self.stats.incr("completion_tokens", sent)
+            self.close_connection = True
+
+
+class FakeLMStudioServer(ThreadingHTTPServer):
+    """HTTP-сервер, который можно запустить в фоне из бенчмарка"""
+
+    daemon_threads = True
+
+    def __init__(self, config: FakeLMStudioConfig = None, quiet: bool = True):
+        self.config = config or FakeLMStudioConfig()
+        self.quiet = quiet
+        self.stats = FakeLMStudioStats()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.slots = threading.Semaphore(self.config.max_concurrency)
+        self.embedder = FastMockEmbeddingAPI(self.config.embedding_dim)
+        self.prompt_cache: List[str] = []
+        self.prompt_cache_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        super().__init__((self.config.host, self.config.port), FakeLMStudioHandler)
+
+    def match_prefix(self, prompt: str) -> int:
+        """Самый длинный общий префикс с промптами в кэше (в символах); промпт занимает слот"""
+        if self.config.prefix_cache_slots <= 0:
+            return 0
+        with self.prompt_cache_lock:
+            best = max((common_prefix_length(prompt, cached) for cached in self.prompt_cache), default=0)
+            self.prompt_cache.append(prompt)
+            del self.prompt_cache[:-self.config.prefix_cache_slots]
+        return best
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLMStudioServer":
+        """Запустить сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-lm-studio", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Остановить сервер"""
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый LM Studio для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency-dist", default="fixed",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Среднее время до первого токена")
+    parser.add_argument("--latency-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--reject-when-busy", action="store_true", help="Отвечать 503 вместо ожидания")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=0.0,
+                        help="Скорость обработки промпта; 0 — не моделировать prefill")
+    parser.add_argument("--prefix-cache-slots", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="Логировать каждый запрос")
+    args = parser.parse_args()
+
+    config = FakeLMStudioConfig(
+        host=args.host,
+        port=args.port,
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        completion_tokens=args.completion_tokens,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_dim=args.embedding_dim,
+        error_rate=args.error_rate,
+        max_concurrency=args.max_concurrency,
+        reject_when_busy=args.reject_when_busy,
+        prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+        prefix_cache_slots=args.prefix_cache_slots,
+        seed=args.seed,
+    )
+    server = FakeLMStudioServer(config, quiet=not args.verbose)
+    print(f"🧪 Фейковый LM Studio запущен: {server.base_url}")
+    print(f"   Модели: {', '.join(config.models)}")
+    print(f"   Задержка: {config.latency_dist} {config.latency_ms} мс, {config.tokens_per_sec} ток/с, "
+          f"ошибки: {config.error_rate:.0%}, параллелизм: {config.max_concurrency}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nОстановка сервера")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Индекс готовых пар вопрос-ответ (FAQ) для ответа без эмбеддинга запроса и генерации
+"""
+
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from local_embeddings import HashingEmbeddingAPI
+
+_HEADING_RE = re.compile(r"^(#{2,6})\s+(.+?)\s*$")
+
+# Заголовок с этого слова — вопрос, даже без «?» («Как записаться в ВОККДЦ:»)
+QUESTION_WORDS = {"что", "как", "где", "когда", "сколько", "какой", "какая", "какое", "какие",
+                  "кто", "почему", "зачем", "куда", "откуда", "чем", "можно"}
+
+# Слова, которые не меняют смысла вопроса и отбрасываются в нормализованной форме
+FILLER_WORDS = {"а", "и", "же", "ли", "ну", "вот", "подскажите", "скажите", "пожалуйста", "мне", "вы", "у", "вас"}
+
+
+@dataclass
+class FAQEntry:
+    """Пара вопрос-ответ из FAQ"""
+    question: str
+    answer: str
+    source: str = ""
+
+
+def is_question_heading(heading: str) -> bool:
+    """Заголовок сформулирован как вопрос: заканчивается «?» или начинается с вопросительного слова"""
+    if heading.endswith("?"):
+        return True
+    words = HashingEmbeddingAPI.normalize_text(heading).split()
+    return bool(words) and (words[0] in QUESTION_WORDS or words[1:2] == ["ли"])
+
+
+def parse_faq_markdown(text: str, source: str = "") -> List[FAQEntry]:
+    """Разобрать markdown, где заголовки-вопросы (##–######) отделяют ответы
+
+    Ответ — весь текст под вопросом до следующего заголовка того же или более
+    высокого уровня; вложенные подразделы («### Основная информация») остаются
+    частью ответа. Заголовки, не являющиеся вопросами, в индекс не попадают.
+    """
+    entries: List[FAQEntry] = []
+    question: Optional[str] = None
+    level = 0
+    body: List[str] = []
+
+    def flush():
+        answer = "\n".join(body).strip()
+        if question and answer:
+            entries.append(FAQEntry(question=question, answer=answer, source=source))
+
+    for line in text.splitlines():
+        match = _HEADING_RE.match(line)
+        if match and question is not None and len(match.group(1)) > level:
+            body.append(line)
+        elif match:
+            flush()
+            heading = match.group(2).rstrip(":").strip()
+            question = heading if is_question_heading(heading) else None
+            level = len(match.group(1))
+            body = []
+        elif question is not None:
+            body.append(line)
+    flush()
+    return entries
+
+
+class FAQIndex:
+    """Сопоставление вопроса с FAQ: точное, нормализованное и по близости векторов
+
+    Вопросы эмбеддятся локальным HashingEmbeddingAPI при загрузке, поэтому поиск —
+    одно матрично-векторное умножение без обращения к серверу эмбеддингов.
+    Ответ отдается, только если уверенность не ниже threshold; иначе вопрос
+    уходит в обычный RAG.
+    """
+
+    def __init__(self, threshold: float = 0.8, embedding_api: Optional[HashingEmbeddingAPI] = None):
+        self.threshold = threshold
+        self.embedding_api = embedding_api or HashingEmbeddingAPI()
+        self.entries: List[FAQEntry] = []
+        self._exact: Dict[str, int] = {}
+        self._normalized: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "exact": 0, "normalized": 0, "vector": 0, "below_threshold": 0}
+
+    @staticmethod
+    def exact_key(question: str) -> str:
+        return question.strip().lower().rstrip("?!. ")
+
+    @staticmethod
+    def normalized_key(question: str) -> str:
+        """Порядок слов, регистр, пунктуация и слова-паразиты не учитываются"""
+        words = HashingEmbeddingAPI.normalize_text(question).split()
+        return " ".join(sorted(word for word in words if word not in FILLER_WORDS))
+
+    def add_entries(self, entries: List[FAQEntry]):
+        """Добавить пары и пересобрать матрицу вопросов"""
+        with self._lock:
+            for entry in entries:
+                index = len(self.entries)
+                self.entries.append(entry)
+                self._exact.setdefault(self.exact_key(entry.question), index)
+                self._normalized.setdefault(self.normalized_key(entry.question), index)
+            questions = [entry.question for entry in self.entries]
+            self._matrix = self.embedding_api.get_embeddings_matrix(questions) if questions else None
+
+    def load_file(self, file_path: str) -> int:
+        """Загрузить FAQ из markdown-файла; возвращает число пар"""
+        if not os.path.exists(file_path):
+            print(f"Файл FAQ {file_path} не найден")
+            return 0
+        with open(file_path, "r", encoding="utf-8") as f:
+            entries = parse_faq_markdown(f.read(), os.path.basename(file_path))
+        self.add_entries(entries)
+        return len(entries)
+
+    def match(self, query: str) -> Optional[Dict[str, Any]]:
+        """Лучшее совпадение независимо от порога; None, если FAQ пуст"""
+        if not self.entries:
+            return None
+        started = time.perf_counter()
+
+        index = self._exact.get(self.exact_key(query))
+        kind, confidence = "exact", 1.0
+        if index is None:
+            index = self._normalized.get(self.normalized_key(query))
+            kind, confidence = "normalized", 0.99
+        if index is None:
+            scores = self._matrix @ self.embedding_api.get_embeddings_matrix([query])[0]
+            index = int(np.argmax(scores))
+            kind, confidence = "vector", float(scores[index])
+
+        entry = self.entries[index]
+        return {
+            "question": entry.question,
+            "answer": entry.answer,
+            "confidence": confidence,
+            "match": kind,
+            "latency_ms": (time.perf_counter() - started) * 1000
+        }
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Совпадение с уверенностью не ниже порога; None — отвечать через LLM"""
+        result = self.match(query)
+        self.stats["lookups"] += 1
+        if result is None or result["confidence"] < self.threshold:
+            self.stats["below_threshold"] += 1
+            return None
+        self.stats[result["match"]] += 1
+        return result
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.entries), "threshold": self.threshold, **self.stats}
@@ -1,12 +1,22 @@
 # Конфигурация Gunicorn для чатбота ВОККДЦ
 
+import os
+import shutil
+
+# Метрики Prometheus собираются со всех воркеров через файлы в этой директории;
+# переменная должна быть задана до импорта приложения (preload_app)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/vodc_prometheus")
+
 # Настройки сети
 bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Настройки воркеров
 workers = 4  # Количество воркеров (CPU cores * 2 + 1)
-worker_class = "sync"
+# Потоки держат очередь допуска к генерации и потоковые ответы: sync-воркер
+# обслуживает один запрос, и при всплеске запросы копятся в backlog без приоритетов
+worker_class = "gthread"
+threads = 8
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -44,4 +54,16 @@ spew = False
 proc_name = "vodc-chatbot"
 
 # Настройки таймаутов graceful restart
-graceful_timeout = 30
\ No newline at end of file
+graceful_timeout = 30
+
+# Хуки для метрик Prometheus в многопроцессном режиме
+def on_starting(server):
+    """Очистить файлы метрик прошлого запуска"""
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    """Убрать live-гейджи завершившегося воркера (перезапуск по max_requests)"""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,198 @@
+"""
+Сжатие длинной истории разговора в краткое содержание (rolling summary)
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+SUMMARY_HEADER = "\n\nКраткое содержание предыдущей части разговора:\n"
+
+SUMMARY_INSTRUCTIONS = """Ты ведешь краткий конспект разговора пациента с ассистентом медицинского центра.
+Обнови конспект с учетом новых реплик. Сохрани всё, что пациент сообщил о себе
+(жалобы, возраст, отделения и врачи, которыми интересовался, даты, выбранные услуги),
+и ключевые ответы ассистента (цены, адреса, телефоны, рекомендации).
+Пиши по-русски, сжато, пунктами, не более 150 слов. Не добавляй ничего от себя."""
+
+
+class HistoryCompactor:
+    """Сворачивает старые реплики истории в краткое содержание
+
+    Когда история длиннее compact_threshold сообщений, всё, кроме последних
+    keep_recent, отправляется модели вместе с прежним конспектом. Запрос к модели
+    выполняется в фоновом потоке уже после того, как ответ пользователю отдан;
+    свернутые сообщения удаляются из начала списка истории только после получения
+    конспекта. Если модель недоступна, история ограничивается hard_limit сообщений.
+
+    post — способ отправить запрос конспекта (по умолчанию POST на chat_endpoint);
+    веб-сервер передает отправку через пул серверов и контроль допуска, чтобы
+    конспекты не добавляли неучтенной нагрузки. Исключение из post означает, что
+    сжатие отложено до следующего ответа.
+    """
+
+    def __init__(self, chat_endpoint: str, model_getter: Callable[[], Optional[str]],
+                 compact_threshold: int = 12, keep_recent: int = 6, hard_limit: int = 40,
+                 summary_max_tokens: int = 400, timeout: float = 60.0,
+                 post: Optional[Callable[[Dict[str, Any]], requests.Response]] = None):
+        self.chat_endpoint = chat_endpoint
+        self.model_getter = model_getter
+        self.compact_threshold = compact_threshold
+        self.keep_recent = keep_recent
+        self.hard_limit = hard_limit
+        self.summary_max_tokens = summary_max_tokens
+        self.timeout = timeout
+        self.post = post
+
+        self.summary = ""
+        self.summarized_messages = 0
+        self.last_error: Optional[str] = None
+        self._generation = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "compactions": 0,
+            "failures": 0,
+            "deferred": 0,
+            "hard_trims": 0,
+            "last_duration_ms": 0.0
+        }
+
+    def needs_compaction(self, history: List[Dict[str, str]]) -> bool:
+        return len(history) > self.compact_threshold
+
+    def maybe_compact(self, history: List[Dict[str, str]]) -> bool:
+        """Запустить фоновое сжатие, если история превысила порог
+
+        Вызывается после доставки ответа. Возвращает True, если сжатие запущено.
+        """
+        self._enforce_hard_limit(history)
+        if not self.needs_compaction(history):
+            return False
+
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+            generation = self._generation
+
+        # Сворачиваем целое число пар вопрос-ответ, чтобы свежая часть начиналась с вопроса
+        fold_count = len(history) - self.keep_recent
+        fold_count -= fold_count % 2
+        older = [dict(m) for m in history[:fold_count]]
+
+        self._thread = threading.Thread(
+            target=self._run, args=(history, older, generation),
+            name="history-compactor", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def _run(self, history: List[Dict[str, str]], older: List[Dict[str, str]], generation: int):
+        started = time.perf_counter()
+        try:
+            summary = self._summarize(self.summary, older)
+            with self._lock:
+                # История была очищена, пока модель писала конспект
+                if generation != self._generation:
+                    return
+                if summary:
+                    self.summary = summary
+                    self.summarized_messages += len(older)
+                    # Новые сообщения добавляются только в конец, поэтому начало списка не сдвинулось
+                    del history[:len(older)]
+                    self.stats["compactions"] += 1
+                    self.last_error = None
+                else:
+                    self.stats["failures"] += 1
+        finally:
+            self.stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            with self._lock:
+                self._running = False
+
+    def _summarize(self, previous_summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Запросить у модели обновленный конспект; None при ошибке"""
+        model = self.model_getter()
+        if not model:
+            self.last_error = "Нет доступной модели для сжатия истории"
+            return None
+
+        transcript = "\n".join(
+            f"{'Пациент' if m['role'] == 'user' else 'Ассистент'}: {m['content']}" for m in messages
+        )
+        content = (f"Текущий конспект:\n{previous_summary or '(пусто)'}\n\n"
+                   f"Новые реплики:\n{transcript}\n\nОбновленный конспект:")
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": content}
+            ],
+            "temperature": 0.2,
+            "max_tokens": self.summary_max_tokens
+        }
+
+        try:
+            if self.post is not None:
+                response = self.post(payload)
+            else:
+                response = requests.post(self.chat_endpoint, json=payload, timeout=self.timeout)
+            if response.status_code != 200:
+                self.last_error = f"Ошибка API при сжатии истории: {response.status_code}"
+                return None
+            summary = response.json()["choices"][0]["message"]["content"].strip()
+            return summary or None
+        except requests.exceptions.RequestException as e:
+            self.last_error = f"Ошибка при сжатии истории: {e}"
+        except (ValueError, KeyError, IndexError) as e:
+            self.last_error = f"Некорректный ответ при сжатии истории: {e}"
+        except Exception as e:
+            # Отказ допуска, истекший срок, нет свободного сервера: попробуем после следующего ответа
+            self.stats["deferred"] += 1
+            self.last_error = f"Сжатие истории отложено: {e}"
+        return None
+
+    def _enforce_hard_limit(self, history: List[Dict[str, str]]):
+        """Страховка на случай, когда модель долго недоступна"""
+        if len(history) > self.hard_limit:
+            with self._lock:
+                if self._running:
+                    # Фоновый поток удалит начало списка сам; не сдвигаем его индексы
+                    return
+                del history[:len(history) - self.hard_limit]
+                self.stats["hard_trims"] += 1
+
+    def wait(self, timeout: Optional[float] = None):
+        """Дождаться завершения фонового сжатия (для скриптов и сохранения разговора)"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def reset(self):
+        """Забыть конспект (при очистке истории); незавершенное сжатие будет отброшено"""
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self.summarized_messages = 0
+
+    def restore(self, summary: str, summarized_messages: int = 0):
+        """Восстановить конспект из сохраненного разговора"""
+        self.reset()
+        self.summary = summary or ""
+        self.summarized_messages = summarized_messages
+
+    def summary_block(self) -> str:
+        """Текст для добавления к системному промпту"""
+        return SUMMARY_HEADER + self.summary if self.summary else ""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "summary_chars": len(self.summary),
+            "summarized_messages": self.summarized_messages,
+            "running": self._running,
+            "last_error": self.last_error,
+            **self.stats
+        }
@@ -0,0 +1,195 @@
+"""
+Быстрый локальный классификатор сообщений перед RAG и генерацией
+"""
+
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from local_embeddings import HashingEmbeddingAPI
+
+# Слова, из которых целиком состоит «светская беседа»; intent — по первому совпавшему
+SMALL_TALK_WORDS = {
+    "farewell": {"до", "свидания", "пока", "всего", "доброго", "хорошего", "встречи"},
+    "thanks": {"спасибо", "благодарю", "спс", "большое", "огромное", "вам", "тебе", "за", "помощь", "информацию"},
+    "greeting": {"здравствуйте", "здравствуй", "привет", "приветствую", "добрый", "доброе", "день", "утро",
+                 "вечер", "алло", "hello", "hi"},
+    "acknowledgement": {"ок", "окей", "ok", "хорошо", "понятно", "ясно", "ладно", "отлично", "супер",
+                        "понял", "поняла", "принято"},
+}
+
+SMALL_TALK_VOCABULARY = set().union(*SMALL_TALK_WORDS.values())
+
+SMALL_TALK_REPLIES = {
+    "greeting": [
+        "Здравствуйте! Я виртуальный помощник ВОККДЦ. Подскажу адреса, режим работы, "
+        "цены и как записаться на прием. Чем могу помочь?",
+    ],
+    "thanks": [
+        "Пожалуйста! Если появятся вопросы о ВОККДЦ, обращайтесь.",
+        "Рад помочь! Записаться на прием можно по телефону +7 (473) 272-02-05 или на сайте vodc.ru.",
+    ],
+    "acknowledgement": [
+        "Хорошо. Если остались вопросы о приеме, услугах или подготовке к исследованиям — спрашивайте.",
+    ],
+    "farewell": [
+        "До свидания! Будьте здоровы.",
+    ],
+}
+
+# Справочные вопросы: шаблон запроса, подсказка для лексического поиска
+# и шаблон строк базы знаний, которые на него отвечают
+LOOKUP_INTENTS: List[Tuple[str, "re.Pattern", str, "re.Pattern"]] = [
+    ("website", re.compile(r"сайт|ссылк"), "сайт vodc.ru запись онлайн", re.compile(r"vodc\.ru", re.IGNORECASE)),
+    ("email", re.compile(r"почт|email|e mail"), "электронная почта", re.compile(r"@")),
+    # «номер» без «телефона» — это номер полиса, талона, кабинета
+    ("phone", re.compile(r"телефон|позвонить|дозвониться|call"), "телефон единый call-центр",
+     re.compile(r"телефон|\+7", re.IGNORECASE)),
+    ("hours", re.compile(r"режим работы|часы работы|время работы|график работы|во сколько|до скольки|"
+                         r"когда работает|работаете|открыт"),
+     "режим работы и адреса главный корпус", re.compile(r"режим работы|\d{1,2}:\d{2}", re.IGNORECASE)),
+    # «пройти» в клинике — чаще «пройти обследование»: только вместе с местом
+    ("address", re.compile(r"адрес|где (вы )?(находит|расположен)|расположен|добраться|доехать|"
+                           r"пройти (к|до) |к вам пройти|пройти в (центр|корпус|здани|поликлиник|клиник)"),
+     "режим работы и адреса главный корпус адрес", re.compile(r"адрес|ул\.|проспект|площадь", re.IGNORECASE)),
+]
+
+
+@dataclass
+class RouteDecision:
+    """Решение маршрутизатора: куда отправить сообщение и готовый ответ, если он есть"""
+    route: str                    # small_talk | faq | facts | lookup | rag
+    intent: str
+    answer: Optional[str] = None
+    confidence: float = 0.0
+    latency_ms: float = 0.0
+
+
+class IntentRouter:
+    """Правила плюс лексический индекс базы знаний, без эмбеддингов и LLM
+
+    Приветствия, благодарности и прощания получают шаблонный ответ. Вопросы,
+    совпавшие с FAQ не ниже его порога, — готовый ответ из FAQ. Вопросы о ценах,
+    адресах и телефонах — строки справочных таблиц. Остальные короткие
+    справочные вопросы (телефон, адрес, режим работы, сайт, почта) отвечаются
+    строками из найденных лексическим поиском чанков. Всё остальное — полный RAG.
+    """
+
+    ROUTES = ("small_talk", "faq", "facts", "lookup", "rag")
+
+    def __init__(self, knowledge_base=None, faq_index=None, fact_tables=None, lookup_threshold: float = 0.1,
+                 max_small_talk_words: int = 6, max_lookup_words: int = 8, max_lookup_lines: int = 4):
+        self.knowledge_base = knowledge_base
+        self.faq_index = faq_index
+        self.fact_tables = fact_tables
+        self.lookup_threshold = lookup_threshold
+        self.max_small_talk_words = max_small_talk_words
+        self.max_lookup_words = max_lookup_words
+        self.max_lookup_lines = max_lookup_lines
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {route: 0 for route in self.ROUTES}
+        self.stats["intents"] = {}
+
+    def classify_small_talk(self, words: List[str], expects_reply: bool = False) -> Optional[str]:
+        """Intent светской беседы или None, если в сообщении есть что-то кроме нее"""
+        if not words or len(words) > self.max_small_talk_words:
+            return None
+        if any(word not in SMALL_TALK_VOCABULARY for word in words):
+            return None
+        for intent, intent_words in SMALL_TALK_WORDS.items():
+            if intent_words.intersection(words):
+                # «Хорошо» в ответ на вопрос ассистента — это ответ, а не вежливость
+                if intent == "acknowledgement" and expects_reply:
+                    return None
+                return intent
+        return None
+
+    def classify_lookup(self, normalized: str, words: List[str]) -> Optional[Tuple[str, str, "re.Pattern"]]:
+        if len(words) > self.max_lookup_words:
+            return None
+        for intent, query_pattern, search_hint, line_pattern in LOOKUP_INTENTS:
+            if query_pattern.search(normalized):
+                return intent, search_hint, line_pattern
+        return None
+
+    def retrieval_answer(self, query: str, line_pattern: "re.Pattern") -> Tuple[Optional[str], float]:
+        """Ответ из строк базы знаний без генерации; (None, score), если строк не нашлось"""
+        if self.knowledge_base is None or not self.knowledge_base.vector_store.documents:
+            return None, 0.0
+        results = self.knowledge_base.lexical_index.search(query, top_k=3)
+        if not results or results[0]["similarity"] < self.lookup_threshold:
+            return None, results[0]["similarity"] if results else 0.0
+
+        lines: List[str] = []
+        for result in results:
+            for line in result["document"].content.splitlines():
+                line = line.strip().lstrip("-• ").replace("**", "").strip()
+                if not line or line.startswith("#") or not line_pattern.search(line):
+                    continue
+                # Чанки перекрываются: обрезанная на границе строка — префикс полной
+                if any(existing.startswith(line) for existing in lines):
+                    continue
+                lines = [existing for existing in lines if not line.startswith(existing)]
+                lines.append(line)
+            if len(lines) >= self.max_lookup_lines:
+                break
+        lines = lines[:self.max_lookup_lines]
+        if not lines:
+            return None, results[0]["similarity"]
+        answer = "По данным ВОККДЦ:\n" + "\n".join(f"- {line}" for line in lines)
+        return answer, results[0]["similarity"]
+
+    def route(self, message: str, last_assistant_message: str = "", allow_lookup: bool = True) -> RouteDecision:
+        """Выбрать маршрут для сообщения
+
+        allow_lookup=False отключает ответы из базы знаний (например, при /kb_off).
+        """
+        started = time.perf_counter()
+        normalized = HashingEmbeddingAPI.normalize_text(message)
+        words = normalized.split()
+        decision = RouteDecision(route="rag", intent="rag")
+
+        small_talk = self.classify_small_talk(words, last_assistant_message.rstrip().endswith("?"))
+        if small_talk:
+            decision = RouteDecision(route="small_talk", intent=small_talk,
+                                     answer=random.choice(SMALL_TALK_REPLIES[small_talk]), confidence=1.0)
+        elif allow_lookup:
+            faq_match = self.faq_index.lookup(message) if self.faq_index is not None else None
+            fact = None
+            if not faq_match and self.fact_tables is not None:
+                fact = self.fact_tables.answer(message)
+            lookup = None if faq_match or fact else self.classify_lookup(normalized, words)
+            if faq_match:
+                decision = RouteDecision(route="faq", intent=f"faq:{faq_match['match']}",
+                                         answer=faq_match["answer"], confidence=faq_match["confidence"])
+            elif fact:
+                tables = sorted({row.table for row in fact["rows"]})
+                decision = RouteDecision(route="facts", intent=f"facts:{'+'.join(tables)}",
+                                         answer=fact["answer"], confidence=fact["confidence"])
+            elif lookup:
+                intent, search_hint, line_pattern = lookup
+                answer, score = self.retrieval_answer(f"{message} {search_hint}", line_pattern)
+                if answer is not None:
+                    decision = RouteDecision(route="lookup", intent=intent, answer=answer, confidence=score)
+
+        decision.latency_ms = (time.perf_counter() - started) * 1000
+        self._count(decision)
+        return decision
+
+    def _count(self, decision: RouteDecision):
+        with self._lock:
+            self.stats[decision.route] += 1
+            intents = self.stats["intents"]
+            intents[decision.intent] = intents.get(decision.intent, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.stats[route] for route in self.ROUTES)
+            return {
+                **{route: self.stats[route] for route in self.ROUTES},
+                "intents": dict(self.stats["intents"]),
+                "fast_path_ratio": round(1 - self.stats["rag"] / total, 3) if total else 0.0
+            }
@@ -4,8 +4,14 @@ import numpy as np
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 import hashlib
+import threading
 from datetime import datetime
 
+from local_embeddings import LexicalIndex
+from embedding_projection import EmbeddingProjection
+from retrieval_cache import RetrievalCache
+from metrics import timed
+
 @dataclass
 class Document:
     """Класс для хранения документа с метаданными"""
@@ -15,6 +21,25 @@ class Document:
     metadata: Dict[str, Any]
     embedding: Optional[List[float]] = None
 
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], top_k: int = 5,
+                           k: int = 60) -> List[Dict[str, Any]]:
+    """Объединить списки результатов по рангам (RRF): score = Σ 1 / (k + rank)
+    
+    Ранги не зависят от масштаба сходства, поэтому списки разных вариантов
+    запроса складываются честно. similarity результата — лучшее сходство
+    документа среди вариантов, rrf_score — итоговая оценка слияния.
+    """
+    fused: Dict[int, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            entry = fused.get(result["index"])
+            if entry is None:
+                entry = fused[result["index"]] = {**result, "rrf_score": 0.0}
+            entry["rrf_score"] += 1.0 / (k + rank)
+            entry["similarity"] = max(entry["similarity"], result["similarity"])
+    ranked = sorted(fused.values(), key=lambda entry: (-entry["rrf_score"], -entry["similarity"]))
+    return ranked[:top_k]
+
 class VectorStore:
     """Простое векторное хранилище для документов"""
     
@@ -27,6 +52,18 @@ class VectorStore:
             "total_documents": 0,
             "total_chunks": 0
         }
+        # Необязательная проекция эмбеддингов (PCA/усечение), хранится вместе с индексом
+        self.projection: Optional[EmbeddingProjection] = None
+        
+        # Матрица нормализованных эмбеддингов для поиска, строится лениво
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_rows: List[int] = []
+        self._matrix_documents: List[Document] = []
+        # Хранилище общее для всех сессий процесса: изменения и сборка матрицы под блокировкой
+        self._lock = threading.RLock()
+        # Версия индекса: увеличивается при любом изменении документов или проекции
+        self.version = 0
+        self._fingerprint: Optional[tuple] = None
         
         # Создаем директорию для хранения
         os.makedirs(storage_path, exist_ok=True)
@@ -34,44 +71,194 @@ class VectorStore:
     
     def add_document(self, document: Document):
         """Добавить документ в хранилище"""
-        self.documents.append(document)
-        if document.embedding:
-            self.embeddings.append(document.embedding)
-        self.metadata["total_documents"] += 1
-        self.metadata["total_chunks"] += 1
-        self.save_to_disk()
+        self.add_documents([document])
     
     def add_documents(self, documents: List[Document]):
-        """Добавить несколько документов"""
-        for doc in documents:
-            self.add_document(doc)
+        """Добавить несколько документов (одна перезапись файла хранилища)"""
+        with self._lock:
+            for doc in documents:
+                self.documents.append(doc)
+                if doc.embedding:
+                    self.embeddings.append(doc.embedding)
+                self.metadata["total_documents"] += 1
+                self.metadata["total_chunks"] += 1
+            self.invalidate_index()
+            self.save_to_disk()
+    
+    def replace_documents(self, filename: str, documents: List[Document], save: bool = True):
+        """Заменить все чанки файла filename новыми; save=False — только в памяти"""
+        with self._lock:
+            # Новый список, а не правка на месте: идущие поиски дочитывают прежний
+            self.documents = [doc for doc in self.documents if doc.filename != filename] + list(documents)
+            self.embeddings = [doc.embedding for doc in self.documents if doc.embedding]
+            self.metadata["total_documents"] = len(self.documents)
+            self.metadata["total_chunks"] = len(self.documents)
+            self.invalidate_index()
+            if save:
+                self.save_to_disk()
+    
+    def file_chunks(self, filename: str) -> Dict[str, Document]:
+        """Чанки файла в хранилище по хэшу содержимого"""
+        return {
+            hashlib.sha1(doc.content.encode("utf-8")).hexdigest(): doc
+            for doc in self.documents if doc.filename == filename
+        }
+    
+    def invalidate_index(self):
+        """Сбросить матрицу поиска после изменения документов"""
+        with self._lock:
+            self._matrix = None
+            self._matrix_rows = []
+            self._matrix_documents = []
+            self.version += 1
+    
+    @property
+    def fingerprint(self) -> str:
+        """Отпечаток содержимого базы: одинаков у любых экземпляров с теми же чанками и проекцией"""
+        if self._fingerprint is None or self._fingerprint[0] != self.version:
+            chunk_hashes = sorted({hashlib.sha1(doc.content.encode("utf-8")).hexdigest() for doc in self.documents})
+            digest = hashlib.sha1("".join(chunk_hashes).encode("utf-8"))
+            if self.projection is not None:
+                digest.update(f"{self.projection.method}:{self.projection.dim}".encode("utf-8"))
+            self._fingerprint = (self.version, digest.hexdigest()[:16])
+        return self._fingerprint[1]
+    
+    def _raw_matrix(self) -> tuple:
+        """Матрица L2-нормализованных исходных эмбеддингов и индексы их документов"""
+        rows = [i for i, doc in enumerate(self.documents) if doc.embedding]
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32), []
+        
+        # Эмбеддинги другой размерности (другая модель) в матрицу не попадают
+        dim = len(self.documents[rows[0]].embedding)
+        rows = [i for i in rows if len(self.documents[i].embedding) == dim]
+        matrix = np.asarray([self.documents[i].embedding for i in rows], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms, rows
+    
+    def _get_index(self) -> tuple:
+        """Матрица поиска (с учетом проекции), индексы документов ее строк и сам список документов"""
+        with self._lock:
+            if self._matrix is None:
+                matrix, rows = self._raw_matrix()
+                if self.projection is not None and len(rows):
+                    matrix = self.projection.transform(matrix)
+                self._matrix, self._matrix_rows, self._matrix_documents = matrix, rows, self.documents
+            return self._matrix, self._matrix_rows, self._matrix_documents
+    
+    def _get_matrix(self) -> tuple:
+        """Матрица поиска (с учетом проекции) и индексы документов ее строк"""
+        matrix, rows, _ = self._get_index()
+        return matrix, rows
+    
+    def prepare_query(self, query_embedding: List[float]) -> Optional[np.ndarray]:
+        """Привести эмбеддинг запроса к пространству индекса (нормализация и проекция)"""
+        matrix, rows = self._get_matrix()
+        query = np.asarray(query_embedding, dtype=np.float32)
+        input_dim = self.projection.input_dim if self.projection is not None else matrix.shape[1]
+        if not rows or query.shape[0] != input_dim:
+            return None
+        
+        if self.projection is not None:
+            return self.projection.transform(query)
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
     
     def search(self, query_embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
         """Поиск похожих документов по эмбеддингу"""
         if not self.embeddings or not self.documents:
             return []
         
-        # Вычисляем косинусное сходство
-        similarities = []
-        query_array = np.array(query_embedding)
-        
-        for i, embedding in enumerate(self.embeddings):
-            doc_array = np.array(embedding)
-            similarity = np.dot(query_array, doc_array) / (
-                np.linalg.norm(query_array) * np.linalg.norm(doc_array)
-            )
-            similarities.append({
-                "document": self.documents[i],
-                "similarity": float(similarity),
-                "index": i
-            })
-        
-        # Сортируем по сходству и возвращаем топ-K
-        similarities.sort(key=lambda x: x["similarity"], reverse=True)
-        return similarities[:top_k]
+        query = self.prepare_query(query_embedding)
+        if query is None:
+            print("Размерность эмбеддинга запроса не совпадает с индексом")
+            return []
+        
+        # Косинусное сходство со всеми документами одним матричным умножением
+        matrix, rows, documents = self._get_index()
+        similarities = matrix @ query
+        
+        # Возвращаем топ-K по убыванию сходства
+        top_k = min(top_k, similarities.shape[0])
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-similarities, top_k - 1)[:top_k]
+        best = best[np.argsort(-similarities[best])]
+        return [
+            {
+                "document": documents[rows[j]],
+                "similarity": float(similarities[j]),
+                "index": rows[j]
+            }
+            for j in best
+        ]
+    
+    def search_many(self, query_embeddings: List[List[float]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Поиск по нескольким эмбеддингам запросов одним матрично-матричным умножением
+        
+        Возвращает списки результатов в порядке запросов; для эмбеддинга
+        несовпадающей размерности список пустой.
+        """
+        if not self.embeddings or not self.documents:
+            return [[] for _ in query_embeddings]
+        
+        prepared = [self.prepare_query(embedding) for embedding in query_embeddings]
+        valid = [i for i, query in enumerate(prepared) if query is not None]
+        results: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+        if not valid:
+            print("Размерность эмбеддингов запросов не совпадает с индексом")
+            return results
+        
+        matrix, rows, documents = self._get_index()
+        # (документы x размерность) @ (размерность x запросы) → сходства по столбцам
+        similarities = matrix @ np.stack([prepared[i] for i in valid], axis=1)
+        top_k = min(top_k, similarities.shape[0])
+        if top_k <= 0:
+            return results
+        best = np.argpartition(-similarities, top_k - 1, axis=0)[:top_k]
+        for column, i in enumerate(valid):
+            scores = similarities[:, column]
+            order = best[:, column][np.argsort(-scores[best[:, column]])]
+            results[i] = [
+                {
+                    "document": documents[rows[j]],
+                    "similarity": float(scores[j]),
+                    "index": rows[j]
+                }
+                for j in order
+            ]
+        return results
+    
+    def fit_projection(self, method: str = "pca", dim: int = 256) -> Optional[EmbeddingProjection]:
+        """Обучить проекцию на эмбеддингах корпуса и сохранить ее вместе с индексом"""
+        with self._lock:
+            matrix, rows = self._raw_matrix()
+            if not rows:
+                print("Нет эмбеддингов для обучения проекции")
+                return None
+            
+            self.projection = EmbeddingProjection(method, dim).fit(matrix)
+            self.invalidate_index()
+            self.save_to_disk()
+            return self.projection
+    
+    def remove_projection(self):
+        """Вернуться к поиску по полным эмбеддингам"""
+        with self._lock:
+            self.projection = None
+            self.invalidate_index()
+            self.save_to_disk()
     
     def save_to_disk(self):
-        """Сохранить хранилище на диск"""
+        """Сохранить хранилище на диск
+        
+        Файл заменяется целиком через временный: другие воркеры не прочитают его наполовину записанным.
+        """
+        with self._lock:
+            self._write_to_disk()
+    
+    def _write_to_disk(self):
         data = {
             "documents": [
                 {
@@ -83,11 +270,15 @@ class VectorStore:
                 }
                 for doc in self.documents
             ],
-            "metadata": self.metadata
+            "metadata": self.metadata,
+            "projection": self.projection.to_dict() if self.projection is not None else None
         }
         
-        with open(os.path.join(self.storage_path, "vector_store.json"), "w", encoding="utf-8") as f:
+        store_path = os.path.join(self.storage_path, "vector_store.json")
+        tmp_path = f"{store_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, store_path)
     
     def load_from_disk(self):
         """Загрузить хранилище с диска"""
@@ -113,11 +304,15 @@ class VectorStore:
                         self.embeddings.append(doc.embedding)
                 
                 self.metadata.update(data.get("metadata", {}))
+                if data.get("projection"):
+                    self.projection = EmbeddingProjection.from_dict(data["projection"])
+                self.invalidate_index()
                 
             except Exception as e:
                 print(f"Ошибка при загрузке хранилища: {e}")
                 self.documents = []
                 self.embeddings = []
+                self.invalidate_index()
 
 class DocumentProcessor:
     """Процессор для обработки и векторизации документов"""
@@ -206,13 +401,22 @@ class KnowledgeBase:
         self.vector_store = VectorStore(storage_path)
         self.processor = DocumentProcessor()
         self.storage_path = storage_path
+        self._lexical_index: Optional[LexicalIndex] = None
+        self.cache = RetrievalCache()
         
         # Создаем директорию для документов
         self.docs_path = os.path.join(storage_path, "documents")
         os.makedirs(self.docs_path, exist_ok=True)
     
     def add_document_from_file(self, file_path: str, embedding_api=None) -> bool:
-        """Добавить документ из файла в базу знаний"""
+        """Добавить документ из файла в базу знаний
+        
+        Чанки файла, уже лежащие в хранилище с эмбеддингами той же модели, не
+        эмбеддятся заново; если файл не изменился, хранилище не перезаписывается.
+        Прежние чанки того же файла заменяются новыми. Если сервер эмбеддингов
+        недоступен, сохраненные векторы не трогаются, а чанки без эмбеддингов
+        в файл хранилища не записываются.
+        """
         if not os.path.exists(file_path):
             print(f"Файл {file_path} не найден")
             return False
@@ -222,51 +426,201 @@ class KnowledgeBase:
         if not documents:
             return False
         
+        filename = os.path.basename(file_path)
+        existing = self.vector_store.file_chunks(filename)
+        # None — модель проверить не удалось (сервер недоступен): сохраненные векторы остаются
+        if embedding_api and self._same_embedding_model(existing.values(), embedding_api) is False:
+            existing = {key: doc for key, doc in existing.items() if not doc.embedding}
+        
+        hashes = [hashlib.sha1(doc.content.encode("utf-8")).hexdigest() for doc in documents]
+        missing = []
+        for doc, key in zip(documents, hashes):
+            known = existing.get(key)
+            if known is not None and (known.embedding or not embedding_api):
+                doc.embedding = known.embedding
+            else:
+                missing.append(doc)
+        
+        stored_count = sum(1 for doc in self.vector_store.documents if doc.filename == filename)
+        if not missing and stored_count == len(documents) and set(existing) == set(hashes):
+            print(f"Файл {filename} уже в базе знаний ({len(documents)} чанков)")
+            return True
+        
         # Генерируем эмбеддинги, если есть API
-        if embedding_api:
-            print(f"Генерирую эмбеддинги для {len(documents)} чанков...")
-            for doc in documents:
-                try:
-                    embedding = embedding_api.get_embedding(doc.content)
+        if embedding_api and missing:
+            print(f"Генерирую эмбеддинги для {len(missing)} чанков...")
+            try:
+                if hasattr(embedding_api, "get_embeddings_batch"):
+                    embeddings = embedding_api.get_embeddings_batch([doc.content for doc in missing])
+                else:
+                    embeddings = [embedding_api.get_embedding(doc.content) for doc in missing]
+                for doc, embedding in zip(missing, embeddings):
                     doc.embedding = embedding
-                except Exception as e:
-                    print(f"Ошибка при генерации эмбеддинга: {e}")
+            except Exception as e:
+                print(f"Ошибка при генерации эмбеддинга: {e}")
+        
+        if embedding_api and any(not doc.embedding for doc in documents):
+            if stored_count:
+                # Не заменяем сохраненные векторы пустыми: файл переиндексируется при следующем запуске
+                print(f"⚠️  Сервер эмбеддингов недоступен: файл {filename} оставлен в базе без изменений")
+                return True
+            # Чанки без эмбеддингов доступны лексическому поиску, но на диск не попадают
+            print(f"⚠️  Сервер эмбеддингов недоступен: чанки файла {filename} не сохранены на диск")
+            self.vector_store.replace_documents(filename, documents, save=False)
+            return True
         
         # Сохраняем документы
-        self.vector_store.add_documents(documents)
+        self.vector_store.replace_documents(filename, documents)
         
         # Копируем файл в директорию документов
         import shutil
-        filename = os.path.basename(file_path)
         dest_path = os.path.join(self.docs_path, filename)
-        shutil.copy2(file_path, dest_path)
+        if os.path.abspath(file_path) != os.path.abspath(dest_path):
+            shutil.copy2(file_path, dest_path)
         
         print(f"Добавлено {len(documents)} чанков из файла {filename}")
         return True
     
+    @staticmethod
+    def _same_embedding_model(documents, embedding_api) -> Optional[bool]:
+        """Сохраненные эмбеддинги получены той же моделью: контрольный чанк дает тот же вектор
+
+        None — проверить не удалось (сервер эмбеддингов недоступен или нечего сравнивать).
+        """
+        sample = next((doc for doc in documents if doc.embedding), None)
+        if sample is None:
+            return None
+        try:
+            embedding = embedding_api.get_embedding(sample.content)
+        except Exception as e:
+            print(f"Ошибка при генерации эмбеддинга: {e}")
+            return None
+        if not embedding:
+            return None
+        if len(embedding) != len(sample.embedding):
+            return False
+        a = np.asarray(embedding, dtype=np.float32)
+        b = np.asarray(sample.embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+        return norm > 0 and float(a @ b) / norm > 0.999
+    
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        """Локальный n-граммный индекс документов (перестраивается при изменении базы)"""
+        documents = self.vector_store.documents
+        if (self._lexical_index is None or self._lexical_index.documents is not documents
+                or len(self._lexical_index) != len(documents)):
+            self._lexical_index = LexicalIndex(documents)
+        return self._lexical_index
+    
+    def embed_query(self, query: str, embedding_api) -> Optional[List[float]]:
+        """Эмбеддинг запроса через кэш; None, если сервер эмбеддингов недоступен"""
+        query_embedding = self.cache.get_embedding(query, embedding_api)
+        if query_embedding is None:
+            try:
+                query_embedding = embedding_api.get_embedding(query)
+            except Exception as e:
+                print(f"Ошибка при генерации эмбеддинга запроса: {e}")
+                query_embedding = None
+            if query_embedding is not None:
+                self.cache.set_embedding(query, embedding_api, query_embedding)
+        return query_embedding
+    
     def search(self, query: str, embedding_api=None, top_k: int = 5) -> List[Dict[str, Any]]:
         """Поиск по базе знаний"""
         if not embedding_api:
             return []
         
+        version = self.vector_store.version
+        cached = self.cache.get_results(query, embedding_api, version, top_k)
+        if cached is not None:
+            return cached
+        
         # Генерируем эмбеддинг для запроса
+        with timed("query_embedding"):
+            query_embedding = self.embed_query(query, embedding_api)
+        
+        # Если сервер эмбеддингов недоступен, ищем по локальному n-граммному индексу
+        # (такой результат не кэшируем, чтобы не закрепить временный сбой)
+        if query_embedding is None:
+            return self.lexical_index.search(query, top_k)
+        
+        # Ищем похожие документы
+        with timed("vector_search"):
+            results = self.vector_store.search(query_embedding, top_k)
+        self.cache.set_results(query, embedding_api, version, top_k, results)
+        return results
+    
+    def embed_queries(self, queries: List[str], embedding_api) -> List[Optional[List[float]]]:
+        """Эмбеддинги нескольких запросов: из кэша, а недостающие — одним пакетным вызовом"""
+        embeddings = [self.cache.get_embedding(query, embedding_api) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+        
         try:
-            query_embedding = embedding_api.get_embedding(query)
+            batch = embedding_api.get_embeddings_batch([queries[i] for i in missing])
         except Exception as e:
-            print(f"Ошибка при генерации эмбеддинга запроса: {e}")
+            print(f"Ошибка при генерации эмбеддингов запроса: {e}")
+            batch = [None] * len(missing)
+        for i, embedding in zip(missing, batch):
+            if embedding is not None:
+                embeddings[i] = embedding
+                self.cache.set_embedding(queries[i], embedding_api, embedding)
+        return embeddings
+    
+    def multi_search(self, queries: List[str], embedding_api=None, top_k: int = 5,
+                     rrf_k: int = 60) -> List[Dict[str, Any]]:
+        """Поиск по нескольким вариантам запроса с объединением результатов по рангам
+        
+        Варианты эмбеддятся одним пакетным вызовом, сходства считаются одним
+        матрично-матричным умножением, списки объединяются через RRF.
+        Каждый вариант дает кандидатов с запасом (2 * top_k), чтобы документ,
+        находящийся в середине нескольких списков, мог подняться в итоговый top_k.
+        """
+        queries = [query for query in queries if query and query.strip()]
+        if not embedding_api or not queries:
             return []
+        if len(queries) == 1:
+            return self.search(queries[0], embedding_api, top_k)
         
-        # Ищем похожие документы
-        results = self.vector_store.search(query_embedding, top_k)
+        version = self.vector_store.version
+        # Ключ отличается от одиночного search: параметры слияния входят в него
+        cache_key, fusion_key = "\n".join(queries), (top_k, "rrf", rrf_k)
+        cached = self.cache.get_results(cache_key, embedding_api, version, fusion_key)
+        if cached is not None:
+            return cached
+        
+        with timed("query_embedding"):
+            embeddings = self.embed_queries(queries, embedding_api)
+        valid = [embedding for embedding in embeddings if embedding is not None]
+        
+        # Сервер эмбеддингов недоступен — те же варианты по локальному n-граммному индексу
+        if not valid:
+            lexical = [self.lexical_index.search(query, 2 * top_k) for query in queries]
+            return reciprocal_rank_fusion(lexical, top_k, rrf_k)
+        
+        with timed("vector_search"):
+            result_lists = self.vector_store.search_many(valid, 2 * top_k)
+            results = reciprocal_rank_fusion(result_lists, top_k, rrf_k)
+        self.cache.set_results(cache_key, embedding_api, version, fusion_key, results)
         return results
     
+    def fit_projection(self, method: str = "pca", dim: int = 256) -> Optional[EmbeddingProjection]:
+        """Обучить проекцию эмбеддингов на текущем корпусе (запросы проецируются автоматически)"""
+        projection = self.vector_store.fit_projection(method, dim)
+        if projection is not None:
+            print(f"Проекция {projection.method}: {projection.input_dim} → {projection.dim}")
+        return projection
+    
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику базы знаний"""
         return {
             "total_documents": len(set(doc.filename for doc in self.vector_store.documents)),
             "total_chunks": len(self.vector_store.documents),
             "storage_path": self.storage_path,
-            "metadata": self.vector_store.metadata
+            "metadata": self.vector_store.metadata,
+            "cache": self.cache.get_stats()
         }
     
     def list_documents(self) -> List[str]:
@@ -277,6 +631,8 @@ class KnowledgeBase:
         """Очистить базу знаний"""
         self.vector_store.documents = []
         self.vector_store.embeddings = []
+        self.vector_store.projection = None
+        self.vector_store.invalidate_index()
         self.vector_store.metadata = {
             "created_at": datetime.now().isoformat(),
             "total_documents": 0,
@@ -0,0 +1,569 @@
+"""
+Пул серверов LM Studio для генерации: маршрутизация, проверка здоровья, лимиты и хеджирование
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class NoBackendAvailable(RuntimeError):
+    """Все серверы заняты до предела или недоступны дольше времени ожидания"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Крайний срок запроса истек; соединение с сервером закрыто, генерация прервана"""
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """Сколько осталось до крайнего срока (time.monotonic()); None — срока нет"""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Крайний срок запроса истек")
+    return remaining
+
+
+def _response_socket(response: requests.Response) -> Optional[socket.socket]:
+    """Сокет потокового ответа; None, если добраться не удалось
+
+    Ответы пула несут сокет, запомненный адаптером при подключении (lm_socket).
+    Для остальных — путь через внутренние атрибуты http.client под urllib3:
+    каждый шаг через getattr, поэтому после обновления библиотек поиск
+    возвращает None, а не падает.
+    """
+    sock = getattr(response, "lm_socket", None)
+    if sock is None:
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    return sock if isinstance(sock, socket.socket) else None
+
+
+def iter_lines_until(response: requests.Response, deadline: Optional[float]) -> Iterator[bytes]:
+    """Строки потокового ответа с общим крайним сроком
+
+    Ответ читается порциями по мере поступления (read1 urllib3 2.x), и перед
+    каждым чтением таймаут сокета пересчитывается по остатку срока: зависший
+    сервер не задержит ответ дольше deadline. По истечении срока бросается
+    DeadlineExceeded. Если сокет не найден или urllib3 старый, срок проверяется
+    между порциями, а в момент истечения ответ закрывается: соединение
+    освобождается с первым же пришедшим байтом.
+    """
+    raw = response.raw
+    sock = _response_socket(response) if deadline is not None else None
+    watchdog = None
+    if deadline is not None and sock is None:
+        watchdog = threading.Timer(max(deadline - time.monotonic(), 0.0), response.close)
+        watchdog.daemon = True
+        watchdog.start()
+    try:
+        if not hasattr(raw, "read1"):
+            for line in response.iter_lines(decode_unicode=False):
+                remaining_seconds(deadline)
+                yield line
+            remaining_seconds(deadline)
+            return
+
+        pending = b""
+        while True:
+            remaining = remaining_seconds(deadline)
+            if sock is not None:
+                try:
+                    sock.settimeout(remaining)
+                except OSError:
+                    sock = None
+            try:
+                chunk = raw.read1(8192, decode_content=True)
+            except Exception:
+                # Таймаут чтения сокета — истекший срок, остальное — ошибка соединения
+                remaining_seconds(deadline)
+                raise
+            if not chunk:
+                # Ответ, закрытый сторожем, выглядит как конец потока
+                remaining_seconds(deadline)
+                break
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending.rstrip(b"\r")
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+
+
+class _AbortableAdapter(HTTPAdapter):
+    """Адаптер одного запроса, запоминающий сокеты своих соединений
+
+    Сокет берется при подключении из публичных ConnectionCls пула и sock соединения.
+    abort() из другого потока закрывает сокет: ожидание ответа прерывается,
+    сервер видит разрыв соединения и прекращает генерацию.
+    """
+
+    def __init__(self):
+        super().__init__(pool_connections=1, pool_maxsize=1)
+        self.aborted = False
+        self._sockets: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def _track(self, pool):
+        adapter = self
+        base = pool.ConnectionCls
+        if getattr(base, "_tracked_by", None) is self:
+            return pool
+
+        class TrackedConnection(base):
+            _tracked_by = adapter
+
+            def connect(self):
+                super().connect()
+                sock = getattr(self, "sock", None)
+                if isinstance(sock, socket.socket):
+                    adapter._register(sock)
+
+        pool.ConnectionCls = TrackedConnection
+        return pool
+
+    def get_connection_with_tls_context(self, *args, **kwargs):
+        return self._track(super().get_connection_with_tls_context(*args, **kwargs))
+
+    def get_connection(self, *args, **kwargs):
+        return self._track(super().get_connection(*args, **kwargs))
+
+    def _register(self, sock: socket.socket):
+        with self._lock:
+            self._sockets.append(sock)
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @property
+    def socket(self) -> Optional[socket.socket]:
+        """Сокет последнего соединения или None"""
+        with self._lock:
+            return self._sockets[-1] if self._sockets else None
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            sockets = list(self._sockets)
+        for sock in sockets:
+            self._shutdown(sock)
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _session(adapter: _AbortableAdapter) -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class LLMBackend:
+    """Один сервер LM Studio: вес, лимит параллельных запросов, состояние и задержки"""
+
+    def __init__(self, url: str, weight: float = 1.0, max_concurrency: int = 4):
+        self.url = url.rstrip("/")
+        self.chat_endpoint = f"{self.url}/v1/chat/completions"
+        self.models_endpoint = f"{self.url}/v1/models"
+        self.weight = max(weight, 0.01)
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_check: Optional[float] = None
+        self.latencies: deque = deque(maxlen=200)
+        self.stats = {"requests": 0, "errors": 0, "hedges_won": 0}
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.outstanding < self.max_concurrency
+
+    @property
+    def load(self) -> float:
+        """Взвешенная загрузка с учетом нового запроса: меньше — лучше"""
+        return (self.outstanding + 1) / self.weight
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "p50_seconds": _percentile(self.latencies, 0.5),
+            "p95_seconds": _percentile(self.latencies, 0.95),
+            **self.stats
+        }
+
+
+def _percentile(values: Iterable[float], q: float) -> Optional[float]:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 3)
+
+
+def parse_backend_urls(value: str) -> List[Tuple[str, float]]:
+    """Разобрать список серверов «url[=вес], url[=вес]» (LM_STUDIO_URLS)"""
+    backends = []
+    for item in value.replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, weight = item, 1.0
+        if "=" in item:
+            head, tail = item.rsplit("=", 1)
+            try:
+                url, weight = head, float(tail)
+            except ValueError:
+                pass
+        backends.append((url.strip(), weight))
+    return backends
+
+
+class LLMBackendPool:
+    """Пул серверов для /v1/chat/completions
+
+    Запрос уходит на здоровый сервер с наименьшим числом выполняющихся запросов
+    относительно его веса (weighted least outstanding requests). У каждого сервера
+    свой лимит параллельных запросов: если все заняты, запрос ждет освобождения
+    до acquire_timeout. Фоновый поток раз в health_interval опрашивает /v1/models;
+    сервер, не ответивший failure_threshold раз подряд (проверкой или запросом),
+    исключается до следующей успешной проверки.
+
+    При hedge=True обычный запрос, не уложившийся в p95 задержки пула, дублируется
+    на другой свободный сервер и берется первый успешный ответ. Соединение
+    проигравшего запроса закрывается, и сервер прекращает его генерацию; пока оба
+    идут, хеджирование расходует запас мощности, поэтому включается явно.
+    Потоковые ответы не хеджируются.
+
+    Модели на всех серверах должны совпадать: список моделей берется у первого.
+    """
+
+    def __init__(self, backends: List[Tuple[str, float]], max_concurrency: int = 4,
+                 acquire_timeout: float = 30.0, health_interval: float = 10.0,
+                 health_timeout: float = 2.0, failure_threshold: int = 2,
+                 hedge: bool = False, hedge_min_samples: int = 20, hedge_min_delay: float = 0.5):
+        if not backends:
+            raise ValueError("Нужен хотя бы один сервер LM Studio")
+        self.backends = [LLMBackend(url, weight, max_concurrency) for url, weight in backends]
+        self.acquire_timeout = acquire_timeout
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failure_threshold = failure_threshold
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+
+        self._condition = threading.Condition()
+        self._latencies: deque = deque(maxlen=500)
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * max_concurrency * len(self.backends)),
+                                            thread_name_prefix="llm-pool")
+        self.stats = {"waits": 0, "rejected": 0, "hedged": 0, "hedges_won": 0, "hedges_cancelled": 0,
+                      "deadline_exceeded": 0}
+
+        self._health_thread: Optional[threading.Thread] = None
+        if health_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_loop, name="llm-pool-health", daemon=True)
+            self._health_thread.start()
+
+    @property
+    def primary_url(self) -> str:
+        return self.backends[0].url
+
+    # --- Выбор сервера ---
+
+    def _pick(self, exclude: Iterable[LLMBackend]) -> Optional[LLMBackend]:
+        candidates = [b for b in self.backends if b not in exclude and b.has_capacity]
+        healthy = [b for b in candidates if b.healthy]
+        # Если проверки считают недоступными все серверы, лучше попробовать, чем отказать
+        if healthy or any(b.healthy for b in self.backends):
+            candidates = healthy
+        if not candidates:
+            return None
+        best = min(b.load for b in candidates)
+        return random.choice([b for b in candidates if b.load == best])
+
+    def acquire(self, exclude: Iterable[LLMBackend] = (), timeout: Optional[float] = None) -> LLMBackend:
+        """Занять слот на лучшем сервере; ждет освобождения не дольше timeout"""
+        exclude = tuple(exclude)
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            backend = self._pick(exclude)
+            if backend is None and timeout > 0:
+                self.stats["waits"] += 1
+            while backend is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if timeout > 0:
+                        self.stats["rejected"] += 1
+                    raise NoBackendAvailable("Все серверы LM Studio заняты или недоступны")
+                self._condition.wait(remaining)
+                backend = self._pick(exclude)
+            backend.outstanding += 1
+            backend.stats["requests"] += 1
+            return backend
+
+    def release(self, backend: LLMBackend, ok: bool = True, latency: Optional[float] = None):
+        """Освободить слот и учесть результат запроса"""
+        with self._condition:
+            backend.outstanding -= 1
+            if ok:
+                backend.consecutive_failures = 0
+                if latency is not None:
+                    backend.latencies.append(latency)
+                    self._latencies.append(latency)
+            else:
+                backend.stats["errors"] += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.healthy = False
+            self._condition.notify_all()
+
+    # --- Проверка здоровья ---
+
+    def check_backend(self, backend: LLMBackend) -> bool:
+        try:
+            response = requests.get(backend.models_endpoint, timeout=self.health_timeout)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        with self._condition:
+            backend.last_check = time.monotonic()
+            if ok:
+                backend.healthy = True
+                backend.consecutive_failures = 0
+            else:
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.healthy = False
+            self._condition.notify_all()
+        return ok
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check_backend(backend)
+            time.sleep(self.health_interval)
+
+    # --- Запросы ---
+
+    def hedge_delay(self) -> Optional[float]:
+        """Задержка перед дублирующим запросом: p95 пула; None, пока данных мало"""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        return max(_percentile(self._latencies, 0.95), self.hedge_min_delay)
+
+    def _acquire_until(self, deadline: Optional[float], exclude: Iterable[LLMBackend] = ()) -> LLMBackend:
+        remaining = remaining_seconds(deadline)
+        timeout = self.acquire_timeout if remaining is None else min(self.acquire_timeout, remaining)
+        return self.acquire(exclude, timeout)
+
+    def _deadline_exceeded(self, backend: LLMBackend) -> DeadlineExceeded:
+        # Истекший срок запроса — не ошибка сервера: на здоровье не влияет
+        self.release(backend, ok=True)
+        with self._condition:
+            self.stats["deadline_exceeded"] += 1
+        return DeadlineExceeded("Сервер LM Studio не ответил до крайнего срока запроса")
+
+    def _post(self, backend: LLMBackend, payload: Dict[str, Any], timeout: Optional[float],
+              adapter: Optional[_AbortableAdapter] = None) -> requests.Response:
+        """POST на сервер; с adapter запрос можно оборвать из другого потока (хеджирование)"""
+        started = time.monotonic()
+        session = _session(adapter) if adapter is not None else None
+        try:
+            response = (session or requests).post(backend.chat_endpoint, json=payload,
+                                                  headers={"Content-Type": "application/json"}, timeout=timeout)
+        except Exception as e:
+            if adapter is not None and adapter.aborted:
+                # Проигравший хедж оборван намеренно: сервер здоров
+                self.release(backend, ok=True)
+                with self._condition:
+                    self.stats["hedges_cancelled"] += 1
+                raise
+            if isinstance(e, requests.exceptions.ReadTimeout):
+                raise self._deadline_exceeded(backend)
+            self.release(backend, ok=False)
+            raise
+        finally:
+            if session is not None:
+                session.close()
+        # 4xx — ошибка запроса, а не сервера: на здоровье не влияет
+        self.release(backend, ok=response.status_code < 500,
+                     latency=time.monotonic() - started if response.status_code == 200 else None)
+        if adapter is not None and adapter.aborted:
+            # Сокет проигравшего не удалось оборвать: ответ дошел, но уже не нужен
+            with self._condition:
+                self.stats["hedges_cancelled"] += 1
+        response.backend_url = backend.url
+        return response
+
+    def complete(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> requests.Response:
+        """Обычный (не потоковый) запрос к лучшему серверу, с хеджированием при hedge=True
+
+        deadline — крайний срок (time.monotonic()): по его истечении соединение
+        закрывается и бросается DeadlineExceeded.
+        """
+        primary = self._acquire_until(deadline)
+        try:
+            timeout = remaining_seconds(deadline)
+        except DeadlineExceeded:
+            raise self._deadline_exceeded(primary)
+        delay = self.hedge_delay() if self.hedge and len(self.backends) > 1 else None
+        if delay is None:
+            return self._post(primary, payload, timeout)
+
+        futures = {}
+        adapters = {}
+
+        def submit(backend: LLMBackend):
+            adapter = _AbortableAdapter()
+            future = self._executor.submit(self._post, backend, payload, timeout, adapter)
+            futures[future] = backend
+            adapters[future] = adapter
+
+        submit(primary)
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            try:
+                second = self.acquire(exclude=(primary,), timeout=0)
+            except NoBackendAvailable:
+                second = None
+            if second is not None:
+                with self._condition:
+                    self.stats["hedged"] += 1
+                submit(second)
+
+        # Первый успешный ответ; если успешных нет — последний полученный ответ или ошибка
+        error: Optional[Exception] = None
+        failed_response: Optional[requests.Response] = None
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if response.status_code != 200:
+                        failed_response = response
+                        continue
+                    if futures[future] is not primary:
+                        with self._condition:
+                            self.stats["hedges_won"] += 1
+                            futures[future].stats["hedges_won"] += 1
+                    return response
+        finally:
+            # Проигравший запрос не должен генерировать впустую и занимать слот сервера;
+            # если его сокет не найден, ответ закрывается, как только придет
+            for future in pending:
+                adapters[future].abort()
+                future.add_done_callback(_close_response)
+        if failed_response is not None:
+            return failed_response
+        raise error or NoBackendAvailable("Нет ответа ни от одного сервера LM Studio")
+
+    @contextmanager
+    def stream(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> Iterator[requests.Response]:
+        """Потоковый запрос к лучшему серверу; слот освобождается при выходе из блока
+
+        Закрытие ответа при выходе из блока обрывает генерацию на сервере. Срок
+        deadline ограничивает ожидание заголовков; тело ответа читается через
+        iter_lines_until, который пересчитывает таймаут чтения по остатку срока.
+        """
+        backend = self._acquire_until(deadline)
+        ok = False
+        # Адаптер запоминает сокет соединения: по нему iter_lines_until ограничивает чтение сроком
+        adapter = _AbortableAdapter()
+        session = _session(adapter)
+        try:
+            response = session.post(backend.chat_endpoint, json=payload,
+                                    headers={"Content-Type": "application/json"},
+                                    stream=True, timeout=remaining_seconds(deadline))
+        except (DeadlineExceeded, requests.exceptions.ReadTimeout):
+            session.close()
+            raise self._deadline_exceeded(backend)
+        except Exception:
+            session.close()
+            self.release(backend, ok=False)
+            raise
+        try:
+            response.backend_url = backend.url
+            response.lm_socket = adapter.socket
+            yield response
+            ok = response.status_code < 500
+        except DeadlineExceeded:
+            ok = True
+            with self._condition:
+                self.stats["deadline_exceeded"] += 1
+            raise
+        except GeneratorExit:
+            # Клиент отключился: сервер здоров, ответ просто больше не нужен
+            ok = True
+            raise
+        finally:
+            response.close()
+            session.close()
+            self.release(backend, ok=ok)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "backends": [backend.get_stats() for backend in self.backends],
+                "hedge": self.hedge,
+                "hedge_delay_seconds": self.hedge_delay(),
+                **self.stats
+            }
+
+
+_pools: Dict[Tuple[str, ...], LLMBackendPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_llm_pool(base_url: Optional[str] = None) -> LLMBackendPool:
+    """Общий для процесса пул серверов
+
+    Серверы берутся из LM_STUDIO_URLS («http://gpu1:1234=2,http://gpu2:1234»),
+    иначе пул из одного base_url (по умолчанию LM_STUDIO_URL или localhost:1234).
+    LM_STUDIO_MAX_CONCURRENCY — лимит запросов на сервер в каждом процессе,
+    LM_STUDIO_HEDGE=1 включает хеджирование.
+    """
+    base_url = base_url or os.getenv("LM_STUDIO_URL", "http://localhost:1234")
+    backends = parse_backend_urls(os.getenv("LM_STUDIO_URLS", "")) or [(base_url, 1.0)]
+    key = tuple(f"{url}={weight}" for url, weight in backends)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = LLMBackendPool(
+                backends,
+                max_concurrency=int(os.getenv("LM_STUDIO_MAX_CONCURRENCY", "4")),
+                hedge=os.getenv("LM_STUDIO_HEDGE", "0").lower() in ("1", "true", "yes")
+            )
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,114 @@
+"""
+Локальные эмбеддинги без модели: хэширование символьных n-грамм с опциональным TF-IDF
+
+Работает в процессе за микросекунды и подходит как быстрый основной или резервный
+ретривер для небольшой русскоязычной базы знаний ВОККДЦ.
+"""
+
+import re
+import zlib
+import numpy as np
+from typing import List, Dict, Any, Optional, Iterable
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddingAPI:
+    """Эмбеддинги на хэшированных символьных n-граммах (интерфейс совместим с EmbeddingAPI)"""
+
+    model_name = "local-hashing-ngrams"
+
+    def __init__(self, embedding_dim: int = 2048, ngram_range: tuple = (2, 4), use_tfidf: bool = False):
+        self.embedding_dim = embedding_dim
+        self.ngram_range = ngram_range
+        self.use_tfidf = use_tfidf
+        self.idf: Optional[np.ndarray] = None
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Нижний регистр, ё → е, только буквенно-цифровые слова"""
+        return " ".join(_WORD_RE.findall(text.lower().replace("ё", "е")))
+
+    def _ngrams(self, text: str) -> Iterable[str]:
+        """Символьные n-граммы слов с граничными пробелами"""
+        min_n, max_n = self.ngram_range
+        for word in self.normalize_text(text).split():
+            padded = f" {word} "
+            for n in range(min_n, max_n + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n]
+
+    def _term_vector(self, text: str) -> np.ndarray:
+        """Вектор сублинейных частот со знаковым хэшированием (без нормализации)"""
+        # crc32 стабилен между процессами, в отличие от встроенного hash()
+        hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in self._ngrams(text)), dtype=np.uint32)
+        if hashes.size == 0:
+            return np.zeros(self.embedding_dim, dtype=np.float32)
+        signs = np.where(hashes >> 31, 1.0, -1.0)
+        counts = np.bincount(hashes % self.embedding_dim, weights=signs, minlength=self.embedding_dim)
+        return (np.sign(counts) * (1.0 + np.log(np.maximum(np.abs(counts), 1.0)))).astype(np.float32)
+
+    def fit(self, texts: List[str]) -> "HashingEmbeddingAPI":
+        """Посчитать IDF по корпусу (используется при use_tfidf=True)"""
+        df = np.zeros(self.embedding_dim, dtype=np.float32)
+        for text in texts:
+            df += self._term_vector(text) != 0
+        self.idf = (np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0).astype(np.float32)
+        return self
+
+    def get_available_models(self) -> List[str]:
+        """Получить список доступных моделей"""
+        return [self.model_name]
+
+    def get_embeddings_matrix(self, texts: List[str]) -> np.ndarray:
+        """Матрица L2-нормализованных эмбеддингов (len(texts) x embedding_dim, float32)"""
+        matrix = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self._term_vector(text)
+        if self.use_tfidf and self.idf is not None:
+            matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
+    def get_embedding(self, text: str, model: str = None) -> List[float]:
+        """Получить эмбеддинг для текста"""
+        return self.get_embeddings_matrix([text])[0].tolist()
+
+    def get_embeddings_batch(self, texts: List[str], model: str = None) -> List[List[float]]:
+        """Получить эмбеддинги для списка текстов"""
+        return self.get_embeddings_matrix(texts).tolist()
+
+
+class LexicalIndex:
+    """Индекс документов базы знаний на HashingEmbeddingAPI с TF-IDF"""
+
+    def __init__(self, documents: list, embedding_dim: int = 2048):
+        self.documents = documents
+        self.embedder = HashingEmbeddingAPI(embedding_dim=embedding_dim, use_tfidf=True)
+        texts = [doc.content for doc in documents]
+        self.embedder.fit(texts)
+        self.matrix = self.embedder.get_embeddings_matrix(texts)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def score(self, query: str) -> np.ndarray:
+        """Косинусное сходство запроса со всеми документами"""
+        if not self.documents:
+            return np.zeros(0, dtype=np.float32)
+        return self.matrix @ self.embedder.get_embeddings_matrix([query])[0]
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Поиск похожих документов (формат результатов как у VectorStore.search)"""
+        scores = self.score(query)
+        if scores.size == 0:
+            return []
+        top_k = min(top_k, scores.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {"document": self.documents[i], "similarity": float(scores[i]), "index": int(i)}
+            for i in best
+        ]
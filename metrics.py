@@ -0,0 +1,245 @@
+"""
+Метрики Prometheus по этапам обработки вопроса (экспорт — /metrics в widget_server)
+
+prometheus_client импортируется лениво, при первом измерении: модуль можно
+импортировать из движка без затрат на старте, а без установленной библиотеки
+все функции ничего не делают. Под gunicorn с несколькими воркерами задайте
+PROMETHEUS_MULTIPROC_DIR (это делает gunicorn.conf.py) — значения всех
+воркеров суммируются при выгрузке.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Этапы обработки вопроса для гистограммы vodc_stage_seconds
+STAGES = (
+    "synonym_expansion",
+    "query_embedding",
+    "vector_search",
+    "prompt_build",
+    "admission_wait",
+    "llm_ttft",
+    "llm_total",
+)
+
+# Общие границы корзин: от миллисекунды (поиск, кэш) до минуты (генерация)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+_metrics: Optional[Dict[str, Any]] = None
+_lock = threading.Lock()
+
+# Средняя длина ответа (токены) для оценки несгенерированных токенов прерванных генераций
+_completion_tokens_avg: Optional[float] = None
+
+
+def _get_metrics() -> Optional[Dict[str, Any]]:
+    """Создать метрики при первом обращении; None, если prometheus_client не установлен"""
+    global _metrics
+    if _metrics is not None:
+        return _metrics or None
+    with _lock:
+        if _metrics is not None:
+            return _metrics or None
+        try:
+            from prometheus_client import Counter, Gauge, Histogram
+        except ImportError:
+            _metrics = {}
+            return None
+
+        _metrics = {
+            "stage": Histogram(
+                "vodc_stage_seconds", "Длительность этапов обработки вопроса",
+                ["stage"], buckets=LATENCY_BUCKETS
+            ),
+            "tokens_per_second": Histogram(
+                "vodc_llm_tokens_per_second", "Скорость генерации по usage ответа LM Studio",
+                buckets=TOKENS_PER_SECOND_BUCKETS
+            ),
+            "tokens": Counter(
+                "vodc_llm_tokens", "Токены промпта, ответа и взятые из KV-кэша префикса",
+                ["kind"]
+            ),
+            "answers": Counter(
+                "vodc_answers", "Ответы по маршруту: без LLM (small_talk, faq, facts, lookup, semantic_cache), rag или coalesced",
+                ["route"]
+            ),
+            "cancelled": Counter(
+                "vodc_llm_cancelled", "Прерванные генерации: клиент отключился (disconnect) или истек срок (deadline)",
+                ["reason"]
+            ),
+            "tokens_avoided": Counter(
+                "vodc_llm_tokens_avoided", "Токены, которые сервер не сгенерировал впустую после прерывания (оценка)",
+                ["reason"]
+            ),
+            "admission": Counter(
+                "vodc_admission", "Решения контроля допуска к генерации по полосам",
+                ["lane", "outcome"]
+            ),
+            "sessions_evicted": Counter(
+                "vodc_sessions_evicted", "Удаленные сессии чата: idle — по простою, capacity — по лимиту числа",
+                ["reason"]
+            ),
+            # livesum: сумма по живым воркерам; livemax: база одинакова во всех воркерах
+            "sessions": Gauge("vodc_active_sessions", "Активные сессии чата", multiprocess_mode="livesum"),
+            "cache_entries": Gauge(
+                "vodc_cache_entries", "Записей в кэшах", ["cache"], multiprocess_mode="livesum"
+            ),
+            "kb_chunks": Gauge("vodc_kb_chunks", "Чанков в базе знаний", multiprocess_mode="livemax"),
+        }
+        # Серии всех этапов видны в /metrics с нулями еще до первого запроса
+        for stage in STAGES:
+            _metrics["stage"].labels(stage=stage)
+        return _metrics
+
+
+def observe_stage(stage: str, seconds: float):
+    """Записать длительность этапа (секунды)"""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["stage"].labels(stage=stage).observe(seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Измерить длительность блока как этап stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def observe_llm(total_seconds: float, ttft_seconds: Optional[float] = None,
+                usage: Optional[Dict[str, Any]] = None):
+    """Записать время ответа LLM, время до первого токена и скорость генерации по usage
+
+    Скорость считается по времени генерации: от первого токена до конца для
+    потокового ответа, иначе по полному времени запроса.
+    """
+    global _completion_tokens_avg
+    metrics = _get_metrics()
+    if metrics is None:
+        return
+    metrics["stage"].labels(stage="llm_total").observe(total_seconds)
+    if ttft_seconds is not None:
+        metrics["stage"].labels(stage="llm_ttft").observe(ttft_seconds)
+    if not usage:
+        return
+
+    completion_tokens = usage.get("completion_tokens") or 0
+    if completion_tokens:
+        _completion_tokens_avg = (completion_tokens if _completion_tokens_avg is None
+                                  else 0.9 * _completion_tokens_avg + 0.1 * completion_tokens)
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    metrics["tokens"].labels(kind="prompt").inc(usage.get("prompt_tokens") or 0)
+    metrics["tokens"].labels(kind="completion").inc(completion_tokens)
+    metrics["tokens"].labels(kind="cached").inc(cached_tokens)
+
+    generation_seconds = total_seconds - (ttft_seconds or 0.0)
+    if completion_tokens and generation_seconds > 0:
+        metrics["tokens_per_second"].observe(completion_tokens / generation_seconds)
+
+
+def count_answer(route: str):
+    """Учесть ответ, выданный по маршруту route"""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["answers"].labels(route=route).inc()
+
+
+def count_cancelled(reason: str, max_tokens: int, received_tokens: int = 0):
+    """Учесть прерванную генерацию и оценку токенов, которые сервер не сгенерировал
+
+    Ответ закончился бы на средней длине ответа (пока ее нет — на max_tokens);
+    полученные до прерывания токены вычитаются.
+    """
+    metrics = _get_metrics()
+    if metrics is None:
+        return
+    expected = min(max_tokens, _completion_tokens_avg or max_tokens)
+    metrics["cancelled"].labels(reason=reason).inc()
+    metrics["tokens_avoided"].labels(reason=reason).inc(max(expected - received_tokens, 0))
+
+
+def count_admission(lane: str, outcome: str):
+    """Учесть решение контроля допуска: admitted, rejected_full, rejected_wait, timeouts"""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["admission"].labels(lane=lane, outcome=outcome).inc()
+
+
+def count_session_evicted(reason: str):
+    """Учесть удаленную сессию: idle (простой дольше TTL) или capacity (лимит числа сессий)"""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["sessions_evicted"].labels(reason=reason).inc()
+
+
+def process_memory() -> Dict[str, Optional[float]]:
+    """Память процесса воркера в МБ: текущий RSS (Linux, /proc) и пиковый (getrusage)"""
+    rss_mb = None
+    try:
+        with open("/proc/self/statm") as statm:
+            rss_mb = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        pass
+    peak_mb = None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux сообщает килобайты, macOS — байты
+        peak_mb = peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+    except ImportError:
+        pass
+    return {
+        "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+        "peak_rss_mb": round(peak_mb, 1) if peak_mb is not None else None
+    }
+
+
+def set_gauges(sessions: Optional[int] = None, caches: Optional[Dict[str, int]] = None,
+               kb_chunks: Optional[int] = None):
+    """Обновить текущие значения: сессии, размеры кэшей, размер базы знаний"""
+    metrics = _get_metrics()
+    if metrics is None:
+        return
+    if sessions is not None:
+        metrics["sessions"].set(sessions)
+    for cache, size in (caches or {}).items():
+        metrics["cache_entries"].labels(cache=cache).set(size)
+    if kb_chunks is not None:
+        metrics["kb_chunks"].set(kb_chunks)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Текст метрик для /metrics и его Content-Type
+
+    С PROMETHEUS_MULTIPROC_DIR значения собираются из файлов всех воркеров.
+    """
+    if _get_metrics() is None:
+        return "# prometheus_client не установлен\n".encode("utf-8"), "text/plain; charset=utf-8"
+
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Удалить live-гейджи завершившегося воркера (хук child_exit в gunicorn.conf.py)"""
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(pid)
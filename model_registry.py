@@ -0,0 +1,123 @@
+"""
+Общий для процесса реестр моделей LM Studio с TTL и фоновым обновлением
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+
+class ModelRegistry:
+    """Кэш списка моделей /v1/models
+
+    Устаревший список отдается сразу, а обновление запускается в фоновом потоке
+    (stale-while-revalidate), поэтому путь обработки сообщения не ждет обнаружения моделей.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:1234", ttl_seconds: float = 60.0,
+                 request_timeout: float = 5.0, default_model: Optional[str] = None):
+        self.base_url = base_url
+        self.models_endpoint = f"{base_url}/v1/models"
+        self.ttl_seconds = ttl_seconds
+        self.request_timeout = request_timeout
+        # Модель на случай, когда список еще ни разу не был получен
+        self.default_model = default_model or os.getenv("LM_STUDIO_MODEL")
+
+        self._models: List[str] = []
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.last_error: Optional[str] = None
+        self.refresh_count = 0
+
+    @staticmethod
+    def _is_chat_model(model_id: str) -> bool:
+        # LM Studio отдает в /v1/models и модели эмбеддингов
+        return "embed" not in model_id.lower()
+
+    @property
+    def is_stale(self) -> bool:
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl_seconds
+
+    def refresh(self) -> List[str]:
+        """Синхронно запросить список моделей и обновить кэш"""
+        try:
+            response = requests.get(self.models_endpoint, timeout=self.request_timeout)
+            if response.status_code == 200:
+                data = response.json()
+                models = [model["id"] for model in data.get("data", [])]
+                with self._lock:
+                    self._models = models
+                    self._fetched_at = time.monotonic()
+                    self.last_error = None
+                    self.refresh_count += 1
+            else:
+                self.last_error = f"Ошибка при получении списка моделей: {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            self.last_error = f"Ошибка при подключении к LM Studio: {e}"
+        except ValueError as e:
+            self.last_error = f"Некорректный ответ /v1/models: {e}"
+        return list(self._models)
+
+    def refresh_async(self):
+        """Запустить обновление в фоне, если оно еще не идет"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_run, name="model-registry-refresh", daemon=True).start()
+
+    def get_models(self, wait: bool = False) -> List[str]:
+        """Список моделей из кэша; при устаревании обновляется в фоне
+
+        wait=True блокирует только если список еще ни разу не был получен
+        (для интерактивных ботов и проверки подключения).
+        """
+        if self._fetched_at is None and wait:
+            return self.refresh()
+        if self.is_stale:
+            self.refresh_async()
+        return list(self._models)
+
+    def get_default_model(self) -> Optional[str]:
+        """Модель для чата без ожидания обнаружения
+
+        Ждать приходится только при холодном старте процесса без LM_STUDIO_MODEL,
+        если фоновый прогрев еще не успел получить список.
+        """
+        models = [m for m in self.get_models(wait=self.default_model is None) if self._is_chat_model(m)]
+        if models:
+            return models[0]
+        return self.default_model
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "models": list(self._models),
+            "age_seconds": round(time.monotonic() - self._fetched_at, 1) if self._fetched_at else None,
+            "refresh_count": self.refresh_count,
+            "last_error": self.last_error
+        }
+
+
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(base_url: str = "http://localhost:1234") -> ModelRegistry:
+    """Получить общий для процесса реестр моделей указанного сервера"""
+    with _registries_lock:
+        registry = _registries.get(base_url)
+        if registry is None:
+            registry = ModelRegistry(base_url)
+            _registries[base_url] = registry
+        return registry
@@ -0,0 +1,195 @@
+"""
+Упреждающий прогрев кэшей поиска по набираемому в виджете вопросу
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from retrieval_cache import normalize_query
+
+
+class _Bucket:
+    """Маркерное ведро одного клиента"""
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+
+class _SessionPrefetch:
+    """Состояние прогрева одной сессии"""
+
+    def __init__(self):
+        self.updated_at = time.monotonic()
+        self.running: Optional[str] = None
+        self.pending: Optional[str] = None
+        self.last_warmed: Optional[str] = None
+        self.done = threading.Event()
+        self.done.set()
+
+
+class PrefetchScheduler:
+    """Планировщик прогрева: ограничение частоты, отмена устаревших префиксов
+
+    На сессию выполняется не больше одного прогрева; пока он идет, новый префикс
+    замещает ожидающий (устаревшие отбрасываются, не дойдя до сервера эмбеддингов).
+    Сессия виджета для этого не нужна: session_id придумывает браузер, и первый
+    вопрос посетителя прогревается до того, как /chat создаст сессию.
+    Частота ограничивается маркерным ведром на пару (адрес клиента, session_id),
+    общий параллелизм — пулом потоков. Сессий с незавершенным прогревом не больше
+    max_backlog: сверх него прогрев отбрасывается, а не копится в очереди пула.
+    Состояний сессий и ведер не больше max_tracked: при переполнении забываются
+    давно не обращавшиеся, поэтому поток случайных session_id не растит память.
+    """
+
+    def __init__(self, warm: Callable[[Any, str], None], max_workers: int = 2,
+                 rate_per_second: float = 2.0, burst: int = 4, min_chars: int = 6,
+                 idle_ttl_seconds: float = 600.0, max_backlog: int = 8, max_tracked: int = 4096):
+        self.warm = warm
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.min_chars = min_chars
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_backlog = max_backlog
+        self.max_tracked = max(max_tracked, 1)
+        self._backlog = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        # Порядок — от давно не обращавшихся к недавним
+        self._sessions: "OrderedDict[str, _SessionPrefetch]" = OrderedDict()
+        self._buckets: "OrderedDict[Hashable, _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "started": 0,
+            "completed": 0,
+            "superseded": 0,
+            "cancelled": 0,
+            "throttled": 0,
+            "dropped": 0,
+            "skipped": 0,
+            "errors": 0,
+            "waited_on_send": 0
+        }
+
+    def _state(self, session_id: str) -> _SessionPrefetch:
+        state = self._sessions.get(session_id)
+        if state is None:
+            # Выполняющийся прогрев держит свое состояние сам: забывается только ожидающее
+            for stale_id in [sid for sid, stale in self._sessions.items() if stale.running is None]:
+                if len(self._sessions) < self.max_tracked:
+                    break
+                del self._sessions[stale_id]
+            state = _SessionPrefetch()
+            self._sessions[session_id] = state
+        self._sessions.move_to_end(session_id)
+        state.updated_at = time.monotonic()
+        return state
+
+    def _take_token(self, client: Hashable) -> bool:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            while len(self._buckets) >= self.max_tracked:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[client] = _Bucket(self.burst)
+        self._buckets.move_to_end(client)
+        now = time.monotonic()
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate_per_second)
+        bucket.updated_at = now
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def submit(self, session_id: str, target: Any, text: str, client: Optional[str] = None) -> str:
+        """Запланировать прогрев; возвращает статус: started | queued | throttled | dropped | skipped
+
+        client — адрес клиента: частота ограничивается для пары (client, session_id).
+        """
+        text = text.strip()
+        key = normalize_query(text)
+        with self._lock:
+            self.stats["requests"] += 1
+            state = self._state(session_id)
+            if len(key) < self.min_chars or key in (state.last_warmed, state.running):
+                self.stats["skipped"] += 1
+                return "skipped"
+            if not self._take_token((client, session_id)):
+                self.stats["throttled"] += 1
+                return "throttled"
+            if state.running is not None:
+                if state.pending is not None:
+                    self.stats["superseded"] += 1
+                state.pending = text
+                return "queued"
+            if self._backlog >= self.max_backlog:
+                self.stats["dropped"] += 1
+                return "dropped"
+            self._backlog += 1
+            state.running = key
+            state.done.clear()
+            self.stats["started"] += 1
+
+        self._executor.submit(self._run, session_id, state, target, text)
+        return "started"
+
+    def _run(self, session_id: str, state: _SessionPrefetch, target: Any, text: str):
+        while True:
+            try:
+                self.warm(target, text)
+                with self._lock:
+                    self.stats["completed"] += 1
+                    state.last_warmed = normalize_query(text)
+            except Exception as e:
+                print(f"Ошибка прогрева кэша для сессии {session_id}: {e}")
+                with self._lock:
+                    self.stats["errors"] += 1
+
+            with self._lock:
+                if state.pending is None:
+                    state.running = None
+                    state.done.set()
+                    self._backlog -= 1
+                    return
+                text, state.pending = state.pending, None
+                state.running = normalize_query(text)
+                self.stats["started"] += 1
+
+    def settle(self, session_id: str, message: str, timeout: float = 0.3):
+        """Вызвать перед отправкой сообщения: отменить устаревший префикс,
+        а если прямо сейчас прогревается этот же вопрос — дождаться его (не дольше
+        timeout), чтобы не запрашивать эмбеддинг повторно"""
+        key = normalize_query(message)
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return
+            if state.pending is not None:
+                self.stats["cancelled"] += 1
+                state.pending = None
+            wait = state.running == key
+            if wait:
+                self.stats["waited_on_send"] += 1
+        if wait:
+            state.done.wait(timeout)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def sweep(self):
+        """Удалить состояние давно неактивных сессий и клиентов"""
+        deadline = time.monotonic() - self.idle_ttl_seconds
+        with self._lock:
+            for session_id in [sid for sid, state in self._sessions.items()
+                               if state.updated_at < deadline and state.running is None]:
+                del self._sessions[session_id]
+            for client in [client for client, bucket in self._buckets.items() if bucket.updated_at < deadline]:
+                del self._buckets[client]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "clients": len(self._buckets),
+                    "backlog": self._backlog, **self.stats}
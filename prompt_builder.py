@@ -0,0 +1,391 @@
+"""
+Сборка промпта в пределах бюджета токенов с быстрой оценкой токенов для русского текста
+
+Оценка сверяется с usage.prompt_tokens сервера: размеры промптов (без текста)
+копятся в журнале, по которому подбирается поправочный коэффициент оценки:
+
+    python prompt_builder.py prompt_usage.jsonl   # → PROMPT_TOKEN_SCALE
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_DIGIT_RE = re.compile(r"[0-9]")
+_SPACE_RE = re.compile(r"\s")
+
+CONTEXT_HEADER = "\n\nКонтекст из базы знаний:\n"
+CONTEXT_FOOTER = "\n\nИспользуйте этот контекст для ответа на вопрос пользователя."
+QUESTION_HEADER = "\n\nВопрос пользователя: "
+
+
+class TokenCounter(Protocol):
+    """Что PromptBuilder ожидает от оценщика: число токенов в тексте"""
+
+    def count(self, text: str) -> int:
+        ...
+
+
+def char_classes(text: str) -> Tuple[int, int, int, int]:
+    """Число символов кириллицы, латиницы, цифр и прочих (без пробелов)"""
+    # re.sub работает в C и быстрее посимвольного цикла на длинных чанках
+    total = len(text)
+    cyrillic = total - len(_CYRILLIC_RE.sub("", text))
+    latin = total - len(_LATIN_RE.sub("", text))
+    digits = total - len(_DIGIT_RE.sub("", text))
+    spaces = total - len(_SPACE_RE.sub("", text))
+    return cyrillic, latin, digits, total - cyrillic - latin - digits - spaces
+
+
+class CharHeuristicEstimator:
+    """Оценка числа токенов по классам символов без токенизатора
+
+    Коэффициенты (символов на токен) подобраны для BPE-словарей Llama 3 / Qwen:
+    кириллица режется мельче латиницы, цифры — почти по одной-две,
+    пунктуация — отдельными токенами. scale поправляет оценку под словарь
+    загруженной модели и подбирается по usage.prompt_tokens (fit_token_scale).
+    """
+
+    def __init__(self, cyrillic_chars_per_token: float = 3.0, latin_chars_per_token: float = 4.0,
+                 digit_chars_per_token: float = 2.0, other_chars_per_token: float = 1.0,
+                 scale: float = 1.0):
+        self.cyrillic_chars_per_token = cyrillic_chars_per_token
+        self.latin_chars_per_token = latin_chars_per_token
+        self.digit_chars_per_token = digit_chars_per_token
+        self.other_chars_per_token = other_chars_per_token
+        self.scale = scale
+
+    def raw(self, classes: Tuple[int, int, int, int]) -> float:
+        """Оценка без поправки scale по числу символов каждого класса"""
+        cyrillic, latin, digits, other = classes
+        return (cyrillic / self.cyrillic_chars_per_token
+                + latin / self.latin_chars_per_token
+                + digits / self.digit_chars_per_token
+                + other / self.other_chars_per_token)
+
+    def count(self, text: str) -> int:
+        """Оценка числа токенов в тексте"""
+        if not text:
+            return 0
+        return max(1, int(round(self.raw(char_classes(text)) * self.scale)))
+
+
+class CallableTokenizer:
+    """Обертка над настоящим токенизатором модели (tiktoken, transformers и т.п.)
+
+        PromptBuilder(estimator=CallableTokenizer(tokenizer.encode))
+    """
+
+    def __init__(self, encode: Callable[[str], list]):
+        self.encode = encode
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text)) if text else 0
+
+
+@dataclass
+class PromptBuildResult:
+    """Собранные сообщения и отчет о размере промпта"""
+    messages: List[Dict[str, str]]
+    max_tokens: int
+    prompt_tokens: int
+    breakdown: Dict[str, int] = field(default_factory=dict)
+    context_chunks_used: int = 0
+    context_chunks_dropped: int = 0
+    context_chunks_truncated: int = 0
+    history_messages_used: int = 0
+    history_messages_dropped: int = 0
+    # Отпечаток выбранного контекста: одинаковый вопрос с тем же контекстом дает тот же промпт
+    context_fingerprint: str = ""
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "max_tokens": self.max_tokens,
+            "breakdown": dict(self.breakdown),
+            "context_chunks": {
+                "used": self.context_chunks_used,
+                "dropped": self.context_chunks_dropped,
+                "truncated": self.context_chunks_truncated
+            },
+            "history_messages": {
+                "used": self.history_messages_used,
+                "dropped": self.history_messages_dropped
+            }
+        }
+
+
+class PromptBuilder:
+    """Распределяет бюджет контекстного окна между системным промптом, контекстом RAG и историей
+
+    Системный промпт и вопрос пользователя включаются всегда. Остаток делится
+    между контекстом (context_share) и историей; неиспользованная часть одной
+    доли переходит другой. Первыми отбрасываются наименее релевантные чанки
+    (последний влезающий обрезается) и самые старые сообщения истории.
+
+    Раскладка layout="system" добавляет контекст к системному промпту, поэтому
+    первое сообщение меняется на каждом ходе. layout="user" оставляет системный
+    промпт байт-в-байт неизменным, а контекст и краткое содержание помещает в
+    последнее сообщение пользователя: сервер переиспользует KV-кэш общего префикса
+    (системный промпт и история) и не пересчитывает его заново.
+    """
+
+    LAYOUTS = ("system", "user")
+
+    MESSAGE_OVERHEAD_TOKENS = 4  # служебные токены шаблона чата на сообщение
+
+    def __init__(self, context_window: int = 4096, max_response_tokens: int = 1024,
+                 context_share: float = 0.6, max_history_messages: int = 10,
+                 min_chunk_tokens: int = 48, estimator: Optional[TokenCounter] = None, layout: str = "user"):
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Неизвестная раскладка промпта: {layout}")
+        self.layout = layout
+        self.context_window = context_window
+        self.max_response_tokens = max_response_tokens
+        self.context_share = context_share
+        self.max_history_messages = max_history_messages
+        self.min_chunk_tokens = min_chunk_tokens
+        self.estimator = estimator or CharHeuristicEstimator()
+
+    def count(self, text: str) -> int:
+        return self.estimator.count(text)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезать текст примерно до max_tokens токенов по границе слова"""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        cut = int(len(text) * max_tokens / tokens)
+        while cut > 0 and self.count(text[:cut]) > max_tokens:
+            cut = int(cut * 0.9)
+        space = text.rfind(" ", 0, cut)
+        return text[:space if space > cut // 2 else cut].rstrip() + "…"
+
+    def _select_context(self, chunks: List[str], budget: int) -> Tuple[List[str], int, int]:
+        """Чанки в порядке релевантности, пока хватает бюджета"""
+        selected = []
+        truncated = 0
+        used = self.count(CONTEXT_HEADER + CONTEXT_FOOTER) if chunks else 0
+        for chunk in chunks:
+            cost = self.count(chunk) + 1
+            if used + cost <= budget:
+                selected.append(chunk)
+                used += cost
+                continue
+            remaining = budget - used - 1
+            if remaining >= self.min_chunk_tokens:
+                selected.append(self._truncate(chunk, remaining))
+                truncated += 1
+            break
+        return selected, len(chunks) - len(selected), truncated
+
+    def _select_history(self, history: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """Самые свежие сообщения истории, пока хватает бюджета"""
+        selected: List[Dict[str, str]] = []
+        used = 0
+        for item in reversed(history[-self.max_history_messages:] if self.max_history_messages else []):
+            cost = self.count(item["content"]) + self.MESSAGE_OVERHEAD_TOKENS
+            if used + cost > budget:
+                break
+            selected.append(item)
+            used += cost
+        selected.reverse()
+        # История не должна начинаться с ответа ассистента без вопроса
+        while selected and selected[0]["role"] == "assistant":
+            selected.pop(0)
+        return selected
+
+    def _history_tokens(self, history: List[Dict[str, str]]) -> int:
+        return sum(self.count(m["content"]) + self.MESSAGE_OVERHEAD_TOKENS for m in history)
+
+    def build(self, system_prompt: str, context_chunks: List[str], history: List[Dict[str, str]],
+              user_message: str, summary: str = "") -> PromptBuildResult:
+        """Собрать сообщения для /v1/chat/completions в пределах бюджета
+
+        summary — краткое содержание свернутой части истории; включается всегда,
+        как и системный промпт.
+        """
+        input_budget = self.context_window - self.max_response_tokens
+        system_tokens = self.count(system_prompt) + self.MESSAGE_OVERHEAD_TOKENS
+        summary_tokens = self.count(summary)
+        user_tokens = self.count(user_message) + self.MESSAGE_OVERHEAD_TOKENS
+        flexible = max(input_budget - system_tokens - summary_tokens - user_tokens, 0)
+
+        # Сначала каждая часть получает свою долю, затем остаток переходит другой
+        context_budget = int(flexible * self.context_share)
+        history_budget = flexible - min(context_budget, self._total_context_cost(context_chunks))
+        selected_history = self._select_history(history, history_budget)
+        history_tokens = self._history_tokens(selected_history)
+        selected_chunks, dropped_chunks, truncated_chunks = self._select_context(
+            context_chunks, flexible - history_tokens
+        )
+
+        context_block = ""
+        if selected_chunks:
+            context_block = CONTEXT_HEADER + "\n\n".join(selected_chunks) + CONTEXT_FOOTER
+        context_tokens = self.count(context_block)
+
+        if self.layout == "user":
+            system_content = system_prompt
+            preamble = "\n\n".join(part for part in (summary.strip(), context_block.strip()) if part)
+            user_content = preamble + QUESTION_HEADER + user_message if preamble else user_message
+        else:
+            system_content = system_prompt + summary + context_block
+            user_content = user_message
+
+        messages = [{"role": "system", "content": system_content}]
+        messages.extend(selected_history)
+        messages.append({"role": "user", "content": user_content})
+
+        prompt_tokens = system_tokens + summary_tokens + context_tokens + history_tokens + user_tokens
+        return PromptBuildResult(
+            messages=messages,
+            max_tokens=max(min(self.max_response_tokens, self.context_window - prompt_tokens), 1),
+            prompt_tokens=prompt_tokens,
+            breakdown={
+                "system": system_tokens,
+                "summary": summary_tokens,
+                "context": context_tokens,
+                "history": history_tokens,
+                "user": user_tokens
+            },
+            context_chunks_used=len(selected_chunks),
+            context_chunks_dropped=dropped_chunks,
+            context_chunks_truncated=truncated_chunks,
+            history_messages_used=len(selected_history),
+            history_messages_dropped=len(history) - len(selected_history),
+            context_fingerprint=hashlib.sha1(context_block.encode("utf-8")).hexdigest()[:16]
+        )
+
+    def _total_context_cost(self, chunks: List[str]) -> int:
+        if not chunks:
+            return 0
+        return self.count(CONTEXT_HEADER + CONTEXT_FOOTER) + sum(self.count(c) + 1 for c in chunks)
+
+
+def prompt_builder_from_env(**kwargs) -> PromptBuilder:
+    """Сборщик промпта с размером окна модели из окружения
+
+    LM_STUDIO_CONTEXT_WINDOW — контекстное окно загруженной модели в токенах,
+    LM_STUDIO_MAX_TOKENS — предел длины ответа, PROMPT_TOKEN_SCALE — поправка
+    оценки токенов, подобранная по журналу промптов. Остальные параметры — как у PromptBuilder.
+    """
+    kwargs.setdefault("estimator", CharHeuristicEstimator(scale=float(os.getenv("PROMPT_TOKEN_SCALE", "1.0"))))
+    return PromptBuilder(
+        context_window=int(os.getenv("LM_STUDIO_CONTEXT_WINDOW", "4096")),
+        max_response_tokens=int(os.getenv("LM_STUDIO_MAX_TOKENS", "2000")),
+        **kwargs
+    )
+
+
+class PromptUsageLog:
+    """Журнал размеров отправленных промптов и usage.prompt_tokens сервера
+
+    Хранится не текст (в вопросах пациентов бывают персональные данные), а
+    число символов каждого класса по всему промпту, число сообщений и реальное
+    число токенов — этого достаточно, чтобы подобрать поправку оценки. С path
+    записи дописываются в JSONL для подбора на собранных за день данных.
+    """
+
+    def __init__(self, max_samples: int = 1000, path: str = ""):
+        self.samples: deque = deque(maxlen=max_samples)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, messages: List[Dict[str, str]], prompt_tokens: int):
+        classes = [0, 0, 0, 0]
+        for message in messages:
+            for i, n in enumerate(char_classes(message.get("content", ""))):
+                classes[i] += n
+        sample = {"chars": classes, "messages": len(messages), "prompt_tokens": int(prompt_tokens)}
+        with self._lock:
+            self.samples.append(sample)
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(sample) + "\n")
+                except OSError:
+                    # Журнал — вспомогательный: ошибка записи не мешает ответу
+                    self.path = ""
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.samples)
+
+
+def load_usage_samples(path: str) -> List[Dict[str, Any]]:
+    """Прочитать записи журнала промптов из JSONL"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _estimated_prompt_tokens(estimator: CharHeuristicEstimator, sample: Dict[str, Any], scale: float) -> float:
+    return estimator.raw(tuple(sample["chars"])) * scale + sample["messages"] * PromptBuilder.MESSAGE_OVERHEAD_TOKENS
+
+
+def prompt_estimate_error(samples: List[Dict[str, Any]], estimator: Optional[CharHeuristicEstimator] = None,
+                          scale: Optional[float] = None) -> float:
+    """Средняя относительная ошибка оценки размера промпта по журналу"""
+    estimator = estimator or CharHeuristicEstimator()
+    scale = estimator.scale if scale is None else scale
+    errors = [abs(_estimated_prompt_tokens(estimator, s, scale) - s["prompt_tokens"]) / s["prompt_tokens"]
+              for s in samples if s["prompt_tokens"] > 0]
+    return sum(errors) / len(errors) if errors else 0.0
+
+
+def fit_token_scale(samples: List[Dict[str, Any]], estimator: Optional[CharHeuristicEstimator] = None) -> float:
+    """Поправка scale по журналу промптов методом наименьших квадратов
+
+    Служебные токены шаблона (MESSAGE_OVERHEAD_TOKENS на сообщение) не
+    масштабируются: подбирается только коэффициент при оценке текста.
+    """
+    estimator = estimator or CharHeuristicEstimator()
+    numerator = denominator = 0.0
+    for sample in samples:
+        raw = estimator.raw(tuple(sample["chars"]))
+        numerator += raw * (sample["prompt_tokens"] - sample["messages"] * PromptBuilder.MESSAGE_OVERHEAD_TOKENS)
+        denominator += raw * raw
+    return numerator / denominator if denominator > 0 else estimator.scale
+
+
+_shared_log: Optional[PromptUsageLog] = None
+_shared_lock = threading.Lock()
+
+
+def get_prompt_usage_log() -> PromptUsageLog:
+    """Общий для процесса журнал промптов (все сессии)
+
+    PROMPT_USAGE_LOG — путь к JSONL-файлу журнала; без него записи только в памяти.
+    """
+    global _shared_log
+    with _shared_lock:
+        if _shared_log is None:
+            _shared_log = PromptUsageLog(path=os.getenv("PROMPT_USAGE_LOG", ""))
+        return _shared_log
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Использование: python prompt_builder.py prompt_usage.jsonl")
+        sys.exit(2)
+    samples = load_usage_samples(sys.argv[1])
+    if not samples:
+        print("Журнал пуст")
+        sys.exit(1)
+    scale = fit_token_scale(samples)
+    print(f"Промптов в журнале: {len(samples)}")
+    print(f"Средняя ошибка оценки: {prompt_estimate_error(samples, scale=1.0):.1%} → "
+          f"{prompt_estimate_error(samples, scale=scale):.1%}")
+    print(f"PROMPT_TOKEN_SCALE={scale:.3f}")
+
+
+if __name__ == "__main__":
+    main()
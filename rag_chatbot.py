@@ -1,50 +1,22 @@
-import requests
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Any, Dict, List, Optional
 from colorama import init, Fore, Back, Style
-from rich.console import Console
-from rich.panel import Panel
-from rich.markdown import Markdown
 
-from knowledge_base import KnowledgeBase
-from embedding_api import EmbeddingAPI, MockEmbeddingAPI
-from system_prompts import SYSTEM_PROMPTS, get_prompt
-from synonym_dictionary import expand_synonyms
+from rag_engine import RAGEngine
+from semantic_cache import SemanticAnswerCache
+from prompt_builder import PromptBuilder
+from system_prompts import SYSTEM_PROMPTS
+from synonym_dictionary import query_variants
 
-class RAGChatBot:
-    """Чатбот с поддержкой RAG (Retrieval-Augmented Generation)"""
+class RAGChatBot(RAGEngine):
+    """Интерактивный чатбот с поддержкой RAG: консольная обертка над RAGEngine"""
     
-    def __init__(self, base_url: str = "http://localhost:1234", use_mock_embeddings: bool = False):
-        self.base_url = base_url
-        self.chat_endpoint = f"{base_url}/v1/chat/completions"
-        self.models_endpoint = f"{base_url}/v1/models"
-        
-        # Инициализация компонентов
-        self.console = Console()
-        self.knowledge_base = KnowledgeBase("knowledge_base")
-        
-        # Инициализация API для эмбеддингов
-        if use_mock_embeddings:
-            self.embedding_api = MockEmbeddingAPI()
-        else:
-            self.embedding_api = EmbeddingAPI(base_url)
-        
-        # Текущие настройки
-        self.current_model = None
-        self.current_system_prompt = "general_assistant"
-        self.conversation_history = []
-        self.use_knowledge_base = True
-        self.rag_top_k = 3
-        
-        # Статистика
-        self.stats = {
-            "total_messages": 0,
-            "total_tokens": 0,
-            "total_rag_queries": 0,
-            "start_time": datetime.now()
-        }
+    def __init__(self, base_url: Optional[str] = None, use_mock_embeddings: bool = False,
+                 use_local_embeddings: bool = False, semantic_cache: Optional[SemanticAnswerCache] = None):
+        super().__init__(base_url, use_mock_embeddings, use_local_embeddings, semantic_cache,
+                         load_knowledge_base=False)
+        self._console = None
         
         print(f"{Fore.GREEN}🏥 RAG-чатбот для ВОККДЦ инициализирован!{Style.RESET_ALL}")
         print(f"{Fore.BLUE}Я помогу вам найти информацию о Воронежском Областном Клиническом Консультативно-Диагностическом Центре{Style.RESET_ALL}")
@@ -53,106 +25,35 @@ class RAGChatBot:
         # Автоматическая загрузка базы знаний ВОККДЦ
         self.load_vodc_knowledge_base()
     
-    def get_available_models(self) -> List[str]:
-        """Получить списко доступных моделей"""
-        try:
-            response = requests.get(self.models_endpoint)
-            if response.status_code == 200:
-                data = response.json()
-                return [model["id"] for model in data.get("data", [])]
-            else:
-                print(f"{Fore.RED}Ошибка при получении списка моделей: {response.status_code}{Style.RESET_ALL}")
-                return []
-        except Exception as e:
-            print(f"{Fore.RED}Ошибка при подключении к LM Studio: {e}{Style.RESET_ALL}")
-            return []
+    @property
+    def console(self):
+        """Консоль rich создается при первом выводе (rich импортируется лениво)"""
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
     
-    def get_relevant_context(self, query: str) -> str:
-        """Получить релевантный контекст из базы знаний"""
-        if not self.use_knowledge_base:
-            return ""
-        
-        try:
-            # Расширяем аббревиатуры и синонимы в запросе
-            expanded_query = expand_synonyms(query)
-            if expanded_query != query:
-                print(f"{Fore.CYAN}🔍 Расширен запрос: '{query}' → '{expanded_query}'{Style.RESET_ALL}")
-            
-            # Ищем похожие документы по расширенному запросу
-            results = self.knowledge_base.search(expanded_query, self.embedding_api, self.rag_top_k)
-            
-            if not results:
-                return ""
-            
-            # Формируем контекст
-            context_parts = []
-            for i, result in enumerate(results):
-                doc = result["document"]
-                similarity = result["similarity"]
-                
-                context_parts.append(f"[Документ {i+1} (релевантность: {similarity:.2f})]: {doc.content}")
-            
-            self.stats["total_rag_queries"] += 1
-            return "\n\n".join(context_parts)
-            
-        except Exception as e:
-            print(f"{Fore.RED}Ошибка при поиске в базе знаний: {e}{Style.RESET_ALL}")
-            return ""
+    def print_panel(self, content: str, title: str, markdown: bool = False, expand: bool = True):
+        """Вывести текст или markdown в рамке rich"""
+        from rich.panel import Panel
+        if markdown:
+            from rich.markdown import Markdown
+            content = Markdown(content)
+        self.console.print(Panel(content, title=title, expand=expand))
     
-    def send_message(self, message: str) -> str:
-        """Отправить сообщение модели с учетом RAG"""
-        if not self.current_model:
-            models = self.get_available_models()
-            if not models:
-                return "Ошибка: Не удалось получить список доступных моделей"
-            self.current_model = models[0]
-        
-        # Получаем контекст из базы знаний
-        context = self.get_relevant_context(message)
-        
-        # Формируем системный промпт с учетом контекста
-        system_prompt = get_prompt(self.current_system_prompt)
-        
-        if context:
-            system_prompt += f"\n\nКонтекст из базы знаний:\n{context}\n\nИспользуйте этот контекст для ответа на вопрос пользователя."
-        
-        # Подготавливаем сообщения
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(self.conversation_history[-10:])  # Последние 10 сообщений
-        messages.append({"role": "user", "content": message})
-        
-        try:
-            payload = {
-                "model": self.current_model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
-            
-            response = requests.post(
-                self.chat_endpoint,
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                assistant_message = data["choices"][0]["message"]["content"]
-                
-                # Обновляем историю
-                self.conversation_history.append({"role": "user", "content": message})
-                self.conversation_history.append({"role": "assistant", "content": assistant_message})
-                
-                # Обновляем статистику
-                self.stats["total_messages"] += 1
-                self.stats["total_tokens"] += data.get("usage", {}).get("total_tokens", 0)
-                
-                return assistant_message
-            else:
-                return f"Ошибка: {response.status_code} - {response.text}"
-                
-        except Exception as e:
-            return f"Ошибка при отправке сообщения: {e}"
+    def get_available_models(self) -> List[str]:
+        """Получить список доступных моделей"""
+        models = self.model_registry.refresh()
+        if self.model_registry.last_error:
+            print(f"{Fore.RED}{self.model_registry.last_error}{Style.RESET_ALL}")
+        return models
+    
+    def get_relevant_chunks(self, query: str) -> List[str]:
+        """Получить релевантные фрагменты базы знаний, показав варианты запроса"""
+        variants = query_variants(query) if self.use_knowledge_base else []
+        if len(variants) > 1:
+            print(f"{Fore.CYAN}🔍 Варианты запроса: {' | '.join(variants)}{Style.RESET_ALL}")
+        return super().get_relevant_chunks(query)
     
     def add_document_to_kb(self, file_path: str) -> bool:
         """Добавить документ в базу знаний"""
@@ -161,7 +62,7 @@ class RAGChatBot:
             return False
         
         print(f"{Fore.YELLOW}Добавляю документ в базу знаний...{Style.RESET_ALL}")
-        success = self.knowledge_base.add_document_from_file(file_path, self.embedding_api)
+        success = super().add_document_to_kb(file_path)
         
         if success:
             print(f"{Fore.GREEN}Документ успешно добавлен в базу знаний{Style.RESET_ALL}")
@@ -171,61 +72,29 @@ class RAGChatBot:
         
         return success
     
-    def save_conversation(self, filename: str = None):
+    def save_conversation(self, filename: str = None) -> str:
         """Сохранить разговор"""
-        if not filename:
-            filename = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        os.makedirs("conversations", exist_ok=True)
-        filepath = os.path.join("conversations", filename)
-        
-        data = {
-            "conversation_history": self.conversation_history,
-            "stats": self.stats,
-            "current_model": self.current_model,
-            "current_system_prompt": self.current_system_prompt,
-            "saved_at": datetime.now().isoformat()
-        }
-        
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
+        filepath = super().save_conversation(filename)
         print(f"{Fore.GREEN}Разговор сохранен: {filepath}{Style.RESET_ALL}")
+        return filepath
     
-    def search_vodc_info(self, query: str) -> str:
-        """Быстрый поиск информации о ВОККДЦ"""
-        try:
-            results = self.knowledge_base.search(query, self.embedding_api, top_k=3)
-            if not results:
-                return "К сожалению, я не нашел информации по вашему запросу в базе данных ВОККДЦ."
-            
-            response = f"Информация по запросу '{query}':\n\n"
-            for i, result in enumerate(results, 1):
-                doc = result["document"]
-                similarity = result["similarity"]
-                response += f"{i}. {doc.content}\n"
-                response += f"   (релевантность: {similarity:.3f})\n\n"
-            
-            return response
-        except Exception as e:
-            return f"Ошибка при поиске: {str(e)}"
-
-    def load_vodc_knowledge_base(self):
+    def load_vodc_knowledge_base(self) -> Dict[str, Any]:
         """Загрузка базы знаний ВОККДЦ"""
-        try:
-            # Проверяем существование файла с базой знаний ВОККДЦ
-            vodc_kb_path = "knowledge_base/vodc_complete_info.md"
-            if os.path.exists(vodc_kb_path):
-                print(f"{Fore.GREEN}Загрузка базы знаний ВОККДЦ...{Style.RESET_ALL}")
-                self.add_document_to_kb(vodc_kb_path)
-                print(f"{Fore.GREEN}✅ База знаний ВОККДЦ загружена успешно!{Style.RESET_ALL}")
-                self.use_knowledge_base = True
-            else:
-                print(f"{Fore.YELLOW}⚠️  Файл базы знаний ВОККДЦ не найден: {vodc_kb_path}{Style.RESET_ALL}")
-                print(f"{Fore.YELLOW}Запустите demo_rag.py для создания базы знаний{Style.RESET_ALL}")
-        except Exception as e:
-            print(f"{Fore.RED}❌ Ошибка загрузки базы знаний ВОККДЦ: {e}{Style.RESET_ALL}")
-
+        print(f"{Fore.GREEN}Загрузка базы знаний ВОККДЦ...{Style.RESET_ALL}")
+        summary = super().load_vodc_knowledge_base()
+        if summary["fact_rows"]:
+            print(f"{Fore.GREEN}✅ Справочные таблицы: {summary['fact_rows']} строк (цены, адреса, контакты){Style.RESET_ALL}")
+        if summary["faq_entries"]:
+            print(f"{Fore.GREEN}✅ FAQ: {summary['faq_entries']} готовых ответов{Style.RESET_ALL}")
+        if summary["error"]:
+            print(f"{Fore.RED}❌ Ошибка загрузки базы знаний ВОККДЦ: {summary['error']}{Style.RESET_ALL}")
+        elif summary["loaded"]:
+            print(f"{Fore.GREEN}✅ База знаний ВОККДЦ загружена успешно!{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.YELLOW}⚠️  Файл базы знаний ВОККДЦ не найден{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}Запустите demo_rag.py для создания базы знаний{Style.RESET_ALL}")
+        return summary
+    
     def print_help(self):
         """Вывести справку"""
         help_text = """
@@ -250,6 +119,12 @@ class RAGChatBot:
 - `/kb_off` - выключить использование базы знаний
 - `/kb_status` - показать статус базы знаний
 - `/kb_clear` - очистить базу знаний
+- `/kb_project <pca|truncate|off> [dim]` - понизить размерность эмбеддингов индекса
+- `/cache` - статистика кэшей поиска и семантического кэша ответов
+- `/prompt` - размер последнего промпта в токенах по частям
+- `/faq [порог]` - статистика FAQ или порог уверенности для готовых ответов (по умолчанию 0.8)
+- `/router [on|off]` - статистика маршрутизатора (светская беседа, справочные ответы, RAG) или его включение
+- `/layout <user|system>` - куда помещать контекст: в сообщение пользователя (стабильный префикс) или в системный промпт
 
 ## ⚙️ Настройки:
 - `/mode <key>` - сменить режим работы (code_assistant, teacher и т.д.)
@@ -265,7 +140,7 @@ class RAGChatBot:
 - Какие анализы можно сдать в ВОККДЦ?
         """
         
-        self.console.print(Panel(Markdown(help_text), title="Справка", expand=False))
+        self.print_panel(help_text, "Справка", markdown=True, expand=False)
     
     def run_interactive(self):
         """Запустить интерактивный режим"""
@@ -294,7 +169,7 @@ class RAGChatBot:
                         self.print_help()
                     
                     elif command == "/clear":
-                        self.conversation_history = []
+                        self.clear_history()
                         print(f"{Fore.GREEN}История очищена{Style.RESET_ALL}")
                     
                     elif command == "/save":
@@ -316,7 +191,7 @@ class RAGChatBot:
                     
                     elif command == "/kb_stats":
                         stats = self.knowledge_base.get_stats()
-                        self.console.print(Panel(str(stats), title="Статистика базы знаний"))
+                        self.print_panel(str(stats), "Статистика базы знаний")
                     
                     elif command == "/kb_list":
                         docs = self.knowledge_base.list_documents()
@@ -331,6 +206,54 @@ class RAGChatBot:
                         self.knowledge_base.clear()
                         print(f"{Fore.GREEN}База знаний очищена{Style.RESET_ALL}")
                     
+                    elif command == "/cache":
+                        cache_stats = {
+                            "retrieval": self.knowledge_base.cache.get_stats(),
+                            "semantic_answers": self.semantic_cache.get_stats()
+                        }
+                        self.print_panel(json.dumps(cache_stats, ensure_ascii=False, indent=2), "Кэши")
+                    
+                    elif command == "/prompt":
+                        if self.last_prompt_report is None:
+                            print(f"{Fore.YELLOW}Промпт еще не собирался{Style.RESET_ALL}")
+                        else:
+                            self.print_panel(json.dumps(self.last_prompt_report, ensure_ascii=False, indent=2), "Последний промпт")
+                    
+                    elif command == "/faq":
+                        try:
+                            if arg:
+                                self.faq_index.threshold = float(arg)
+                                print(f"{Fore.GREEN}Порог FAQ: {self.faq_index.threshold}{Style.RESET_ALL}")
+                            else:
+                                self.print_panel(json.dumps(self.faq_index.get_stats(), ensure_ascii=False, indent=2), "FAQ")
+                        except ValueError:
+                            print(f"{Fore.RED}Порог должен быть числом от 0 до 1{Style.RESET_ALL}")
+                    
+                    elif command == "/router":
+                        if arg in ("on", "off"):
+                            self.use_router = arg == "on"
+                            print(f"{Fore.GREEN}Маршрутизатор {'включен' if self.use_router else 'выключен'}{Style.RESET_ALL}")
+                        else:
+                            self.print_panel(json.dumps(self.intent_router.get_stats(), ensure_ascii=False, indent=2), "Маршрутизация")
+                    
+                    elif command == "/layout":
+                        if arg in PromptBuilder.LAYOUTS:
+                            self.prompt_builder.layout = arg
+                            print(f"{Fore.GREEN}Раскладка промпта: {arg}{Style.RESET_ALL}")
+                        else:
+                            print(f"{Fore.RED}Использование: /layout <user|system> (сейчас: {self.prompt_builder.layout}){Style.RESET_ALL}")
+                    
+                    elif command == "/kb_project":
+                        project_args = (arg or "").split()
+                        if project_args and project_args[0] == "off":
+                            self.knowledge_base.vector_store.remove_projection()
+                            print(f"{Fore.GREEN}Проекция отключена{Style.RESET_ALL}")
+                        elif project_args and project_args[0] in ("pca", "truncate"):
+                            dim = int(project_args[1]) if len(project_args) > 1 and project_args[1].isdigit() else 256
+                            self.knowledge_base.fit_projection(project_args[0], dim)
+                        else:
+                            print(f"{Fore.RED}Использование: /kb_project <pca|truncate|off> [dim]{Style.RESET_ALL}")
+                    
                     elif command == "/mode":
                         if arg and arg in SYSTEM_PROMPTS:
                             self.current_system_prompt = arg
@@ -358,27 +281,27 @@ class RAGChatBot:
                     elif command == "/departments":
                         print(f"{Fore.YELLOW}Поиск информации об отделениях ВОККДЦ...{Style.RESET_ALL}")
                         response = self.search_vodc_info("отделения ВОККДЦ")
-                        self.console.print(Panel(Markdown(response), title="Отделения ВОККДЦ", expand=False))
+                        self.print_panel(response, "Отделения ВОККДЦ", markdown=True, expand=False)
                     
                     elif command == "/prices":
                         print(f"{Fore.YELLOW}Поиск информации о ценах ВОККДЦ...{Style.RESET_ALL}")
                         response = self.search_vodc_info("цены услуги ВОККДЦ")
-                        self.console.print(Panel(Markdown(response), title="Цены на услуги ВОККДЦ", expand=False))
+                        self.print_panel(response, "Цены на услуги ВОККДЦ", markdown=True, expand=False)
                     
                     elif command == "/doctors":
                         print(f"{Fore.YELLOW}Поиск информации о врачах ВОККДЦ...{Style.RESET_ALL}")
                         response = self.search_vodc_info("врачи специалисты ВОККДЦ")
-                        self.console.print(Panel(Markdown(response), title="Врачи ВОККДЦ", expand=False))
+                        self.print_panel(response, "Врачи ВОККДЦ", markdown=True, expand=False)
                     
                     elif command == "/contacts":
                         print(f"{Fore.YELLOW}Поиск контактной информации ВОККДЦ...{Style.RESET_ALL}")
                         response = self.search_vodc_info("контакты адрес телефон ВОККДЦ")
-                        self.console.print(Panel(Markdown(response), title="Контакты ВОККДЦ", expand=False))
+                        self.print_panel(response, "Контакты ВОККДЦ", markdown=True, expand=False)
                     
                     elif command == "/prepare":
                         print(f"{Fore.YELLOW}Поиск информации о подготовке к исследованиям...{Style.RESET_ALL}")
                         response = self.search_vodc_info("подготовка исследования анализы")
-                        self.console.print(Panel(Markdown(response), title="Подготовка к исследованиям", expand=False))
+                        self.print_panel(response, "Подготовка к исследованиям", markdown=True, expand=False)
                     
                     else:
                         print(f"{Fore.RED}Неизвестная команда: {command}{Style.RESET_ALL}")
@@ -390,7 +313,7 @@ class RAGChatBot:
                     response = self.send_message(user_input)
                     
                     # Выводим ответ
-                    self.console.print(Panel(Markdown(response), title="Ассистент", expand=False))
+                    self.print_panel(response, "Ассистент", markdown=True, expand=False)
             
             except KeyboardInterrupt:
                 print(f"\n{Fore.YELLOW}Используйте /exit для выхода{Style.RESET_ALL}")
@@ -0,0 +1,671 @@
+"""
+Headless RAG-движок ВОККДЦ: поиск по базе знаний, сборка промпта и запрос к LLM
+
+Без консольного ввода-вывода и без rich/colorama: используется веб-сервером
+виджета, а интерактивный чатбот (rag_chatbot.py) — тонкая обертка над ним.
+Диагностика пишется в logging.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from knowledge_base import KnowledgeBase
+from embedding_api import EmbeddingAPI, MockEmbeddingAPI
+from local_embeddings import HashingEmbeddingAPI
+from model_registry import get_model_registry
+from llm_pool import DeadlineExceeded, get_llm_pool, iter_lines_until, remaining_seconds
+from admission import AdmissionController, AdmissionRejected, get_admission_controller
+from request_coalescer import Event, get_request_coalescer
+from retrieval_cache import normalize_query
+from semantic_cache import SemanticAnswerCache, get_semantic_cache, prompt_fingerprint
+from prompt_builder import PromptBuildResult, get_prompt_usage_log, prompt_builder_from_env
+from history_compactor import HistoryCompactor
+from intent_router import IntentRouter, RouteDecision
+from faq_index import FAQIndex
+from fact_tables import FactTables
+from system_prompts import get_prompt
+from synonym_dictionary import expand_synonyms, query_variants
+from metrics import count_answer, count_cancelled, observe_llm, timed
+
+logger = logging.getLogger(__name__)
+
+VODC_KB_PATH = "knowledge_base/vodc_complete_info.md"
+VODC_FAQ_PATH = "knowledge_base/vodc_abbreviations_faq.md"
+
+# Сколько фрагментов базы знаний попадает в контекст ответа
+RAG_TOP_K = 3
+
+
+class RAGCore:
+    """Общая для процесса часть RAG: база знаний, эмбеддинги, реестр моделей и серверы
+
+    Одна на воркер веб-сервера: база знаний загружается и эмбеддится один раз,
+    а сессии (RAGEngine) хранят только свой разговор. Потокобезопасна: хранилище
+    и кэши защищены своими блокировками, загрузка базы — блокировкой ядра.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, use_mock_embeddings: bool = False,
+                 use_local_embeddings: bool = False, semantic_cache: Optional[SemanticAnswerCache] = None,
+                 use_admission: bool = False, load_knowledge_base: bool = True):
+        # Генерация распределяется по пулу серверов (LM_STUDIO_URLS); эмбеддинги,
+        # список моделей и сжатие истории идут на первый сервер пула
+        self.llm_pool = get_llm_pool(base_url)
+        base_url = self.llm_pool.primary_url
+        self.base_url = base_url
+        self.chat_endpoint = f"{base_url}/v1/chat/completions"
+        self.models_endpoint = f"{base_url}/v1/models"
+
+        # Общий для процесса реестр моделей; первое обращение запускает фоновый прогрев
+        self.model_registry = get_model_registry(base_url)
+        self.model_registry.get_models()
+
+        self.knowledge_base = KnowledgeBase("knowledge_base")
+
+        # Инициализация API для эмбеддингов
+        if use_mock_embeddings:
+            self.embedding_api = MockEmbeddingAPI()
+        elif use_local_embeddings:
+            # Локальные n-граммные эмбеддинги: без модели и HTTP-запросов
+            self.embedding_api = HashingEmbeddingAPI()
+        else:
+            self.embedding_api = EmbeddingAPI(base_url)
+
+        # Готовые ответы FAQ и таблицы цен, адресов и телефонов (заполняются при загрузке базы ВОККДЦ)
+        self.faq_index = FAQIndex()
+        self.fact_tables = FactTables()
+
+        # Локальный маршрутизатор: светская беседа, FAQ и справочные вопросы без эмбеддингов и LLM
+        self.intent_router = IntentRouter(self.knowledge_base, self.faq_index, self.fact_tables)
+
+        # Семантический кэш ответов на первые вопросы
+        self.semantic_cache = semantic_cache if semantic_cache is not None else get_semantic_cache()
+
+        # Одинаковые одновременные первые вопросы ждут одну генерацию
+        self.coalescer = get_request_coalescer()
+
+        # Допуск к генерации с очередью и приоритетами (веб-сервер): не больше слотов, чем у пула
+        self.admission: Optional[AdmissionController] = None
+        if use_admission:
+            self.admission = get_admission_controller(
+                sum(backend.max_concurrency for backend in self.llm_pool.backends)
+            )
+
+        self._load_lock = threading.Lock()
+        if load_knowledge_base:
+            self.load_vodc_knowledge_base()
+
+    def add_document_to_kb(self, file_path: str) -> bool:
+        """Добавить документ в базу знаний"""
+        if not os.path.exists(file_path):
+            logger.warning("Файл не найден: %s", file_path)
+            return False
+        with self._load_lock:
+            return self.knowledge_base.add_document_from_file(file_path, self.embedding_api)
+
+    def load_vodc_knowledge_base(self) -> Dict[str, Any]:
+        """Загрузка базы знаний ВОККДЦ, справочных таблиц и FAQ
+
+        Возвращает сводку: loaded (найден ли файл базы), fact_rows и faq_entries
+        (сколько строк и пар загружено сейчас; 0, если они уже были загружены).
+        Неизмененная база не эмбеддится и не перезаписывается повторно.
+        """
+        summary = {"loaded": False, "fact_rows": 0, "faq_entries": 0, "error": None}
+        try:
+            if os.path.exists(VODC_KB_PATH):
+                self.add_document_to_kb(VODC_KB_PATH)
+                with self._load_lock:
+                    if not len(self.fact_tables):
+                        summary["fact_rows"] = self.fact_tables.load_file(VODC_KB_PATH)
+                summary["loaded"] = True
+            else:
+                logger.warning("Файл базы знаний ВОККДЦ не найден: %s", VODC_KB_PATH)
+
+            # Пары вопрос-ответ FAQ отвечаются напрямую, без эмбеддинга запроса и генерации
+            with self._load_lock:
+                if os.path.exists(VODC_FAQ_PATH) and not len(self.faq_index):
+                    summary["faq_entries"] = self.faq_index.load_file(VODC_FAQ_PATH)
+        except Exception as e:
+            logger.error("Ошибка загрузки базы знаний ВОККДЦ: %s", e)
+            summary["error"] = str(e)
+        return summary
+
+    def prefetch(self, partial_message: str, top_k: int = RAG_TOP_K) -> bool:
+        """Прогреть кэши эмбеддинга запроса и результатов поиска для набираемого вопроса
+
+        Кэши принадлежат ядру, а ключи совпадают с теми, что использует
+        RAGEngine.send_message: при отправке того же текста из любой сессии
+        эмбеддинг и поиск берутся из кэша, а платить остается только за генерацию.
+        """
+        if not partial_message.strip():
+            return False
+        self.knowledge_base.multi_search(query_variants(partial_message), self.embedding_api, top_k)
+        return True
+
+
+_shared_core: Optional[RAGCore] = None
+_shared_core_lock = threading.Lock()
+
+
+def get_rag_core(create: bool = True, **options) -> Optional[RAGCore]:
+    """Общее для процесса ядро RAG; options передаются RAGCore при первом создании
+
+    Под gunicorn создается в каждом воркере при первой сессии (после fork), пока
+    остальные потоки воркера ждут загрузки базы. create=False — только уже созданное.
+    """
+    global _shared_core
+    with _shared_core_lock:
+        if _shared_core is None and create:
+            _shared_core = RAGCore(**options)
+        return _shared_core
+
+
+class RAGEngine:
+    """RAG для ВОККДЦ без консоли: маршрутизация, поиск, промпт, генерация и история
+
+    Состояние разговора (история, краткое содержание, режим, модель, статистика)
+    у каждого экземпляра свое, а база знаний, эмбеддинги, модели и кэши берутся
+    из ядра RAGCore: веб-сервер передает общее ядро воркера, консольный чатбот
+    создает собственное.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, use_mock_embeddings: bool = False,
+                 use_local_embeddings: bool = False, semantic_cache: Optional[SemanticAnswerCache] = None,
+                 load_knowledge_base: bool = True, core: Optional[RAGCore] = None):
+        # load_knowledge_base относится только к собственному ядру: общее загружено при создании
+        if core is None:
+            core = RAGCore(base_url, use_mock_embeddings, use_local_embeddings, semantic_cache,
+                           load_knowledge_base=load_knowledge_base)
+        self.core = core
+
+        # Общие компоненты ядра
+        self.llm_pool = core.llm_pool
+        self.base_url = core.base_url
+        self.chat_endpoint = core.chat_endpoint
+        self.models_endpoint = core.models_endpoint
+        self.model_registry = core.model_registry
+        self.knowledge_base = core.knowledge_base
+        self.embedding_api = core.embedding_api
+        self.faq_index = core.faq_index
+        self.fact_tables = core.fact_tables
+        self.intent_router = core.intent_router
+        self.semantic_cache = core.semantic_cache
+        self.coalescer = core.coalescer
+        self.admission = core.admission
+
+        # Текущие настройки
+        self.current_model = None
+        self.current_system_prompt = "general_assistant"
+        self.conversation_history = []
+        self.use_knowledge_base = True
+        self.rag_top_k = RAG_TOP_K
+
+        # Старые реплики сворачиваются в краткое содержание в фоне после ответа
+        self.history_compactor = HistoryCompactor(
+            self.chat_endpoint,
+            lambda: self.current_model or self.model_registry.get_default_model(),
+            compact_threshold=10,
+            keep_recent=4,
+            post=self._background_completion
+        )
+
+        # Бюджет контекстного окна модели и последний отчет о размере промпта
+        self.prompt_builder = prompt_builder_from_env(max_history_messages=self.history_compactor.compact_threshold + 2)
+        self.last_prompt_report: Optional[Dict[str, Any]] = None
+        self._last_prompt_messages: Optional[List[Dict[str, str]]] = None
+        # Реальные размеры промптов — для подбора PROMPT_TOKEN_SCALE
+        self.prompt_usage_log = get_prompt_usage_log()
+
+        self.use_router = True
+        self.last_route: Optional[RouteDecision] = None
+        self.use_semantic_cache = True
+        self.use_coalescing = True
+
+        # Статистика
+        self.stats = {
+            "total_messages": 0,
+            "total_tokens": 0,
+            "total_rag_queries": 0,
+            "semantic_cache_hits": 0,
+            "routed_answers": 0,
+            "total_prompt_tokens": 0,
+            "start_time": datetime.now()
+        }
+
+    def get_available_models(self) -> List[str]:
+        """Получить список доступных моделей"""
+        models = self.model_registry.refresh()
+        if self.model_registry.last_error:
+            logger.warning(self.model_registry.last_error)
+        return models
+
+    def get_relevant_chunks(self, query: str) -> List[str]:
+        """Получить релевантные фрагменты базы знаний в порядке убывания релевантности"""
+        if not self.use_knowledge_base:
+            return []
+
+        try:
+            # Исходная формулировка плюс варианты с расширенными аббревиатурами и синонимами
+            with timed("synonym_expansion"):
+                variants = query_variants(query)
+            if len(variants) > 1:
+                logger.debug("Варианты запроса: %s", " | ".join(variants))
+
+            # Один пакетный эмбеддинг, один матричный поиск, слияние по рангам
+            results = self.knowledge_base.multi_search(variants, self.embedding_api, self.rag_top_k)
+
+            if not results:
+                return []
+
+            # Формируем контекст
+            context_parts = []
+            for i, result in enumerate(results):
+                doc = result["document"]
+                similarity = result["similarity"]
+
+                context_parts.append(f"[Документ {i+1} (релевантность: {similarity:.2f})]: {doc.content}")
+
+            self.stats["total_rag_queries"] += 1
+            return context_parts
+
+        except Exception as e:
+            logger.error("Ошибка при поиске в базе знаний: %s", e)
+            return []
+
+    def prefetch(self, partial_message: str) -> bool:
+        """Прогреть кэши ядра для набираемого вопроса с настройками поиска этой сессии"""
+        if not self.use_knowledge_base:
+            return False
+        return self.core.prefetch(partial_message, self.rag_top_k)
+
+    def get_relevant_context(self, query: str) -> str:
+        """Получить релевантный контекст из базы знаний"""
+        return "\n\n".join(self.get_relevant_chunks(query))
+
+    def answer_without_llm(self, message: str) -> Optional[str]:
+        """Ответ маршрутизатора без генерации; None, если нужен полный RAG"""
+        if not self.use_router:
+            return None
+        last_assistant_message = next(
+            (m["content"] for m in reversed(self.conversation_history) if m["role"] == "assistant"), ""
+        )
+        self.last_route = self.intent_router.route(message, last_assistant_message,
+                                                   allow_lookup=self.use_knowledge_base)
+        if self.last_route.answer is None:
+            return None
+        self.stats["routed_answers"] += 1
+        return self.last_route.answer
+
+    def _semantic_cache_namespace(self) -> Tuple[str, str, str, bool]:
+        """Пространство имен семантического кэша: ответ зависит от базы знаний,
+        системного промпта, модели и того, включена ли база знаний в этой сессии"""
+        return (self.knowledge_base.vector_store.fingerprint,
+                prompt_fingerprint(get_prompt(self.current_system_prompt)),
+                self.current_model or self.model_registry.get_default_model() or "",
+                self.use_knowledge_base)
+
+    def _semantic_cache_embedding(self, message: str) -> Optional[List[float]]:
+        """Эмбеддинг вопроса для семантического кэша (только для первого вопроса сессии)"""
+        if not self.use_semantic_cache or self.conversation_history:
+            return None
+        # Тот же расширенный запрос, что и для поиска, поэтому эмбеддинг берется из кэша
+        return self.knowledge_base.embed_query(expand_synonyms(message), self.embedding_api)
+
+    def get_cached_answer(self, message: str) -> Optional[str]:
+        """Готовый ответ на близкий по смыслу первый вопрос или None"""
+        embedding = self._semantic_cache_embedding(message)
+        if embedding is None:
+            return None
+
+        hit = self.semantic_cache.lookup(embedding, *self._semantic_cache_namespace())
+        if hit is None:
+            return None
+
+        logger.info("Ответ из семантического кэша (сходство %.3f с '%s')", hit["similarity"], hit["question"])
+        self.stats["semantic_cache_hits"] += 1
+        return hit["answer"]
+
+    def _remember_answer(self, message: str, answer: str):
+        """Сохранить ответ на первый вопрос сессии в семантический кэш"""
+        embedding = self._semantic_cache_embedding(message)
+        if embedding is not None and answer:
+            self.semantic_cache.store(message, embedding, answer, *self._semantic_cache_namespace())
+
+    def _prepare_messages(self, message: str) -> PromptBuildResult:
+        """Собрать сообщения для модели в пределах бюджета токенов"""
+        # Получаем контекст из базы знаний
+        context_chunks = self.get_relevant_chunks(message)
+
+        with timed("prompt_build"):
+            # Точные цены и адреса — первым, самым коротким чанком вместо пересказа прозы
+            if self.use_knowledge_base:
+                facts_context = self.fact_tables.as_context(message)
+                if facts_context:
+                    context_chunks.insert(0, facts_context)
+
+            # Системный промпт, контекст и история распределяются по бюджету контекстного окна
+            prompt = self.prompt_builder.build(
+                get_prompt(self.current_system_prompt),
+                context_chunks,
+                self.conversation_history,
+                message,
+                summary=self.history_compactor.summary_block()
+            )
+        self.last_prompt_report = prompt.report()
+        self._last_prompt_messages = prompt.messages
+        self.stats["total_prompt_tokens"] += prompt.prompt_tokens
+        return prompt
+
+    def _record_exchange(self, message: str, assistant_message: str, usage: Optional[Dict[str, Any]] = None):
+        """Обновить историю и статистику после полученного ответа"""
+        self.conversation_history.append({"role": "user", "content": message})
+        self.conversation_history.append({"role": "assistant", "content": assistant_message})
+
+        self.stats["total_messages"] += 1
+        self.stats["total_tokens"] += (usage or {}).get("total_tokens", 0)
+
+        # Реальный размер промпта по данным сервера — для сверки с оценкой
+        if usage and self.last_prompt_report is not None and "prompt_tokens" in usage:
+            self.last_prompt_report["actual_prompt_tokens"] = usage["prompt_tokens"]
+            if self._last_prompt_messages is not None:
+                self.prompt_usage_log.record(self._last_prompt_messages, usage["prompt_tokens"])
+
+        # Ответ уже получен: сжатие истории не задерживает пользователя
+        self.history_compactor.maybe_compact(self.conversation_history)
+
+    def clear_history(self):
+        """Очистить историю разговора вместе с кратким содержанием"""
+        self.conversation_history = []
+        self.history_compactor.reset()
+
+    def _coalesce_key(self, message: str, prompt: PromptBuildResult, payload: Dict[str, Any]) -> Optional[tuple]:
+        """Ключ объединения одинаковых запросов; None — запрос выполняется отдельно
+
+        Объединяются только первые вопросы сессии: дальше ответ зависит от истории.
+        Одинаковые вопрос, контекст, системный промпт и модель дают одинаковый промпт.
+        """
+        if not self.use_coalescing or self.conversation_history or self.history_compactor.summary:
+            return None
+        return (
+            normalize_query(message),
+            prompt.context_fingerprint,
+            prompt_fingerprint(get_prompt(self.current_system_prompt)),
+            self.prompt_builder.layout,
+            payload["model"],
+            payload["max_tokens"],
+            payload.get("stream", False)
+        )
+
+    def _background_completion(self, payload: Dict[str, Any]) -> requests.Response:
+        """Фоновая генерация (конспект истории) через пул, в полосе наименьшего приоритета
+
+        Слот берется, только если он свободен сейчас и никто не ждет в очереди;
+        иначе AdmissionRejected, и сжатие откладывается до следующего ответа.
+        """
+        admission = (self.admission.admit("background", timeout=0)
+                     if self.admission is not None else nullcontext())
+        with admission:
+            return self.llm_pool.complete(payload, deadline=time.monotonic() + self.history_compactor.timeout)
+
+    def _upstream_events(self, payload: Dict[str, Any], lane: str = "widget",
+                         deadline: Optional[float] = None) -> Iterator[Event]:
+        """Запрос к LM Studio как поток событий ("delta", текст), ("usage", ...), ("error", текст)
+
+        Слот генерации занимается через контроль допуска на все время ответа.
+        Закрытие итератора (клиент отключился) или истекший deadline закрывает
+        соединение с сервером, и генерация прерывается.
+        """
+        admission = (self.admission.admit(lane, timeout=remaining_seconds(deadline))
+                     if self.admission is not None else nullcontext())
+        with admission:
+            yield from self._request_events(payload, deadline)
+
+    def _request_events(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> Iterator[Event]:
+        started = time.perf_counter()
+        if not payload.get("stream"):
+            try:
+                response = self.llm_pool.complete(payload, deadline=deadline)
+            except DeadlineExceeded:
+                count_cancelled("deadline", payload["max_tokens"])
+                raise
+            if response.status_code != 200:
+                yield "error", f"Ошибка: {response.status_code} - {response.text}"
+                return
+            data = response.json()
+            observe_llm(time.perf_counter() - started, usage=data.get("usage"))
+            yield "delta", data["choices"][0]["message"]["content"]
+            yield "usage", data.get("usage")
+            return
+
+        usage = None
+        ttft = None
+        # LM Studio присылает по одному токену в событии: число событий — число токенов
+        received = 0
+        finished = False
+        try:
+            with self.llm_pool.stream(payload, deadline=deadline) as response:
+                if response.status_code != 200:
+                    finished = True
+                    yield "error", f"Ошибка: {response.status_code} - {response.text}"
+                    return
+
+                for line in iter_lines_until(response, deadline):
+                    if not line or not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    event = json.loads(data.decode("utf-8"))
+                    usage = event.get("usage") or usage
+                    choices = event.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        received += 1
+                        yield "delta", delta
+                finished = True
+        except DeadlineExceeded:
+            count_cancelled("deadline", payload["max_tokens"], received)
+            raise
+        except GeneratorExit:
+            if not finished:
+                count_cancelled("disconnect", payload["max_tokens"], received)
+            raise
+        observe_llm(time.perf_counter() - started, ttft, usage)
+        yield "usage", usage
+
+    def _generate(self, message: str, prompt: PromptBuildResult, payload: Dict[str, Any],
+                  lane: str = "widget", deadline: Optional[float] = None) -> Tuple[bool, Iterator[Event]]:
+        """События генерации: своей или уже идущей для такого же первого вопроса
+
+        Возвращает (своя ли это генерация, итератор событий). Объединенная
+        генерация идет со сроком первого запроса.
+        """
+        key = self._coalesce_key(message, prompt, payload)
+        return self.coalescer.subscribe(key, lambda: self._upstream_events(payload, lane, deadline))
+
+    def send_message(self, message: str, lane: str = "widget", deadline: Optional[float] = None) -> str:
+        """Отправить сообщение модели с учетом RAG
+
+        lane — полоса контроля допуска; при перегрузке бросает AdmissionRejected.
+        deadline — крайний срок ответа (time.monotonic()), после него генерация прерывается.
+        """
+        routed_answer = self.answer_without_llm(message)
+        if routed_answer is not None:
+            count_answer(self.last_route.route)
+            self._record_exchange(message, routed_answer)
+            return routed_answer
+
+        # Модель, выбранная пользователем, или текущая модель из общего реестра
+        model = self.current_model or self.model_registry.get_default_model()
+        if not model:
+            return "Ошибка: Не удалось получить список доступных моделей"
+
+        cached_answer = self.get_cached_answer(message)
+        if cached_answer is not None:
+            count_answer("semantic_cache")
+            self._record_exchange(message, cached_answer)
+            return cached_answer
+
+        prompt = self._prepare_messages(message)
+
+        try:
+            payload = {
+                "model": model,
+                "messages": prompt.messages,
+                "temperature": 0.7,
+                "max_tokens": prompt.max_tokens
+            }
+
+            parts = []
+            usage = None
+            leader, events = self._generate(message, prompt, payload, lane, deadline)
+            for kind, value in events:
+                if kind == "error":
+                    return value
+                if kind == "delta":
+                    parts.append(value)
+                elif kind == "usage":
+                    usage = value
+
+            assistant_message = "".join(parts)
+            count_answer("rag" if leader else "coalesced")
+
+            # Обновляем кэш, историю и статистику
+            self._remember_answer(message, assistant_message)
+            self._record_exchange(message, assistant_message, usage)
+
+            return assistant_message
+
+        except AdmissionRejected:
+            raise
+        except DeadlineExceeded:
+            return "Ошибка: ответ не успел сформироваться за отведенное время"
+        except Exception as e:
+            return f"Ошибка при отправке сообщения: {e}"
+
+    def stream_message(self, message: str, lane: str = "widget",
+                       deadline: Optional[float] = None) -> Iterator[str]:
+        """Отправить сообщение модели и получать ответ по частям (stream: true)
+
+        История и статистика обновляются после получения полного ответа.
+        Если потребитель прекращает итерацию, соединение с LM Studio закрывается
+        (для объединенных запросов — когда отключились все их получатели),
+        а после deadline генерация прерывается сама.
+        При перегрузке бросает AdmissionRejected до первой части ответа.
+        """
+        routed_answer = self.answer_without_llm(message)
+        if routed_answer is not None:
+            count_answer(self.last_route.route)
+            self._record_exchange(message, routed_answer)
+            yield routed_answer
+            return
+
+        model = self.current_model or self.model_registry.get_default_model()
+        if not model:
+            yield "Ошибка: Не удалось получить список доступных моделей"
+            return
+
+        cached_answer = self.get_cached_answer(message)
+        if cached_answer is not None:
+            count_answer("semantic_cache")
+            self._record_exchange(message, cached_answer)
+            yield cached_answer
+            return
+
+        prompt = self._prepare_messages(message)
+        payload = {
+            "model": model,
+            "messages": prompt.messages,
+            "temperature": 0.7,
+            "max_tokens": prompt.max_tokens,
+            "stream": True
+        }
+
+        parts = []
+        usage = None
+        leader, events = self._generate(message, prompt, payload, lane, deadline)
+        try:
+            for kind, value in events:
+                if kind == "error":
+                    yield value
+                    return
+                if kind == "delta":
+                    parts.append(value)
+                    yield value
+                elif kind == "usage":
+                    usage = value
+        except AdmissionRejected:
+            raise
+        except DeadlineExceeded:
+            yield "Ошибка: ответ не успел сформироваться за отведенное время"
+            return
+        except Exception as e:
+            yield f"Ошибка при отправке сообщения: {e}"
+            return
+        finally:
+            events.close()
+
+        count_answer("rag" if leader else "coalesced")
+        answer = "".join(parts)
+        self._remember_answer(message, answer)
+        self._record_exchange(message, answer, usage)
+
+    def add_document_to_kb(self, file_path: str) -> bool:
+        """Добавить документ в базу знаний (общую для всех сессий ядра)"""
+        return self.core.add_document_to_kb(file_path)
+
+    def save_conversation(self, filename: str = None) -> str:
+        """Сохранить разговор; возвращает путь к файлу"""
+        if not filename:
+            filename = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        os.makedirs("conversations", exist_ok=True)
+        filepath = os.path.join("conversations", filename)
+
+        data = {
+            "conversation_history": self.conversation_history,
+            "history_summary": self.history_compactor.summary,
+            "stats": self.stats,
+            "current_model": self.current_model,
+            "current_system_prompt": self.current_system_prompt,
+            "saved_at": datetime.now().isoformat()
+        }
+
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+
+        return filepath
+
+    def search_vodc_info(self, query: str) -> str:
+        """Быстрый поиск информации о ВОККДЦ"""
+        try:
+            results = self.knowledge_base.multi_search(query_variants(query), self.embedding_api, top_k=3)
+            if not results:
+                return "К сожалению, я не нашел информации по вашему запросу в базе данных ВОККДЦ."
+
+            response = f"Информация по запросу '{query}':\n\n"
+            for i, result in enumerate(results, 1):
+                doc = result["document"]
+                similarity = result["similarity"]
+                response += f"{i}. {doc.content}\n"
+                response += f"   (релевантность: {similarity:.3f})\n\n"
+
+            return response
+        except Exception as e:
+            return f"Ошибка при поиске: {str(e)}"
+
+    def load_vodc_knowledge_base(self) -> Dict[str, Any]:
+        """Загрузка базы знаний ВОККДЦ, справочных таблиц и FAQ в ядро (см. RAGCore)"""
+        summary = self.core.load_vodc_knowledge_base()
+        if summary["loaded"]:
+            self.use_knowledge_base = True
+        return summary
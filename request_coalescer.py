@@ -0,0 +1,137 @@
+"""
+Объединение одинаковых одновременных запросов к LLM (single-flight)
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Событие потока ответа: ("delta", текст), ("usage", словарь usage) или ("error", текст ошибки)
+Event = Tuple[str, Any]
+
+
+class _Flight:
+    """Одна выполняющаяся генерация и ее подписчики"""
+
+    def __init__(self):
+        self.events: List[Event] = []
+        self.condition = threading.Condition()
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.started_at = time.monotonic()
+
+
+class RequestCoalescer:
+    """Single-flight для генерации: одинаковые запросы ждут один вызов LM Studio
+
+    Первый запрос с ключом запускает генерацию в фоновом потоке; запросы с тем же
+    ключом, пришедшие до ее окончания, подписываются на тот же поток событий и
+    получают его с начала. Генерация отменяется (итератор закрывается, соединение
+    с сервером рвется), только когда отписались все подписчики. После окончания
+    ключ освобождается: повторять готовые ответы — задача семантического кэша.
+    """
+
+    def __init__(self, wait_timeout: float = 120.0):
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "cancelled": 0, "errors": 0}
+
+    def subscribe(self, key: Optional[Hashable],
+                  start: Callable[[], Iterator[Event]]) -> Tuple[bool, Iterator[Event]]:
+        """Подписаться на генерацию с ключом key; key=None — без объединения
+
+        start вызывается только у первого запроса и должен вернуть итератор событий.
+        Возвращает (ведущий ли это запрос, итератор событий с начала генерации).
+        """
+        if key is None:
+            return True, start()
+
+        with self._lock:
+            flight = self._flights.get(key)
+            # Отмененная генерация еще может быть в словаре до следующего события сервера
+            if flight is not None and flight.cancelled:
+                flight = None
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+            with flight.condition:
+                flight.subscribers += 1
+        if leader:
+            threading.Thread(target=self._produce, args=(key, flight, start),
+                             name="coalescer-flight", daemon=True).start()
+        return leader, self._consume(flight)
+
+    def _consume(self, flight: _Flight) -> Iterator[Event]:
+        try:
+            yield from self._replay(flight)
+        finally:
+            with flight.condition:
+                flight.subscribers -= 1
+                if flight.subscribers == 0 and not flight.finished:
+                    flight.cancelled = True
+
+    def _replay(self, flight: _Flight) -> Iterator[Event]:
+        index = 0
+        while True:
+            with flight.condition:
+                while index >= len(flight.events) and not flight.finished:
+                    if not flight.condition.wait(self.wait_timeout):
+                        raise TimeoutError("Генерация не ответила за отведенное время")
+                events = flight.events[index:]
+                index = len(flight.events)
+                finished = flight.finished
+            yield from events
+            if finished and index >= len(flight.events):
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    def _produce(self, key: Hashable, flight: _Flight, start: Callable[[], Iterator[Event]]):
+        iterator = None
+        try:
+            iterator = start()
+            for event in iterator:
+                with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+                    if flight.cancelled:
+                        break
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.stats["errors"] += 1
+        finally:
+            # Закрытие генератора закрывает HTTP-ответ и останавливает генерацию на сервере
+            if iterator is not None and hasattr(iterator, "close"):
+                iterator.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.cancelled:
+                    self.stats["cancelled"] += 1
+            with flight.condition:
+                flight.finished = True
+                flight.condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._flights), **self.stats}
+
+
+_shared_coalescer: Optional[RequestCoalescer] = None
+_shared_lock = threading.Lock()
+
+
+def get_request_coalescer() -> RequestCoalescer:
+    """Общий для процесса объединитель запросов (все сессии виджета)"""
+    global _shared_coalescer
+    with _shared_lock:
+        if _shared_coalescer is None:
+            _shared_coalescer = RequestCoalescer()
+        return _shared_coalescer
@@ -0,0 +1,120 @@
+"""
+Кэш эмбеддингов запросов и результатов поиска по базе знаний (LRU + TTL)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from local_embeddings import HashingEmbeddingAPI
+
+
+def normalize_query(query: str) -> str:
+    """Нормализованная форма запроса для ключа кэша"""
+    return HashingEmbeddingAPI.normalize_text(query)
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 600.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получить значение или None (устаревшие записи удаляются)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Сохранить значение, вытесняя самые давно использованные записи"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class RetrievalCache:
+    """Кэш эмбеддингов запросов и top-k результатов, версионированный по сборке базы знаний
+
+    Эмбеддинг запроса зависит только от текста и модели, поэтому переживает
+    пересборку базы. Результаты поиска привязаны к версии базы знаний и
+    сбрасываются при первом обращении после любого изменения индекса.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 600.0):
+        self.embeddings = TTLCache(max_size, ttl_seconds)
+        self.results = TTLCache(max_size, ttl_seconds)
+        self.kb_version: Optional[int] = None
+
+    @staticmethod
+    def embedding_key(query: str, embedding_api) -> tuple:
+        backend = f"{type(embedding_api).__name__}:{getattr(embedding_api, 'base_url', '')}"
+        return backend, normalize_query(query)
+
+    def get_embedding(self, query: str, embedding_api) -> Optional[list]:
+        return self.embeddings.get(self.embedding_key(query, embedding_api))
+
+    def set_embedding(self, query: str, embedding_api, embedding: list):
+        self.embeddings.set(self.embedding_key(query, embedding_api), embedding)
+
+    def _check_version(self, kb_version: int):
+        if kb_version != self.kb_version:
+            self.results.clear()
+            self.kb_version = kb_version
+
+    def get_results(self, query: str, embedding_api, kb_version: int, top_k: int) -> Optional[list]:
+        self._check_version(kb_version)
+        return self.results.get(self.embedding_key(query, embedding_api) + (kb_version, top_k))
+
+    def set_results(self, query: str, embedding_api, kb_version: int, top_k: int, results: list):
+        self._check_version(kb_version)
+        self.results.set(self.embedding_key(query, embedding_api) + (kb_version, top_k), results)
+
+    def clear(self):
+        self.embeddings.clear()
+        self.results.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "kb_version": self.kb_version,
+            "embeddings": self.embeddings.get_stats(),
+            "results": self.results.get_stats()
+        }
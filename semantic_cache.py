@@ -0,0 +1,163 @@
+"""
+Семантический кэш ответов на первые вопросы пациентов (перефразированные FAQ)
+"""
+
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def prompt_fingerprint(system_prompt: str) -> str:
+    """Короткий отпечаток системного промпта для ключа кэша"""
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class SemanticAnswerCache:
+    """Ограниченный кэш ответов с векторным поиском ближайшего вопроса
+
+    Эмбеддинги вопросов хранятся в предвыделенной float32-матрице, поиск — одно
+    матрично-векторное умножение. Ответ отдается, только если совпадает пространство
+    имен — отпечаток базы знаний, отпечаток системного промпта, модель и то, включена
+    ли база знаний в сессии, — а сходство не ниже порога.
+    При переполнении вытесняется давно не использованная запись.
+    """
+
+    def __init__(self, max_entries: int = 512, similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+
+        self._matrix: Optional[np.ndarray] = None
+        self._namespaces: List[Optional[Tuple[str, str, str, bool]]] = [None] * max_entries
+        self._questions: List[Optional[str]] = [None] * max_entries
+        self._answers: List[Optional[str]] = [None] * max_entries
+        self._created_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "stored": 0,
+            "evictions": 0,
+            "served_latency_ms_total": 0.0
+        }
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, embedding, kb_version: str, prompt_key: str, model: str = "",
+               use_knowledge_base: bool = True) -> Optional[Dict[str, Any]]:
+        """Найти ответ на близкий вопрос; None, если подходящей записи нет"""
+        started = time.perf_counter()
+        query = self._normalize(embedding)
+        namespace = (kb_version, prompt_key, model, use_knowledge_base)
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            if self._size == 0 or self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                self.stats["misses"] += 1
+                return None
+
+            now = time.time()
+            similarities = self._matrix[:self._size] @ query
+            valid = np.fromiter((ns == namespace for ns in self._namespaces[:self._size]),
+                                dtype=bool, count=self._size)
+            valid &= (now - self._created_at[:self._size]) < self.ttl_seconds
+            similarities = np.where(valid, similarities, -np.inf)
+
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.similarity_threshold:
+                self.stats["misses"] += 1
+                return None
+
+            self._last_used[best] = now
+            self.stats["hits"] += 1
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.stats["served_latency_ms_total"] += latency_ms
+            return {
+                "answer": self._answers[best],
+                "question": self._questions[best],
+                "similarity": similarity,
+                "latency_ms": latency_ms
+            }
+
+    def store(self, question: str, embedding, answer: str, kb_version: str, prompt_key: str,
+              model: str = "", use_knowledge_base: bool = True):
+        """Сохранить ответ на вопрос в пространстве имен (база, промпт, модель, режим базы)"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # Новая модель эмбеддингов — старые записи несопоставимы
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._size = 0
+
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.stats["evictions"] += 1
+
+            now = time.time()
+            self._matrix[slot] = vector
+            self._namespaces[slot] = (kb_version, prompt_key, model, use_knowledge_base)
+            self._questions[slot] = question
+            self._answers[slot] = answer
+            self._created_at[slot] = now
+            self._last_used[slot] = now
+            self.stats["stored"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        hits = self.stats["hits"]
+        return {
+            "size": self._size,
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.similarity_threshold,
+            "lookups": lookups,
+            "hits": hits,
+            "misses": self.stats["misses"],
+            "stored": self.stats["stored"],
+            "evictions": self.stats["evictions"],
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "avg_served_latency_ms": round(self.stats["served_latency_ms_total"] / hits, 3) if hits else 0.0
+        }
+
+
+_shared_cache: Optional[SemanticAnswerCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticAnswerCache:
+    """Общий для процесса семантический кэш (все сессии виджета)
+
+    SEMANTIC_CACHE_THRESHOLD — минимальное косинусное сходство вопросов,
+    SEMANTIC_CACHE_MAX_ENTRIES — записей в кэше, SEMANTIC_CACHE_TTL — срок жизни ответа в секундах.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = SemanticAnswerCache(
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512")),
+                similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+                ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+            )
+        return _shared_cache
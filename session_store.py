@@ -0,0 +1,155 @@
+"""
+Ограниченное хранилище сессий виджета: вытеснение по простою и по числу сессий
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import count_session_evicted
+
+
+class SessionStore:
+    """Сессии чата с idle TTL и LRU-ограничением числа сессий
+
+    Каждое обращение переносит сессию в конец порядка использования. Сессии,
+    не использовавшиеся дольше idle_ttl_seconds, удаляет фоновый поток раз в
+    sweep_interval_seconds; при превышении max_sessions сразу вытесняется давно
+    неиспользуемая. Для вытесненной сессии вызывается on_evict (сброс связанного
+    состояния, например прогрева кэша). Сессия, которой запрос еще пользуется,
+    дорабатывает: вытеснение только забывает ее, следующий запрос начнет новую.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_sessions: int = 1000,
+                 idle_ttl_seconds: float = 1800.0, sweep_interval_seconds: float = 60.0,
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.factory = factory
+        self.max_sessions = max(max_sessions, 1)
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.on_evict = on_evict
+
+        # session_id -> (сессия, время последнего обращения); порядок — от давно неиспользуемых
+        self._sessions: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"created": 0, "expired": 0, "evicted_capacity": 0, "sweeps": 0}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def __contains__(self, session_id: Hashable) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def get(self, session_id: Hashable) -> Optional[Any]:
+        """Сессия по идентификатору (с продлением срока) или None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], time.monotonic())
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def get_or_create(self, session_id: str) -> Any:
+        """Существующая сессия или новая, созданная factory(session_id)"""
+        session = self.get(session_id)
+        if session is not None:
+            return session
+
+        # Создание может быть долгим (первая сессия загружает ядро RAG): вне блокировки
+        self.start_sweeper()
+        created = self.factory(session_id)
+        evicted = []
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                # Параллельный запрос с тем же идентификатором успел раньше
+                session = entry[0]
+            else:
+                session = created
+                self.stats["created"] += 1
+                while len(self._sessions) >= self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False))
+                    self.stats["evicted_capacity"] += 1
+            self._sessions[session_id] = (session, time.monotonic())
+            self._sessions.move_to_end(session_id)
+        self._evicted(evicted, "capacity")
+        return session
+
+    def sweep(self) -> int:
+        """Удалить сессии, простаивающие дольше idle_ttl_seconds; возвращает их число"""
+        deadline = time.monotonic() - self.idle_ttl_seconds
+        expired = []
+        with self._lock:
+            # Порядок по времени обращения: просроченные — в начале
+            while self._sessions:
+                _, last_used = next(iter(self._sessions.values()))
+                if last_used >= deadline:
+                    break
+                expired.append(self._sessions.popitem(last=False))
+            self.stats["expired"] += len(expired)
+            self.stats["sweeps"] += 1
+        self._evicted(expired, "idle")
+        return len(expired)
+
+    def _evicted(self, entries, reason: str):
+        for session_id, (session, _) in entries:
+            count_session_evicted(reason)
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(session_id, session)
+                except Exception as e:
+                    print(f"⚠️  Ошибка при удалении сессии {session_id}: {e}")
+
+    def start_sweeper(self):
+        """Запустить фоновую очистку (один раз, в процессе воркера после fork)"""
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️  Ошибка очистки сессий: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            oldest = next(iter(self._sessions.values()), None)
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "oldest_idle_seconds": round(now - oldest[1], 1) if oldest is not None else 0.0,
+                **self.stats
+            }
+
+
+def session_store_from_env(factory: Callable[[str], Any],
+                           on_evict: Optional[Callable[[str, Any], None]] = None) -> SessionStore:
+    """Хранилище сессий с настройками из окружения
+
+    SESSION_MAX — сессий в воркере, SESSION_IDLE_TTL — секунд простоя до удаления,
+    SESSION_SWEEP_INTERVAL — период фоновой очистки в секундах.
+    """
+    return SessionStore(
+        factory,
+        max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+        idle_ttl_seconds=float(os.getenv("SESSION_IDLE_TTL", "1800")),
+        sweep_interval_seconds=float(os.getenv("SESSION_SWEEP_INTERVAL", "60")),
+        on_evict=on_evict
+    )
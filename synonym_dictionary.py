@@ -4,6 +4,7 @@
 """
 
 import re
+from typing import List, Tuple
 
 SYNONYM_DICT = {
     # Русские аббревиатуры - короткие формы
@@ -69,6 +70,51 @@ def expand_synonyms(query: str) -> str:
     
     return query
 
+def find_abbreviations(query: str) -> List[Tuple[int, int, str]]:
+    """
+    Все непересекающиеся вхождения ключей словаря: (начало, конец, расшифровка)
+    """
+    query_lower = query.lower()
+    spans: List[Tuple[int, int, str]] = []
+    for key in sorted(SYNONYM_DICT.keys(), key=len, reverse=True):
+        for match in re.finditer(re.escape(key), query_lower):
+            start, end = match.span()
+            if all(end <= s or start >= e for s, e, _ in spans):
+                spans.append((start, end, SYNONYM_DICT[key]))
+    return sorted(spans)
+
+
+def query_variants(query: str, max_variants: int = 4) -> List[str]:
+    """
+    Варианты запроса для многозапросного поиска: исходная формулировка,
+    результат expand_synonyms, запрос со всеми расшифрованными аббревиатурами
+    и исходный запрос с дописанными расшифровками. Дубликаты отбрасываются
+    """
+    query = query.strip()
+    variants = [query, expand_synonyms(query)]
+
+    spans = find_abbreviations(query)
+    if spans:
+        parts, position = [], 0
+        for start, end, expansion in spans:
+            parts.append(query[position:start])
+            parts.append(expansion)
+            position = end
+        parts.append(query[position:])
+        variants.append("".join(parts))
+        expansions = list(dict.fromkeys(expansion for _, _, expansion in spans))
+        variants.append(f"{query} ({', '.join(expansions)})")
+
+    unique: List[str] = []
+    seen = set()
+    for variant in variants:
+        key = " ".join(re.findall(r"\w+", variant.lower().replace("ё", "е")))
+        if variant and key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique[:max_variants]
+
+
 def get_abbreviation_expansion(abbreviation: str) -> str:
     """
     Возвращает расшифровку аббревиатуры
@@ -89,4 +135,6 @@ if __name__ == "__main__":
     print("🧪 Тестирование словаря синонимов:")
     for query in test_queries:
         expanded = expand_synonyms(query)
-        print(f"  '{query}' → '{expanded}'")
\ No newline at end of file
+        print(f"  '{query}' → '{expanded}'")
+        for variant in query_variants(query)[1:]:
+            print(f"      вариант: '{variant}'")
\ No newline at end of file
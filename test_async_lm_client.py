@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Проверка асинхронного клиента LM Studio на фейковом сервере
+
+- лимит параллельных запросов общий для процесса: запросы из двух event loop
+  в разных потоках не превышают max_concurrency;
+- потоковый ответ приходит по токенам, а молчащий сервер прерывается по
+  stream_idle_timeout;
+- прерванный поток и отмененная задача закрывают сокет, и сервер прекращает генерацию.
+
+    python test_async_lm_client.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+from async_lm_client import AsyncLMStudioClient, get_async_client
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer
+from test_support import report
+
+MESSAGES = [{"role": "user", "content": "Как записаться на МРТ?"}]
+
+
+def wait_disconnects(fake: FakeLMStudioServer, expected: int, timeout: float) -> bool:
+    started = time.monotonic()
+    while fake.stats.snapshot()["client_disconnects"] < expected and time.monotonic() - started < timeout:
+        time.sleep(0.02)
+    return fake.stats.snapshot()["client_disconnects"] >= expected
+
+
+def check_concurrency(fake: FakeLMStudioServer) -> bool:
+    print("🚦 Лимит параллельных запросов (max_concurrency=3, два event loop по 6 запросов):")
+    fake.config.latency_ms = 300
+    client = get_async_client(fake.base_url, max_concurrency=8)
+    client = get_async_client(fake.base_url, max_concurrency=3)
+    results = []
+
+    async def burst():
+        return await asyncio.gather(*(client.chat_completion(MESSAGES, "fake", max_tokens=4) for _ in range(6)))
+
+    threads = [threading.Thread(target=lambda: results.extend(asyncio.run(burst()))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    max_in_flight = fake.stats.snapshot()["max_in_flight"]
+    ok = report(client.max_concurrency == 3, f"повторный get_async_client применил лимит: {client.max_concurrency}")
+    ok = report(len(results) == 12 and all(results), f"ответов: {sum(1 for r in results if r)} из 12") and ok
+    ok = report(max_in_flight == 3, f"одновременно на сервере не больше {max_in_flight}") and ok
+    ok = report(client.in_flight == 0, "все слоты освобождены") and ok
+    return ok
+
+
+def check_streaming(fake: FakeLMStudioServer) -> bool:
+    print("📡 Потоковый ответ:")
+    fake.config.latency_ms = 20
+    fake.config.tokens_per_sec = 50
+    client = AsyncLMStudioClient(fake.base_url, max_concurrency=2)
+
+    async def collect():
+        return [delta async for delta in client.stream_chat_completion(MESSAGES, "fake", max_tokens=10)]
+
+    deltas = asyncio.run(collect())
+    ok = report(len(deltas) == 10, f"получено токенов: {len(deltas)}")
+
+    fake.config.tokens_per_sec = 1
+    idle = AsyncLMStudioClient(fake.base_url, stream_idle_timeout=0.3)
+
+    async def stalled():
+        async for _ in idle.stream_chat_completion(MESSAGES, "fake", max_tokens=10):
+            pass
+
+    started = time.monotonic()
+    try:
+        asyncio.run(stalled())
+        timed_out = False
+    except asyncio.TimeoutError:
+        timed_out = True
+    elapsed = time.monotonic() - started
+    ok = report(timed_out and elapsed < 3.0 and idle.in_flight == 0,
+                f"сервер молчит дольше stream_idle_timeout: прервано через {elapsed:.2f} с") and ok
+    return ok
+
+
+def check_cancellation(fake: FakeLMStudioServer) -> bool:
+    print("✂️  Отмена закрывает соединение:")
+    fake.config.latency_ms = 20
+    fake.config.tokens_per_sec = 10
+    client = AsyncLMStudioClient(fake.base_url, max_concurrency=2)
+
+    async def read_two_tokens():
+        stream = client.stream_chat_completion(MESSAGES, "fake", max_tokens=50)
+        received = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return received
+
+    disconnects = fake.stats.snapshot()["client_disconnects"]
+    asyncio.run(read_two_tokens())
+    ok = report(wait_disconnects(fake, disconnects + 1, 2.0) and client.in_flight == 0,
+                "прерванный поток: сервер прекратил генерацию, слот освобожден")
+
+    async def cancel_after(seconds: float, coroutine):
+        task = asyncio.create_task(coroutine)
+        await asyncio.sleep(seconds)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def consume():
+        async for _ in client.stream_chat_completion(MESSAGES, "fake", max_tokens=50):
+            pass
+
+    asyncio.run(cancel_after(0.3, consume()))
+    ok = report(wait_disconnects(fake, disconnects + 2, 2.0) and client.in_flight == 0,
+                "отмененная задача с потоком: сервер прекратил генерацию, слот освобожден") and ok
+
+    # Без stream сервер молчит до конца генерации: обрыв он заметит при отправке ответа
+    fake.config.latency_ms = 1000
+    asyncio.run(cancel_after(0.3, client.chat_completion(MESSAGES, "fake", max_tokens=4)))
+    ok = report(client.in_flight == 0, "отмененная задача без потока: слот освобожден сразу") and ok
+    ok = report(wait_disconnects(fake, disconnects + 3, 3.0), "сокет закрыт, ответ сервера не доставлен") and ok
+    return ok
+
+
+def main():
+    fake = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=20, tokens_per_sec=0, max_concurrency=16)).start()
+    try:
+        ok = check_concurrency(fake)
+        ok = check_streaming(fake) and ok
+        ok = check_cancellation(fake) and ok
+    finally:
+        fake.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Бюджет времени импорта для старта и перезапуска воркеров gunicorn
+
+Каждый модуль импортируется в отдельном процессе с `python -X importtime`
+несколько раз (IMPORT_RUNS, по умолчанию 5); с бюджетом сравнивается медиана
+суммарного времени импорта. Проверяется и то, что консольные библиотеки
+(rich, colorama) не попадают в путь загрузки веб-сервера.
+
+    python test_import_time.py
+    IMPORT_BUDGET_MS=300 IMPORT_RUNS=9 python test_import_time.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+# Модуль → бюджет в миллисекундах (переопределяется IMPORT_BUDGET_MS): вдвое больше
+# измеренной медианы (rag_engine ≈ 300 мс, widget_server ≈ 460 мс на свободной машине),
+# чтобы шум CI не ронял проверку, а заметная регрессия — ловилась
+BUDGETS_MS = {
+    "rag_engine": 650,
+    "widget_server": 950,
+}
+
+# Модули, которые не должны импортироваться воркером
+FORBIDDEN_MODULES = ("rich", "colorama")
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, float]]:
+    """Суммарное время импорта модуля (мс) и время каждого импортированного пакета верхнего уровня"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "ошибка импорта")
+
+    total_us = 0
+    packages: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        total_us += int(self_us)
+        top_level = name.split(".")[0]
+        packages[top_level] = packages.get(top_level, 0.0) + int(self_us) / 1000
+    return total_us / 1000, packages
+
+
+def measure_median(module: str, runs: int) -> Tuple[float, Dict[str, float]]:
+    """Медиана времени импорта по нескольким запускам и пакеты медианного запуска"""
+    results = sorted((measure_import(module) for _ in range(max(runs, 1))), key=lambda result: result[0])
+    median_ms = statistics.median(total for total, _ in results)
+    return median_ms, results[len(results) // 2][1]
+
+
+def main():
+    override = os.environ.get("IMPORT_BUDGET_MS")
+    runs = int(os.environ.get("IMPORT_RUNS", "5"))
+    failed = False
+
+    print(f"⏱️  Проверка времени импорта (медиана {runs} запусков)")
+    for module, budget_ms in BUDGETS_MS.items():
+        budget_ms = float(override) if override else budget_ms
+        try:
+            total_ms, packages = measure_median(module, runs)
+        except RuntimeError as e:
+            print(f"  ❌ {module}: {e}")
+            failed = True
+            continue
+
+        forbidden = [name for name in FORBIDDEN_MODULES if name in packages]
+        status = "✅" if total_ms <= budget_ms and not forbidden else "❌"
+        failed = failed or status == "❌"
+        print(f"  {status} {module}: {total_ms:.0f} мс (бюджет {budget_ms:.0f} мс)")
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:5]
+        print("     самые тяжелые: " + ", ".join(f"{name} {ms:.0f} мс" for name, ms in heaviest))
+        if forbidden:
+            print(f"     импортированы консольные библиотеки: {', '.join(forbidden)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Проверка перезагрузки базы знаний при недоступном сервере эмбеддингов
+
+База эмбеддится на fake_lm_studio, после чего сервер останавливается и ядро
+создается заново (как при перезапуске воркера): и для неизмененного, и для
+измененного файла базы сохраненные эмбеддинги должны остаться на месте, а не
+обнулиться или пропасть.
+
+    python test_kb_reload.py
+"""
+
+import json
+import os
+import sys
+
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer
+from rag_engine import VODC_KB_PATH, RAGCore
+from test_support import report, temporary_knowledge_base
+
+VECTOR_STORE_PATH = os.path.join("knowledge_base", "vector_store.json")
+
+
+def stored_embeddings() -> dict:
+    """Чанк (файл, номер) → есть ли у него эмбеддинг в сохраненном хранилище"""
+    with open(VECTOR_STORE_PATH, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {f"{doc['filename']}#{doc['chunk_id']}": bool(doc.get("embedding")) for doc in data.get("documents", [])}
+
+
+def check_reload(base_url: str, expected: dict, title: str) -> bool:
+    print(title)
+    core = RAGCore(base_url)
+    in_memory = core.knowledge_base.vector_store.documents
+    ok = report(len(in_memory) == len(expected) and all(doc.embedding for doc in in_memory),
+                f"в памяти {len(in_memory)} чанков с эмбеддингами из {len(expected)}")
+    ok = report(stored_embeddings() == expected, "vector_store.json не изменился") and ok
+    return ok
+
+
+def main():
+    fake = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=20)).start()
+    base_url = fake.base_url
+    running = True
+    try:
+        with temporary_knowledge_base("vodc_kb_reload_"):
+            print("📚 Загрузка базы с сервером эмбеддингов:")
+            RAGCore(base_url)
+            expected = stored_embeddings()
+            ok = report(bool(expected) and all(expected.values()), f"сохранено {len(expected)} чанков с эмбеддингами")
+
+            fake.stop()
+            running = False
+            ok = check_reload(base_url, expected, "🔌 Сервер остановлен, файл базы не изменился:") and ok
+
+            with open(VODC_KB_PATH, "a", encoding="utf-8") as f:
+                f.write("\n\n## Новый раздел\n\nДобавлен после первичной загрузки базы.\n")
+            ok = check_reload(base_url, expected, "🔌 Сервер остановлен, файл базы изменился:") and ok
+    finally:
+        if running:
+            fake.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Проверка отмены запросов пула LM Studio на фейковых серверах
+
+- хеджирование: проигравший запрос к медленному серверу обрывается сразу после
+  ответа быстрого, его слот освобождается, а сервер не считается сбойным;
+  если сокет проигравшего найти не удалось, его ответ закрывается по приходу;
+- крайний срок потокового ответа соблюдается и по сокету соединения, и без него.
+
+    python test_llm_pool.py
+"""
+
+import sys
+import time
+from unittest import mock
+
+import llm_pool
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer
+from llm_pool import DeadlineExceeded, LLMBackendPool, _AbortableAdapter, iter_lines_until
+from test_support import report
+
+SLOW_LATENCY_MS = 4000
+PAYLOAD = {"model": "fake", "messages": [{"role": "user", "content": "Как записаться на МРТ?"}], "max_tokens": 8}
+
+
+def hedged_pool(slow: FakeLMStudioServer, fast: FakeLMStudioServer) -> LLMBackendPool:
+    # Больший вес — меньшая загрузка: первым всегда выбирается медленный сервер
+    pool = LLMBackendPool([(slow.base_url, 10.0), (fast.base_url, 1.0)], health_interval=0,
+                          hedge=True, hedge_min_samples=5, hedge_min_delay=0.2)
+    pool._latencies.extend([0.2] * 5)
+    return pool
+
+
+def wait_released(pool: LLMBackendPool, timeout: float) -> float:
+    started = time.monotonic()
+    while any(b.outstanding for b in pool.backends) and time.monotonic() - started < timeout:
+        time.sleep(0.02)
+    return time.monotonic() - started
+
+
+def check_hedge_abort(slow: FakeLMStudioServer, fast: FakeLMStudioServer) -> bool:
+    print("✂️  Хеджирование: проигравший запрос обрывается")
+    pool = hedged_pool(slow, fast)
+    started = time.monotonic()
+    response = pool.complete(PAYLOAD)
+    elapsed = time.monotonic() - started
+    ok = report(response.status_code == 200 and response.backend_url == fast.base_url and elapsed < 1.5,
+                f"ответ быстрого сервера за {elapsed:.2f} с")
+    released = wait_released(pool, 2.0)
+    ok = report(pool.backends[0].outstanding == 0 and released < 1.0,
+                f"слот медленного сервера освобожден через {released:.2f} с "
+                f"(сервер ответил бы через {SLOW_LATENCY_MS / 1000:.0f} с)") and ok
+    ok = report(pool.stats["hedges_cancelled"] == 1 and pool.backends[0].stats["errors"] == 0,
+                f"отменено хеджей: {pool.stats['hedges_cancelled']}, ошибок сервера: "
+                f"{pool.backends[0].stats['errors']}") and ok
+    return ok
+
+
+def check_hedge_untracked(slow: FakeLMStudioServer, fast: FakeLMStudioServer) -> bool:
+    print("✂️  Хеджирование без найденного сокета: ответ проигравшего закрывается по приходу")
+    pool = hedged_pool(slow, fast)
+    with mock.patch.object(_AbortableAdapter, "_register", lambda self, sock: None):
+        started = time.monotonic()
+        response = pool.complete(PAYLOAD)
+        elapsed = time.monotonic() - started
+        ok = report(response.status_code == 200 and elapsed < 1.5, f"ответ быстрого сервера за {elapsed:.2f} с")
+        wait_released(pool, SLOW_LATENCY_MS / 1000 + 2.0)
+    ok = report(pool.backends[0].outstanding == 0 and pool.stats["hedges_cancelled"] == 1
+                and pool.backends[0].stats["errors"] == 0,
+                "слот освобожден, отмена учтена, сервер не считается сбойным") and ok
+    return ok
+
+
+def stream_until(pool: LLMBackendPool, deadline_seconds: float) -> tuple:
+    started = time.monotonic()
+    deadline = started + deadline_seconds
+    lines = 0
+    try:
+        with pool.stream({**PAYLOAD, "stream": True}, deadline) as response:
+            for _ in iter_lines_until(response, deadline):
+                lines += 1
+    except DeadlineExceeded:
+        return True, time.monotonic() - started
+    return False, time.monotonic() - started
+
+
+def check_stream_deadline(server: FakeLMStudioServer) -> bool:
+    print("⏱️  Крайний срок потокового ответа (токен раз в 0.5 с, срок 1.2 с)")
+    pool = LLMBackendPool([(server.base_url, 1.0)], health_interval=0)
+    raised, elapsed = stream_until(pool, 1.2)
+    ok = report(raised and elapsed < 1.4, f"по сокету соединения: прервано через {elapsed:.2f} с")
+
+    # Сокет не найден (например, после обновления urllib3): срок проверяется между порциями
+    with mock.patch.object(llm_pool, "_response_socket", lambda response: None):
+        raised, elapsed = stream_until(pool, 1.2)
+    ok = report(raised and elapsed < 1.9, f"без сокета: прервано через {elapsed:.2f} с") and ok
+    ok = report(pool.backends[0].outstanding == 0 and pool.backends[0].stats["errors"] == 0,
+                "слот освобожден, сервер не считается сбойным") and ok
+    return ok
+
+
+def main():
+    slow = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=SLOW_LATENCY_MS, tokens_per_sec=0)).start()
+    fast = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=50, tokens_per_sec=0)).start()
+    streaming = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=10, tokens_per_sec=2,
+                                                      completion_tokens=20)).start()
+    try:
+        ok = check_hedge_abort(slow, fast)
+        ok = check_hedge_untracked(slow, fast) and ok
+        ok = check_stream_deadline(streaming) and ok
+    finally:
+        for server in (slow, fast, streaming):
+            server.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Проверка оценки токенов промпта и ее поправки по usage.prompt_tokens сервера
+
+- PromptBuilder принимает настоящий токенизатор через CallableTokenizer;
+- движок записывает размеры отправленных промптов и usage сервера в журнал
+  (без текста), а fit_token_scale по журналу уменьшает ошибку оценки;
+- поправка из PROMPT_TOKEN_SCALE применяется к сборщику промпта движка.
+
+Сервер LM Studio заменяет fake_lm_studio (его prompt_tokens — длина/4 на
+сообщение: словарь «другой модели», под который оценку и нужно подстроить).
+
+    python test_prompt_tokens.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer
+from prompt_builder import (CallableTokenizer, PromptBuilder, fit_token_scale, load_usage_samples,
+                            prompt_builder_from_env, prompt_estimate_error)
+from test_support import report, temporary_knowledge_base
+
+QUESTIONS = [
+    "Как подготовиться к УЗИ брюшной полости?",
+    "Какие анализы нужно сдать перед гастроскопией?",
+    "Сколько стоит МРТ коленного сустава и нужна ли запись?",
+    "Можно ли пройти обследование по полису ОМС без направления?",
+    "Чем отличается КТ от МРТ и что лучше при головных болях?",
+    "Какие документы взять с собой на первичный прием к неврологу?",
+    "Есть ли в центре лаборатория и как получить результаты анализов?",
+    "Принимает ли центр пациентов из других районов Воронежской области?",
+]
+
+
+def check_tokenizer_adapter() -> bool:
+    print("🔤 Токенизатор модели вместо оценки:")
+    builder = PromptBuilder(estimator=CallableTokenizer(str.split))
+    question = "Как записаться на МРТ головного мозга?"
+    result = builder.build("Вы помощник ВОККДЦ.", ["Запись по телефону call-центра."], [], question)
+    expected = len(question.split()) + PromptBuilder.MESSAGE_OVERHEAD_TOKENS
+    return report(result.breakdown["user"] == expected,
+                  f"вопрос: {result.breakdown['user']} токенов по токенизатору (ожидалось {expected})")
+
+
+def check_calibration(base_url: str, usage_path: str) -> bool:
+    print("📏 Поправка оценки по usage.prompt_tokens:")
+    from rag_engine import RAGEngine
+
+    engine = RAGEngine(base_url, use_local_embeddings=True)
+    engine.use_router = False
+    engine.use_semantic_cache = False
+    for question in QUESTIONS:
+        engine.send_message(question)
+
+    samples = engine.prompt_usage_log.snapshot()
+    ok = report(len(samples) == len(QUESTIONS) and all("chars" in s and "prompt_tokens" in s for s in samples),
+                f"в журнале {len(samples)} промптов из {len(QUESTIONS)}")
+    with open(usage_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    ok = report(len(load_usage_samples(usage_path)) == len(QUESTIONS) and QUESTIONS[0] not in text,
+                "журнал записан в PROMPT_USAGE_LOG без текста вопросов") and ok
+
+    scale = fit_token_scale(samples)
+    before = prompt_estimate_error(samples, scale=1.0)
+    after = prompt_estimate_error(samples, scale=scale)
+    ok = report(after < before / 2 and after < 0.1,
+                f"средняя ошибка оценки {before:.1%} → {after:.1%} (scale={scale:.3f})") and ok
+
+    # Подобранная поправка из окружения попадает в сборщик промпта новых сессий
+    os.environ["PROMPT_TOKEN_SCALE"] = f"{scale:.3f}"
+    builder = prompt_builder_from_env()
+    ok = report(abs(builder.estimator.scale - scale) < 0.001,
+                f"PROMPT_TOKEN_SCALE применен: {builder.estimator.scale:.3f}") and ok
+
+    engine.prompt_builder = builder
+    engine.send_message(QUESTIONS[0])
+    estimated = engine.last_prompt_report["prompt_tokens"]
+    actual = engine.last_prompt_report["actual_prompt_tokens"]
+    ok = report(abs(estimated - actual) / actual < 0.1,
+                f"оценка с поправкой {estimated} при реальных {actual} токенах") and ok
+    return ok
+
+
+def main():
+    fake = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=5, tokens_per_sec=0,
+                                                 completion_tokens=12)).start()
+    usage_dir = tempfile.mkdtemp(prefix="vodc_prompt_usage_")
+    usage_path = os.path.join(usage_dir, "prompt_usage.jsonl")
+    os.environ["PROMPT_USAGE_LOG"] = usage_path
+    try:
+        ok = check_tokenizer_adapter()
+        with temporary_knowledge_base("vodc_prompt_tokens_"):
+            ok = check_calibration(fake.base_url, usage_path) and ok
+    finally:
+        fake.stop()
+        shutil.rmtree(usage_dir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
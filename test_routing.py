@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Проверка маршрутизации вопросов без LLM: быстрые ответы только там, где они уместны
+
+База знаний ВОККДЦ загружается с локальными эмбеддингами во временную
+директорию (knowledge_base/vector_store.json проекта не меняется).
+
+    python test_routing.py
+"""
+
+import sys
+
+from intent_router import HashingEmbeddingAPI
+from rag_engine import RAGCore
+from test_support import report, temporary_knowledge_base
+
+# Вопрос → справочный intent (lookup) или None — вопрос не справочный
+LOOKUP_CASES = [
+    # «Пройти» в клинике — обследование, а не дорога
+    ("Как пройти МРТ?", None),
+    ("Как пройти диспансеризацию?", None),
+    # «Номер» без «телефона» — полис, талон
+    ("Какой номер полиса нужен?", None),
+    ("Где взять номер талона?", None),
+    ("Как пройти к вам?", "address"),
+    ("Где вы находитесь?", "address"),
+    ("Номер телефона регистратуры", "phone"),
+]
+
+# Вопрос → прямой ответ из справочных таблиц (True) или передача в RAG (False)
+FACT_CASES = [
+    ("Какой номер полиса нужен для записи?", False),
+    ("Номер талона где посмотреть?", False),
+    # Таблица выбрана, но строка не совпала: не отвечать всей таблицей
+    ("Телефон кабинета флюорографии", False),
+    ("Где вы находитесь?", True),
+    ("Телефон call-центра", True),
+]
+
+# Вопрос → ответ из FAQ (True) или передача дальше (False)
+FAQ_CASES = [
+    ("Что такое ВОККДЦ?", True),
+    # Подзаголовки — не вопросы, а части ответа
+    ("Синонимы и альтернативные названия", False),
+    ("Основная информация о ВОККДЦ", False),
+]
+
+
+def check_lookup_intents(core: RAGCore) -> bool:
+    print("🧭 Справочные intent-ы:")
+    ok = True
+    for question, expected in LOOKUP_CASES:
+        normalized = HashingEmbeddingAPI.normalize_text(question)
+        lookup = core.intent_router.classify_lookup(normalized, normalized.split())
+        actual = lookup[0] if lookup else None
+        ok = report(actual == expected, f"{question!r}: {actual} (ожидалось {expected})") and ok
+    return ok
+
+
+def check_fact_tables(core: RAGCore) -> bool:
+    print("📋 Справочные таблицы:")
+    ok = True
+    for question, expected in FACT_CASES:
+        fact = core.fact_tables.answer(question)
+        answered = f"ответ ({fact['confidence']:.2f})" if fact else "в RAG"
+        ok = report((fact is not None) == expected, f"{question!r}: {answered}") and ok
+    return ok
+
+
+def check_faq(core: RAGCore) -> bool:
+    print("❓ FAQ:")
+    ok = True
+    for question, expected in FAQ_CASES:
+        faq = core.faq_index.lookup(question)
+        answered = f"ответ на {faq['question']!r}, {len(faq['answer'])} симв." if faq else "нет"
+        ok = report((faq is not None) == expected, f"{question!r}: {answered}") and ok
+    # Вложенные подразделы остаются в ответе на родительский вопрос
+    faq = core.faq_index.lookup("Что такое ВОККДЦ?")
+    full = faq is not None and "Синонимы и альтернативные названия" in faq["answer"]
+    return report(full, "ответ включает вложенные подразделы") and ok
+
+
+def main():
+    with temporary_knowledge_base("vodc_routing_"):
+        core = RAGCore(use_local_embeddings=True)
+        ok = check_lookup_intents(core)
+        ok = check_fact_tables(core) and ok
+        ok = check_faq(core) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Общие помощники скриптовых проверок: временная копия базы знаний и вывод результатов
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def copy_knowledge_base(target_dir: str):
+    """Скопировать исходные файлы базы знаний (без vector_store.json) во временную директорию"""
+    source = os.path.join(PROJECT_DIR, "knowledge_base")
+    os.makedirs(os.path.join(target_dir, "knowledge_base"))
+    for name in os.listdir(source):
+        if name.endswith(".md"):
+            shutil.copy2(os.path.join(source, name), os.path.join(target_dir, "knowledge_base", name))
+
+
+@contextmanager
+def temporary_knowledge_base(prefix: str = "vodc_test_") -> Iterator[str]:
+    """Перейти во временную директорию с копией базы знаний; после блока она удаляется
+
+    KnowledgeBase ищет базу по относительному пути, поэтому knowledge_base/vector_store.json
+    проекта при проверках не меняется.
+    """
+    work_dir = tempfile.mkdtemp(prefix=prefix)
+    cwd = os.getcwd()
+    try:
+        copy_knowledge_base(work_dir)
+        os.chdir(work_dir)
+        yield work_dir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def report(ok: bool, message: str) -> bool:
+    """Напечатать результат проверки с ✅/❌ и вернуть его"""
+    print(f"  {'✅' if ok else '❌'} {message}")
+    return ok
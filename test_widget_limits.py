@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Проверка ограничений веб-сервера виджета на фейковом LM Studio
+
+- сессии: вытеснение давно неиспользуемой при превышении SESSION_MAX и удаление
+  простаивающих дольше SESSION_IDLE_TTL;
+- прогрев: /chat/prefetch для еще не созданной сессии не создает ее, но прогревает
+  кэши ядра, и последующий /chat с тем же вопросом берет эмбеддинг и поиск из кэша;
+- перегрузка: при занятом слоте генерации и пустой очереди /chat и /chat/stream
+  сразу отвечают 429 с Retry-After, а допущенный запрос завершается.
+
+База знаний копируется во временную директорию, сервер LM Studio заменяет
+fake_lm_studio на свободном порту.
+
+    python test_widget_limits.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+from fake_lm_studio import FakeLMStudioConfig, FakeLMStudioServer
+from test_support import report, temporary_knowledge_base
+
+SESSION_IDLE_TTL = 2.0
+
+
+def session_exists(client, session_id: str) -> bool:
+    return client.get(f"/sessions/{session_id}").status_code == 200
+
+
+def check_prefetch(client, fake: FakeLMStudioServer, core, prefetcher) -> bool:
+    print("🔥 Прогрев по набираемому вопросу (новая сессия):")
+    question = "Как подготовиться к УЗИ брюшной полости?"
+    completed = prefetcher.stats["completed"]
+    response = client.post("/chat/prefetch", json={"message": question, "session_id": "fresh"})
+    ok = report(response.status_code == 202 and response.get_json()["status"] == "started",
+                f"/chat/prefetch: {response.status_code} {response.get_json()['status']}")
+
+    started = time.monotonic()
+    while prefetcher.stats["completed"] == completed and time.monotonic() - started < 10:
+        time.sleep(0.05)
+    ok = report(prefetcher.stats["completed"] > completed, "прогрев завершен") and ok
+    ok = report(not session_exists(client, "fresh"), "прогрев не создал сессию") and ok
+
+    embedding_requests = fake.stats.snapshot()["embedding_requests"]
+    result_hits = core.knowledge_base.cache.results.hits
+    response = client.post("/chat", json={"message": question, "session_id": "fresh"})
+    ok = report(response.status_code == 200, f"/chat: {response.status_code}") and ok
+    ok = report(core.knowledge_base.cache.results.hits > result_hits, "поиск взят из кэша ядра") and ok
+    ok = report(fake.stats.snapshot()["embedding_requests"] == embedding_requests,
+                "эмбеддинг вопроса повторно не запрашивался") and ok
+    return ok
+
+
+def check_sessions(client) -> bool:
+    print("🗂️  Сессии (SESSION_MAX=2):")
+    for session_id in ("a", "b"):
+        client.post("/chat", json={"message": "Что такое ВОККДЦ?", "session_id": session_id})
+    # Обращение к «a» делает давно неиспользуемой «b»
+    session_exists(client, "a")
+    client.post("/chat", json={"message": "Что такое ВОККДЦ?", "session_id": "c"})
+
+    ok = report(session_exists(client, "a") and session_exists(client, "c"),
+                "недавно использованные сессии a и c сохранены")
+    ok = report(not session_exists(client, "b"), "давно неиспользуемая сессия b вытеснена") and ok
+
+    time.sleep(SESSION_IDLE_TTL + 1.0)
+    ok = report(not session_exists(client, "a") and not session_exists(client, "c"),
+                f"после {SESSION_IDLE_TTL + 1.0:.0f} с простоя сессии удалены") and ok
+    return ok
+
+
+def check_admission(client, fake: FakeLMStudioServer, core) -> bool:
+    print("🚦 Перегрузка (ADMISSION_MAX_ACTIVE=1, очередь виджета 0):")
+    fake.config.latency_ms = 3000
+    first = {}
+
+    def occupy_slot():
+        response = client.post("/chat", json={"message": "Какие исследования делают в отделении неврологии?",
+                                              "session_id": "slow"})
+        first["status"] = response.status_code
+
+    thread = threading.Thread(target=occupy_slot)
+    thread.start()
+    started = time.monotonic()
+    while core.admission.get_stats()["active"] < 1 and time.monotonic() - started < 10:
+        time.sleep(0.05)
+
+    started = time.monotonic()
+    response = client.post("/chat", json={"message": "Как подготовиться к сдаче крови?", "session_id": "busy"})
+    elapsed = time.monotonic() - started
+    ok = report(response.status_code == 429 and elapsed < 1.0,
+                f"/chat: {response.status_code} за {elapsed * 1000:.0f} мс")
+    ok = report(int(response.headers.get("Retry-After", "0")) >= 1,
+                f"Retry-After: {response.headers.get('Retry-After')}") and ok
+
+    response = client.post("/chat/stream", json={"message": "Чем центр отличается от обычной поликлиники?",
+                                                  "session_id": "busy-stream"})
+    ok = report(response.status_code == 429 and "Retry-After" in response.headers,
+                f"/chat/stream: {response.status_code}") and ok
+
+    thread.join(timeout=30)
+    ok = report(first.get("status") == 200, f"допущенный запрос завершен: {first.get('status')}") and ok
+    stats = core.admission.get_stats()
+    ok = report(stats["active"] == 0 and stats["lanes"]["widget"]["rejected_full"] == 2,
+                f"слот освобожден, отказов в полосе виджета: {stats['lanes']['widget']['rejected_full']}") and ok
+    return ok
+
+
+def main():
+    fake = FakeLMStudioServer(FakeLMStudioConfig(port=0, latency_ms=20, tokens_per_sec=0,
+                                                 completion_tokens=16)).start()
+    # Настройки читаются при импорте веб-сервера и создании ядра
+    os.environ.update({
+        "LM_STUDIO_URL": fake.base_url,
+        "ADMISSION_MAX_ACTIVE": "1",
+        "ADMISSION_QUEUE_WIDGET": "0",
+        "SESSION_MAX": "2",
+        "SESSION_IDLE_TTL": str(SESSION_IDLE_TTL),
+        "SESSION_SWEEP_INTERVAL": "0.2",
+    })
+    try:
+        with temporary_knowledge_base("vodc_widget_"):
+            import widget_server
+            from rag_engine import get_rag_core
+
+            client = widget_server.app.test_client()
+            # Первая сессия загружает общее ядро: база знаний эмбеддится на фейковом сервере
+            client.post("/chat", json={"message": "Что такое ВОККДЦ?", "session_id": "warmup"})
+            core = get_rag_core(create=False)
+
+            ok = check_prefetch(client, fake, core, widget_server.prefetcher)
+            ok = check_sessions(client) and ok
+            ok = check_admission(client, fake, core) and ok
+    finally:
+        fake.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
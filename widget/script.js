@@ -3,6 +3,11 @@ class ChatWidget {
         this.isMinimized = false;
         this.isTyping = false;
         this.apiEndpoint = 'http://localhost:5000/chat'; // Будет изменено при создании сервера
+        this.prefetchDelay = 400; // мс паузы в наборе до прогрева кэша
+        this.prefetchTimer = null;
+        this.prefetchController = null;
+        this.lastPrefetched = '';
+        this.retryNotBefore = 0; // время (мс), раньше которого сервер просил не повторять запрос
         this.initializeElements();
         this.bindEvents();
         this.setInitialTime();
@@ -40,6 +45,9 @@ class ChatWidget {
             }
         });
 
+        // Прогрев поиска на сервере, пока пациент набирает вопрос
+        this.messageInput.addEventListener('input', () => this.schedulePrefetch());
+
         // События для управления чатом
         this.clearBtn.addEventListener('click', () => this.clearChat());
         this.restartBtn.addEventListener('click', () => this.restartChat());
@@ -78,11 +86,58 @@ class ChatWidget {
         }
     }
 
+    schedulePrefetch() {
+        clearTimeout(this.prefetchTimer);
+        this.prefetchTimer = setTimeout(() => this.prefetch(), this.prefetchDelay);
+    }
+
+    cancelPrefetch() {
+        clearTimeout(this.prefetchTimer);
+        if (this.prefetchController) {
+            this.prefetchController.abort();
+            this.prefetchController = null;
+        }
+    }
+
+    async prefetch() {
+        const text = this.messageInput.value.trim();
+        if (text.length < 6 || text === this.lastPrefetched) return;
+
+        // Предыдущий префикс устарел — отменяем его запрос
+        this.cancelPrefetch();
+        this.prefetchController = new AbortController();
+        this.lastPrefetched = text;
+        try {
+            await fetch(`${this.apiEndpoint}/prefetch`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    message: text,
+                    session_id: this.getSessionId()
+                }),
+                signal: this.prefetchController.signal
+            });
+        } catch (error) {
+            // Прогрев необязателен: ошибки и отмены игнорируем
+        }
+    }
+
     async sendMessage() {
         const message = this.messageInput.value.trim();
         
         if (!message || this.isTyping) return;
 
+        // Сервер перегружен и просил подождать: не отправляем запрос раньше Retry-After
+        const waitSeconds = Math.ceil((this.retryNotBefore - Date.now()) / 1000);
+        if (waitSeconds > 0) {
+            this.addMessage(`Сейчас много обращений. Пожалуйста, повторите вопрос через ${waitSeconds} с.`, 'bot');
+            return;
+        }
+        this.cancelPrefetch();
+        this.lastPrefetched = '';
+
         // Добавляем сообщение пользователя
         this.addMessage(message, 'user');
         this.messageInput.value = '';
@@ -93,14 +148,24 @@ class ChatWidget {
         this.showTypingIndicator();
 
         try {
-            // Отправляем запрос на сервер
-            const response = await this.callChatAPI(message);
+            // Получаем ответ потоком: текст появляется по мере генерации
+            let botText = null;
+            const response = await this.streamChatAPI(message, (partialText) => {
+                if (!botText) {
+                    this.hideTypingIndicator();
+                    botText = this.addMessage('', 'bot');
+                }
+                botText.textContent = partialText;
+                this.scrollToBottom();
+            });
             
             // Скрываем индикатор набора текста
             this.hideTypingIndicator();
             
-            // Добавляем ответ бота
-            this.addMessage(response, 'bot');
+            // Добавляем ответ бота, если он пришел целиком (без потока)
+            if (!botText) {
+                this.addMessage(response, 'bot');
+            }
             
         } catch (error) {
             console.error('Ошибка при отправке сообщения:', error);
@@ -132,6 +197,10 @@ class ChatWidget {
                 })
             });
 
+            if (response.status === 429 || response.status === 503) {
+                return this.busyReply(response);
+            }
+
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -145,6 +214,71 @@ class ChatWidget {
         }
     }
 
+    busyReply(response) {
+        // Retry-After в секундах; без заголовка — 10 с
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 10;
+        this.retryNotBefore = Date.now() + retryAfter * 1000;
+        return `Сейчас много обращений. Пожалуйста, повторите вопрос через ${retryAfter} с.`;
+    }
+
+    async streamChatAPI(message, onText) {
+        // Потоковый endpoint (SSE); при его недоступности — обычный запрос
+        let response;
+        try {
+            response = await fetch(`${this.apiEndpoint}/stream`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    message: message,
+                    session_id: this.getSessionId()
+                })
+            });
+        } catch (error) {
+            return this.callChatAPI(message);
+        }
+
+        // Перегрузка: повторный запрос в /chat только добавил бы нагрузки
+        if (response.status === 429 || response.status === 503) {
+            return this.busyReply(response);
+        }
+
+        if (!response.ok || !response.body) {
+            return this.callChatAPI(message);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                if (!rawEvent.startsWith('data:')) continue;
+
+                const event = JSON.parse(rawEvent.slice(5).trim());
+                if (event.type === 'token') {
+                    text += event.content;
+                    onText(text);
+                } else if (event.type === 'done') {
+                    return event.response;
+                } else if (event.type === 'error') {
+                    throw new Error(event.error);
+                }
+            }
+        }
+
+        return text;
+    }
+
     addMessage(text, sender, isError = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${sender}-message`;
@@ -182,6 +316,7 @@ class ChatWidget {
         
         this.chatMessages.appendChild(messageDiv);
         this.scrollToBottom();
+        return textDiv;
     }
 
     showTypingIndicator() {
@@ -1,19 +1,28 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 from flask_cors import CORS
+import hmac
 import json
 import os
 import sys
+import time
+from collections import deque
 from datetime import datetime
 import uuid
 
+from prefetch import PrefetchScheduler
+from admission import AdmissionRejected
+from session_store import session_store_from_env
+import metrics
+
 # Добавляем путь к текущей директории для импорта модулей
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Импортируем RAG-модули с обработкой ошибок
 try:
-    from rag_chatbot import RAGChatBot
-    from knowledge_base import KnowledgeBase
-    from embedding_api import EmbeddingAPI
+    # Headless-движок без rich/colorama и консольного вывода: быстрый старт воркера
+    from rag_engine import RAGEngine, get_rag_core
+    from llm_pool import get_llm_pool
+    from request_coalescer import get_request_coalescer
     print("✅ RAG-модули успешно импортированы")
     RAG_AVAILABLE = True
 except ImportError as e:
@@ -22,51 +31,83 @@ except ImportError as e:
     RAG_AVAILABLE = False
     
     # Создаем заглушку для демонстрации
-    class RAGChatBot:
-        def __init__(self, use_mock_embeddings=False):
+    def get_rag_core(create=True, **options):
+        return None
+    
+    class RAGEngine:
+        def __init__(self, use_mock_embeddings=False, core=None):
             self.knowledge_base = {"ВОККДЦ": "Всероссийский образовательный центр космонавтики и дополнительного образования детей"}
         
-        def send_message(self, question):
+        def send_message(self, question, lane="widget", deadline=None):
             return f"Я получил ваш вопрос: '{question}'. В реальной системе здесь будет ответ от RAG-системы ВОККДЦ с использованием базы знаний."
+        
+        def stream_message(self, question, lane="widget", deadline=None):
+            yield self.send_message(question)
+        
+        def prefetch(self, partial_message):
+            return False
 
 app = Flask(__name__)
-CORS(app)  # Разрешаем CORS для всех доменов
+CORS(app, expose_headers=["Retry-After"])  # Разрешаем CORS для всех доменов; виджет читает Retry-After
+
+# Прогрев кэшей поиска, пока пациент набирает вопрос. Ядро берется уже в потоке прогрева:
+# в свежем воркере первый прогрев загружает его, не задерживая ответ на /chat/prefetch
+prefetcher = PrefetchScheduler(lambda get_core, text: get_core().prefetch(text))
+
+# Сообщений в истории сессии для /sessions/<id>: старые вытесняются
+SESSION_HISTORY_MESSAGES = int(os.getenv("SESSION_HISTORY_MESSAGES", "50"))
+
+# Ответ должен уложиться в proxy_read_timeout nginx (60 с): после него генерация идет впустую
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "55"))
+
+# Адреса прокси (nginx), которым доверяется заголовок X-Real-IP с адресом клиента
+PROXY_ADDRESSES = {address.strip() for address in os.getenv("PROXY_ADDRESSES", "127.0.0.1,::1").split(",") if address.strip()}
 
-# Хранилище сессий
-sessions = {}
+# Запросы с этим токеном в X-Operator-Token (операторы Битрикс24) обслуживаются раньше виджета
+OPERATOR_TOKEN = os.getenv("VODC_OPERATOR_TOKEN", "")
+
+def shared_core():
+    """Общее ядро RAG воркера: база знаний, эмбеддинги, модели, допуск к генерации
+
+    Создается при первой сессии, уже в процессе воркера (после fork в gunicorn).
+    """
+    return get_rag_core(use_admission=True)
 
 class ChatSession:
     def __init__(self, session_id):
         self.session_id = session_id
         self.created_at = datetime.now()
-        self.messages = []
+        # Кольцевой буфер последних сообщений; история для модели ограничена в движке
+        self.messages = deque(maxlen=SESSION_HISTORY_MESSAGES)
+        self.message_count = 0
         
         # Инициализируем RAG-систему с учетом доступности модулей
         try:
             if RAG_AVAILABLE:
-                # Пытаемся использовать реальную RAG-систему
-                self.rag_bot = RAGChatBot(use_mock_embeddings=False)
+                # У сессии только свой разговор; база знаний и модели — общие для воркера
+                self.rag_bot = RAGEngine(core=shared_core())
                 print(f"✅ RAG-чатбот инициализирован для сессии {session_id}")
             else:
                 # Используем заглушку
-                self.rag_bot = RAGChatBot(use_mock_embeddings=False)
+                self.rag_bot = RAGEngine(use_mock_embeddings=False)
                 print(f"⚠️  Используется заглушка RAG-системы для сессии {session_id}")
         except Exception as e:
             print(f"❌ Ошибка инициализации RAG-системы: {e}")
             # В крайнем случае используем заглушку
-            self.rag_bot = RAGChatBot(use_mock_embeddings=False)
+            self.rag_bot = RAGEngine(use_mock_embeddings=False)
     
     def add_message(self, role, content):
+        self.message_count += 1
         self.messages.append({
             "role": role,
             "content": content,
             "timestamp": datetime.now().isoformat()
         })
     
-    def get_response(self, user_message):
+    def get_response(self, user_message, lane="widget", deadline=None):
         try:
             # Получаем ответ от RAG-чатбота
-            answer = self.rag_bot.send_message(user_message)
+            answer = self.rag_bot.send_message(user_message, lane=lane, deadline=deadline)
             
             # Добавляем сообщения в историю
             self.add_message("user", user_message)
@@ -79,6 +120,8 @@ class ChatSession:
                 "session_id": self.session_id,
                 "rag_available": RAG_AVAILABLE
             }
+        except AdmissionRejected:
+            raise
         except Exception as e:
             print(f"❌ Ошибка в RAG-чатботе: {e}")
             # Возвращаем тестовый ответ в случае ошибки
@@ -94,17 +137,101 @@ class ChatSession:
                 "rag_available": False
             }
 
+    def stream_response(self, user_message, lane="widget", deadline=None):
+        """Ответ RAG-чатбота в виде событий Server-Sent Events
+
+        Если клиент закрыл виджет, сервер закрывает этот генератор при следующей
+        записи, и запрос к LM Studio обрывается вместе с ним.
+        """
+        parts = []
+        try:
+            for delta in self.rag_bot.stream_message(user_message, lane=lane, deadline=deadline):
+                parts.append(delta)
+                yield sse_event({"type": "token", "content": delta})
+            
+            answer = "".join(parts)
+            self.add_message("user", user_message)
+            self.add_message("assistant", answer)
+            
+            yield sse_event({
+                "type": "done",
+                "response": answer,
+                "confidence": 0.85,
+                "sources": ["vodc_complete_info.md"],
+                "session_id": self.session_id,
+                "rag_available": RAG_AVAILABLE
+            })
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка в потоковом ответе RAG-чатбота: {e}")
+            yield sse_event({
+                "type": "error",
+                "error": str(e),
+                "session_id": self.session_id
+            })
+
+def sse_event(data):
+    """Сериализовать событие для text/event-stream"""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def request_lane():
+    """Полоса допуска запроса: operator при верном X-Operator-Token, иначе widget"""
+    token = request.headers.get('X-Operator-Token', '')
+    if OPERATOR_TOKEN and token and hmac.compare_digest(token, OPERATOR_TOKEN):
+        return "operator"
+    return "widget"
+
+def client_address():
+    """Адрес клиента: X-Real-IP от доверенного прокси, иначе адрес соединения"""
+    real_ip = request.headers.get('X-Real-IP')
+    if real_ip and request.remote_addr in PROXY_ADDRESSES:
+        return real_ip.strip()
+    return request.remote_addr or "unknown"
+
+def request_deadline():
+    """Крайний срок ответа (time.monotonic()): X-Request-Timeout от прокси, но не больше REQUEST_TIMEOUT_SECONDS"""
+    timeout = REQUEST_TIMEOUT_SECONDS
+    try:
+        timeout = min(timeout, float(request.headers.get('X-Request-Timeout', timeout)))
+    except ValueError:
+        pass
+    return time.monotonic() + max(timeout, 1.0)
+
+def resume_events(first_event, events):
+    """Поток событий с уже прочитанным первым; закрытие потока закрывает и events
+
+    Flask закрывает генератор ответа при разрыве соединения: close доходит до
+    stream_response и обрывает запрос к LM Studio.
+    """
+    try:
+        if first_event is not None:
+            yield first_event
+            yield from events
+    finally:
+        events.close()
+
+def busy_response(error):
+    """429 с Retry-After: очередь к модели заполнена или ожидание слишком долгое"""
+    response = jsonify({
+        "error": str(error),
+        "status": "busy",
+        "retry_after": error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def forget_session(session_id, session):
+    """Сессия удалена из хранилища по простою или лимиту: сбросить ее прогрев"""
+    prefetcher.forget(session_id)
+
+# Хранилище сессий: простаивающие дольше SESSION_IDLE_TTL и сверх SESSION_MAX удаляются
+sessions = session_store_from_env(ChatSession, on_evict=forget_session)
+
 def get_or_create_session(session_id=None):
     """Получаем или создаем новую сессию"""
-    if session_id and session_id in sessions:
-        return sessions[session_id]
-    
-    # Создаем новую сессию
-    new_session_id = session_id or str(uuid.uuid4())
-    session = ChatSession(new_session_id)
-    sessions[new_session_id] = session
-    
-    return session
+    return sessions.get_or_create(session_id or str(uuid.uuid4()))
 
 @app.route('/')
 def index():
@@ -317,12 +444,15 @@ def chat():
         
         # Получаем или создаем сессию
         session = get_or_create_session(session_id)
+        prefetcher.settle(session.session_id, user_message)
         
         # Получаем ответ от RAG-системы
-        result = session.get_response(user_message)
+        result = session.get_response(user_message, lane=request_lane(), deadline=request_deadline())
         
         return jsonify(result)
         
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
         print(f"Ошибка в API: {e}")
         return jsonify({
@@ -331,26 +461,124 @@ def chat():
             "status": "error"
         }), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """API endpoint для чата с потоковой выдачей токенов (SSE)"""
+    data = request.get_json(silent=True)
+    
+    if not data or 'message' not in data:
+        return jsonify({
+            "error": "Необходимо указать сообщение",
+            "status": "error"
+        }), 400
+    
+    user_message = data['message'].strip()
+    if not user_message:
+        return jsonify({
+            "error": "Сообщение не может быть пустым",
+            "status": "error"
+        }), 400
+    
+    session = get_or_create_session(data.get('session_id'))
+    prefetcher.settle(session.session_id, user_message)
+    
+    # Ожидание допуска и первая часть ответа — до заголовков, чтобы отказ стал ответом 429
+    events = session.stream_response(user_message, lane=request_lane(), deadline=request_deadline())
+    try:
+        first_event = next(events, None)
+    except AdmissionRejected as e:
+        return busy_response(e)
+    
+    return Response(
+        stream_with_context(resume_events(first_event, events)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # nginx не должен буферизовать поток
+        }
+    )
+
+@app.route('/chat/prefetch', methods=['POST'])
+def chat_prefetch():
+    """Прогрев кэша эмбеддинга и поиска по частично набранному вопросу (вызывается виджетом с задержкой)"""
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('message'), str) or not data.get('session_id'):
+        return jsonify({
+            "error": "Необходимо указать сообщение и session_id",
+            "status": "error"
+        }), 400
+    
+    # Кэши поиска общие для воркера, поэтому прогрев не создает сессию (иначе поток префиксов
+    # вытеснял бы настоящие разговоры) и работает для первого вопроса, пока сессии еще нет
+    if not RAG_AVAILABLE:
+        return jsonify({"status": "skipped"}), 202
+    status = prefetcher.submit(str(data['session_id'])[:128], shared_core, data['message'][:500],
+                               client=client_address())
+    if prefetcher.stats["requests"] % 256 == 0:
+        prefetcher.sweep()
+    
+    # 202: прогрев идет в фоне; 429: слишком частые запросы или очередь прогрева заполнена,
+    # клиент просто пропускает префикс
+    return jsonify({"status": status}), 429 if status in ("throttled", "dropped") else 202
+
 @app.route('/health')
 def health_check():
     """Проверка состояния сервера"""
+    # Проверка не создает ядро: база знаний загружается с первой сессией
+    core = get_rag_core(create=False)
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "active_sessions": len(sessions),
-        "rag_system": "available"
+        "sessions": sessions.get_stats(),
+        "memory": metrics.process_memory(),
+        "rag_system": "available",
+        "knowledge_base_chunks": len(core.knowledge_base.vector_store.documents) if core is not None else None,
+        "prefetch": prefetcher.get_stats(),
+        "llm_backends": get_llm_pool().get_stats() if RAG_AVAILABLE else None,
+        "coalescing": get_request_coalescer().get_stats() if RAG_AVAILABLE else None,
+        "admission": core.admission.get_stats() if core is not None else None
     })
 
+def update_metrics_gauges():
+    """Текущие размеры сессий, кэшей и базы знаний этого воркера для /metrics"""
+    core = get_rag_core(create=False)
+    if core is None:
+        metrics.set_gauges(sessions=len(sessions))
+        return
+    # Кэши и база знаний общие для всех сессий воркера
+    caches = {
+        "query_embeddings": len(core.knowledge_base.cache.embeddings),
+        "search_results": len(core.knowledge_base.cache.results),
+        "semantic_answers": len(core.semantic_cache)
+    }
+    metrics.set_gauges(sessions=len(sessions), caches=caches,
+                       kb_chunks=len(core.knowledge_base.vector_store.documents))
+
+@app.after_request
+def refresh_metrics_gauges(response):
+    # Под gunicorn /metrics обслуживает один воркер: остальные обновляют гейджи после своих запросов
+    if request.path.startswith('/chat'):
+        update_metrics_gauges()
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики Prometheus: длительность этапов, TTFT, скорость генерации, сессии и кэши"""
+    update_metrics_gauges()
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
+
 @app.route('/sessions/<session_id>')
 def get_session_history(session_id):
     """Получение истории сессии"""
-    if session_id in sessions:
-        session = sessions[session_id]
+    session = sessions.get(session_id)
+    if session is not None:
         return jsonify({
             "session_id": session_id,
             "created_at": session.created_at.isoformat(),
-            "messages": session.messages,
-            "message_count": len(session.messages)
+            "messages": list(session.messages),
+            "message_count": session.message_count
         })
     else:
         return jsonify({
@@ -365,6 +593,9 @@ if __name__ == '__main__':
     print(f"   - Jivo-виджет: http://localhost:5000/jivo (рекомендуется)")
     print(f"   - Классический виджет: http://localhost:5000/widget")
     print(f"   - API чата: http://localhost:5000/chat")
+    print(f"   - Потоковый API чата (SSE): http://localhost:5000/chat/stream")
+    print(f"   - Метрики Prometheus: http://localhost:5000/metrics")
+    print(f"   - Прогрев кэша по набираемому вопросу: http://localhost:5000/chat/prefetch")
     print(f"   - Проверка состояния: http://localhost:5000/health")
     print()
     print("📝 Для интеграции с Битрикс24 используйте URL: http://localhost:5000/chat")